@@ -0,0 +1,143 @@
+# benchmarks/lobby_contention.py
+# 量測大量玩家同時 JOIN_ROOM / LEAVE_ROOM 時 lobby 的吞吐量與延遲 (不啟動 Game Server)
+#
+#   python benchmarks/lobby_contention.py -c 500 -n 20 --rooms 20
+#   python benchmarks/lobby_contention.py -c 500 -n 20 --rooms 20 --mode global-lock   (模擬舊的做法，對照用)
+#
+# global-lock 模式重現舊的 JOIN_ROOM：整個 lobby 一把 lock，而且在 lock 裡同步寫 play_history 並 commit。
+# 兩種模式都用暫存的 DB，不會動到正式資料。
+
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.append(project_root)
+
+# 假房間不要寫進正式的 room journal (重啟時會被當成真的房間接管)
+import tempfile
+os.environ.setdefault("LOBBY_JOURNAL", os.path.join(tempfile.gettempdir(), f"bench_journal_{os.getpid()}.log"))
+os.environ.setdefault("LOBBY_DB", os.path.join(tempfile.gettempdir(), f"bench_db_{os.getpid()}.sqlite3"))
+
+from common.protocol import Protocol
+from server.services import lobby
+from server.services.rooms import Room
+from server.services.db import db_instance
+
+BASE_PORT = 40000
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def make_rooms(count):
+    """直接放進 registry 的假房間；每間留一個 keeper，房間不會因為沒人而關掉"""
+    created = []
+    for i in range(count):
+        rid = lobby.rooms.next_id()
+        room = Room(rid, "bench", "Bench", BASE_PORT + i, "keeper", None, "1.0", None)
+        room.players["keeper"] = 0
+        lobby.rooms.add(room)
+        created.append(rid)
+    return created
+
+
+def client(idx, room_ids, ops, list_every, big_lock, barrier, join_lat, leave_lat, errors):
+    username = f"bench{idx}"
+    rng = random.Random(idx)
+    joins, leaves = [], []
+    failed = 0
+    barrier.wait()
+    for i in range(ops):
+        rid = rng.choice(room_ids)
+
+        t0 = time.perf_counter()
+        if big_lock:
+            with big_lock:
+                res = lobby.handle_join_room(rid, idx, username)
+                if res["status"] == Protocol.STATUS_OK:
+                    # 舊的 JOIN_ROOM 在 lock 裡同步 INSERT + commit
+                    db_instance.add_play_history(idx, "bench")
+        else:
+            res = lobby.handle_join_room(rid, idx, username)
+        joins.append(time.perf_counter() - t0)
+        if res["status"] != Protocol.STATUS_OK:
+            failed += 1
+            continue
+
+        if list_every and i % list_every == 0:
+            lobby.handle_list_rooms()
+
+        t0 = time.perf_counter()
+        if big_lock:
+            with big_lock:
+                res = lobby.handle_leave_room(rid, username)
+        else:
+            res = lobby.handle_leave_room(rid, username)
+        leaves.append(time.perf_counter() - t0)
+        if res["status"] != Protocol.STATUS_OK:
+            failed += 1
+
+    join_lat.extend(joins)
+    leave_lat.extend(leaves)
+    errors.append(failed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--clients", type=int, default=500)
+    parser.add_argument("-n", "--ops", type=int, default=20, help="每個 client 的 join/leave 次數")
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--list-every", type=int, default=5, help="每幾次 join 順便 LIST_ROOMS 一次 (0 = 不查)")
+    parser.add_argument("--mode", choices=["lobby", "global-lock"], default="lobby")
+    args = parser.parse_args()
+
+    # 500 個 thread 同時搶 GIL，切換間隔調小一點比較接近真實的交錯
+    sys.setswitchinterval(0.0005)
+
+    room_ids = make_rooms(args.rooms)
+    big_lock = threading.Lock() if args.mode == "global-lock" else None
+    barrier = threading.Barrier(args.clients + 1)
+    join_lat, leave_lat, errors = [], [], []
+
+    threads = [threading.Thread(target=client, args=(i + 1, room_ids, args.ops, args.list_every, big_lock,
+                                                     barrier, join_lat, leave_lat, errors))
+               for i in range(args.clients)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    t0 = time.monotonic()
+    for t in threads:
+        t.join()
+    total = time.monotonic() - t0
+
+    for rid in room_ids:
+        lobby.rooms.remove(rid)
+    db_instance.conn.close()
+    for path in (os.environ["LOBBY_DB"], os.environ["LOBBY_JOURNAL"]):
+        if os.path.basename(path).startswith("bench_"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    ops = len(join_lat) + len(leave_lat)
+    print("=" * 50)
+    print(f"mode={args.mode} clients={args.clients} ops/client={args.ops} rooms={args.rooms}")
+    print(f"total={total:.2f}s ops={ops} failed={sum(errors)}")
+    print(f"throughput: {ops / total:.0f} ops/sec")
+    for name, lat in (("join", join_lat), ("leave", leave_lat)):
+        print(f"{name:<5} p50={percentile(lat, 0.5) * 1e6:.0f}us p95={percentile(lat, 0.95) * 1e6:.0f}us "
+              f"p99={percentile(lat, 0.99) * 1e6:.0f}us max={max(lat or [0]) * 1e6:.0f}us")
+
+
+if __name__ == "__main__":
+    main()
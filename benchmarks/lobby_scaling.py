@@ -0,0 +1,180 @@
+# benchmarks/lobby_scaling.py
+# 量測 server/main.py 在不同 worker 數 (--workers N, SO_REUSEPORT) 下的吞吐量
+# 每個 client 登入後一直送 LIST_GAMES / LIST_ROOMS / GET_REVIEWS，用暫存的 DB，不會動到正式資料
+#
+#   python benchmarks/lobby_scaling.py --workers 1,2,4 -c 64 --seconds 10
+#
+# client 端也是多 process (不然量到的是 client 自己的 GIL)；核心數不夠時 worker 多反而會互搶 CPU。
+
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.append(project_root)
+
+from common.utils import send_json, recv_json
+from common.protocol import Protocol
+
+HOST = "127.0.0.1"
+GAMES = 30
+REVIEWS_PER_GAME = 20
+OPS = (
+    {"cmd": Protocol.CMD_LIST_GAMES},
+    {"cmd": Protocol.CMD_LIST_ROOMS},
+    {"cmd": Protocol.CMD_GET_REVIEWS, "game_id": "1"},
+)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def seed_db(path, users):
+    """在暫存 DB 建好玩家、遊戲與評論 (只有資料列，不需要 ZIP 檔)"""
+    os.environ["LOBBY_DB"] = path
+    from server.services.db import Database
+    db = Database()
+    db.register_user("bench_dev", "p", "dev")
+    for i in range(users):
+        db.register_user(f"bench{i}", "p", "player")
+    for g in range(GAMES):
+        db.add_game(f"Game{g}", "1.0", 1, "benchmark game " * 8, f"Game{g}_1.0.zip")
+        for r in range(REVIEWS_PER_GAME):
+            db.add_review(2 + r % users, g + 1, 1 + r % 5, "nice " * 10)
+    db.conn.close()
+
+
+def start_server(port, workers, tmp):
+    env = dict(os.environ,
+               LOBBY_PORT=str(port),
+               LOBBY_DB=os.path.join(tmp, "bench.sqlite3"),
+               LOBBY_JOURNAL=os.path.join(tmp, "journal.log"),
+               LOBBY_STATE_SOCKET=os.path.join(tmp, f"state-{port}.sock"),
+               # 量的是吞吐量，關掉每條連線的頻率限制
+               LOBBY_RATE_CATALOG="0", LOBBY_RATE_INTERACTIVE="0")
+    proc = subprocess.Popen([sys.executable, os.path.join(project_root, "server", "main.py"),
+                             "--workers", str(workers)],
+                            cwd=project_root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((HOST, port), timeout=0.5).close()
+            # 多 worker 時等每個 worker 都起來
+            time.sleep(0.5 * workers)
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+
+def stop_server(proc):
+    proc.send_signal(signal.SIGINT)
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def client_thread(port, user, deadline, results):
+    lat = []
+    errors = 0
+    try:
+        s = socket.create_connection((HOST, port))
+        send_json(s, {"cmd": Protocol.CMD_LOGIN_PLAYER, "username": user, "password": "p"})
+        if (recv_json(s) or {}).get("status") != Protocol.STATUS_OK:
+            errors += 1
+        i = 0
+        while time.monotonic() < deadline:
+            t0 = time.perf_counter()
+            send_json(s, OPS[i % len(OPS)])
+            res = recv_json(s)
+            lat.append(time.perf_counter() - t0)
+            if not res or res.get("status") != Protocol.STATUS_OK:
+                errors += 1
+            i += 1
+        s.close()
+    except OSError:
+        errors += 1
+    results.append((lat, errors))
+
+
+def client_process(port, users, start_at, seconds, queue):
+    """一個 client process 開多個連線 (thread)，時間到回傳所有延遲"""
+    while time.time() < start_at:
+        time.sleep(0.01)
+    deadline = time.monotonic() + seconds
+    results = []
+    threads = [threading.Thread(target=client_thread, args=(port, u, deadline, results)) for u in users]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    lat = [x for r in results for x in r[0]]
+    queue.put((lat, sum(r[1] for r in results)))
+
+
+def run(port, workers, clients, procs, seconds, tmp):
+    server = start_server(port, workers, tmp)
+    try:
+        queue = multiprocessing.Queue()
+        start_at = time.time() + 1
+        users = [f"bench{i}" for i in range(clients)]
+        ps = [multiprocessing.Process(target=client_process,
+                                      args=(port, users[i::procs], start_at, seconds, queue))
+              for i in range(procs)]
+        for p in ps:
+            p.start()
+        lat, errors = [], 0
+        for _ in ps:
+            l, e = queue.get()
+            lat.extend(l)
+            errors += e
+        for p in ps:
+            p.join()
+    finally:
+        stop_server(server)
+    return len(lat) / seconds, lat, errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default="1,2,4", help="要比較的 worker 數，逗號分隔")
+    parser.add_argument("-c", "--clients", type=int, default=64)
+    parser.add_argument("--client-procs", type=int, default=max(1, min(8, os.cpu_count() or 1)))
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--port", type=int, default=30900)
+    args = parser.parse_args()
+
+    counts = [int(x) for x in args.workers.split(",")]
+    with tempfile.TemporaryDirectory() as tmp:
+        seed_db(os.path.join(tmp, "bench.sqlite3"), args.clients)
+        rows = []
+        for n, workers in enumerate(counts):
+            # 每輪換一個 port，避免上一輪的 TIME_WAIT
+            ops, lat, errors = run(args.port + n, workers, args.clients, args.client_procs, args.seconds, tmp)
+            rows.append((workers, ops, lat, errors))
+
+    base = rows[0][1] or 1
+    print("=" * 64)
+    print(f"cpus={os.cpu_count()} clients={args.clients} client_procs={args.client_procs} seconds={args.seconds}")
+    print(f"{'workers':>7} {'ops/sec':>10} {'speedup':>8} {'p50':>9} {'p99':>9} {'errors':>7}")
+    for workers, ops, lat, errors in rows:
+        print(f"{workers:>7} {ops:>10.0f} {ops / base:>7.2f}x {percentile(lat, 0.5) * 1e3:>7.2f}ms "
+              f"{percentile(lat, 0.99) * 1e3:>7.2f}ms {errors:>7}")
+
+
+if __name__ == "__main__":
+    main()
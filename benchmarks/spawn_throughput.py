@@ -0,0 +1,89 @@
+# benchmarks/spawn_throughput.py
+# 量測 Game Server 的啟動吞吐量 (rooms/sec) 與 spawn -> ready 延遲
+#
+#   python benchmarks/spawn_throughput.py -n 50 -c 4
+#   python benchmarks/spawn_throughput.py -n 50 -c 4 --mode shell   (舊的 shell=True 做法，對照用)
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.append(project_root)
+
+from server.services import spawner
+from server.services.ports import PortPool
+
+DEFAULT_GAME_DIR = os.path.join(project_root, "client_dev", "my_games_source", "snakes")
+
+
+def spawn_one(mode, config, run_dir, port):
+    start = time.monotonic()
+    if mode == "shell":
+        cmd = config["server_cmd"].replace("{port}", str(port))
+        process = subprocess.Popen(cmd, shell=True, cwd=run_dir, start_new_session=True,
+                                   stdout=subprocess.DEVNULL)
+        process.spawned_at = start
+        process.ready_event = None
+    else:
+        process = spawner.spawn_game_server(config, run_dir, port)
+    ready, info = spawner.wait_until_ready(process, port)
+    return process, ready, time.monotonic() - start, info
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--rooms", type=int, default=30)
+    parser.add_argument("-c", "--concurrency", type=int, default=1)
+    parser.add_argument("--mode", choices=["argv", "shell"], default="argv")
+    parser.add_argument("--game-dir", default=DEFAULT_GAME_DIR)
+    parser.add_argument("--port-start", type=int, default=22000)
+    args = parser.parse_args()
+
+    config = spawner.load_game_config(args.game_dir)
+    pool = PortPool(args.port_start, args.port_start + args.rooms + 50, quarantine=0)
+    ports = [pool.lease() for _ in range(args.rooms)]
+    if None in ports:
+        print("Not enough free ports.")
+        return
+
+    processes = []
+    latencies = []
+    failures = 0
+    t0 = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+        futures = [ex.submit(spawn_one, args.mode, config, args.game_dir, port) for port in ports]
+        for fut in futures:
+            process, ready, elapsed, info = fut.result()
+            processes.append(process)
+            if ready:
+                latencies.append(elapsed)
+            else:
+                failures += 1
+                print(f"[!] {info}")
+    total = time.monotonic() - t0
+
+    for process in processes:
+        spawner.kill_process(process)
+
+    print("=" * 50)
+    print(f"mode={args.mode} rooms={args.rooms} concurrency={args.concurrency}")
+    print(f"ready={len(latencies)} failed={failures} total={total:.2f}s")
+    print(f"throughput: {len(latencies) / total:.1f} rooms/sec")
+    print(f"spawn->ready p50={percentile(latencies, 0.5) * 1000:.0f}ms "
+          f"p95={percentile(latencies, 0.95) * 1000:.0f}ms max={max(latencies or [0]) * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
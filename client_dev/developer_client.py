@@ -4,23 +4,26 @@ import socket
 import sys
 import os
 import threading
+import time
 import queue
 import json
 import shutil
 import base64
-import zipfile 
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(current_dir) 
 sys.path.append(project_root)
 
-from common.utils import send_json, recv_json
+from common.utils import send_json, recv_json, Heartbeat, set_keepalive
 from common.protocol import Protocol
+import packager
 
 
 # Host & Port -> connects to server
 HOST = '140.113.17.11'
 PORT = 30800
+# 上傳要等多久：Server 可能先排隊 (最多 LOBBY_TRANSFER_WAIT 秒) 才開始處理
+TRANSFER_TIMEOUT = 120
 
 class DeveloperClient:
     def __init__(self):
@@ -29,11 +32,17 @@ class DeveloperClient:
         self.user_token = None
         self.username = None
         self.msg_queue = queue.Queue()
+        self.send_lock = threading.Lock()  # 心跳 thread 也會寫 socket
+        self.seq = 0  # 每個請求的編號，Server 原樣帶回；用來丟掉逾時後才到的舊回覆
+        self.heartbeat = None
 
     def connect(self):
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.connect((HOST, PORT))
+            set_keepalive(self.sock)
+            self.heartbeat = Heartbeat(self.sock, self.send_lock)
+            self.heartbeat.start()
             threading.Thread(target=self.listen_to_server, daemon=True).start()
             return True
         except: return False
@@ -42,14 +51,24 @@ class DeveloperClient:
         while self.is_running:
             try:
                 msg = recv_json(self.sock)
-                if msg: self.msg_queue.put(msg)
-                else: break
+                if not msg: break
+                self.heartbeat.touch()
+                if msg.get("cmd") != Protocol.CMD_PONG: self.msg_queue.put(msg)
             except: break
         self.is_running = False
 
+    def send(self, req):
+        with self.send_lock:
+            self.seq += 1
+            return send_json(self.sock, dict(req, seq=self.seq))
+
     def get_response(self, timeout=5):
-        try: return self.msg_queue.get(timeout=timeout)
-        except queue.Empty: return None
+        # 之前逾時的請求後來才到的回覆直接丟掉
+        deadline = time.monotonic() + timeout
+        while True:
+            try: msg = self.msg_queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty: return None
+            if msg.get("seq", self.seq) == self.seq: return msg
 
     def start(self):
         if not self.connect(): return
@@ -59,6 +78,7 @@ class DeveloperClient:
                 else: self.login_menu()
         except: pass
         finally: 
+            if self.heartbeat: self.heartbeat.stop()
             if self.sock: self.sock.close()
 
     # Basic func
@@ -81,17 +101,18 @@ class DeveloperClient:
 
     def do_register(self):
         u, p = input("User: "), input("Pass: ")
-        send_json(self.sock, {"cmd": Protocol.CMD_REGISTER, "username": u, "password": p, "role": "dev"})
+        self.send({"cmd": Protocol.CMD_REGISTER, "username": u, "password": p, "role": "dev"})
         res = self.get_response()
         if res: print(res.get('message'))
 
     def do_login(self):
         u, p = input("User: "), input("Pass: ")
-        send_json(self.sock, {"cmd": Protocol.CMD_LOGIN_DEV, "username": u, "password": p})
+        self.send({"cmd": Protocol.CMD_LOGIN_DEV, "username": u, "password": p})
         res = self.get_response()
         if res and res.get("status") == "OK":
             self.user_token = res["user_id"]
             self.username = res["username"]
+            self.heartbeat.interval = res.get("heartbeat_interval", self.heartbeat.interval)
         else: print(f"Login Failed: {res.get('message') if res else 'Timeout'}")
 
     # D1: upload games
@@ -158,28 +179,12 @@ class DeveloperClient:
             return
 
         try:
-            # 1. 壓縮 (手動過濾垃圾檔案，這是解決卡住的關鍵！)
+            # 1. 壓縮 (手動過濾垃圾檔案 + 增量快取，沒改過的檔案不重新壓縮)
             print("Zipping files (excluding .git, venv, __pycache__)...")
             zip_filename = os.path.join(current_dir, "temp_upload.zip")
-            
-            # 定義要排除的目錄名
-            EXCLUDE_DIRS = {'.git', '__pycache__', 'venv', 'env', '.idea', '.vscode', 'node_modules', 'bin', 'obj'}
-            # 定義要排除的副檔名或檔名
-            EXCLUDE_FILES = {'.DS_Store', 'db.sqlite3', 'Thumbs.db'}
-            
-            with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk(target_folder_path):
-                    # 修改 dirs 列表以排除不需要的資料夾 (這樣 os.walk 就不會進去)
-                    dirs[:] = [d for d in dirs if d not in EXCLUDE_DIRS]
-                    
-                    for file in files:
-                        if file in EXCLUDE_FILES or file.endswith('.pyc'):
-                            continue
-                        
-                        abs_path = os.path.join(root, file)
-                        # 計算相對路徑，確保 zip 內部結構正確 (去除絕對路徑資訊)
-                        rel_path = os.path.relpath(abs_path, target_folder_path)
-                        zipf.write(abs_path, rel_path)
+
+            stats = packager.build_zip(target_folder_path, zip_filename)
+            print(f"Packed {stats['files']} files ({stats['reused']} cached, {stats['compressed']} compressed).")
             
             # 檢查大小
             size_mb = os.path.getsize(zip_filename) / (1024 * 1024)
@@ -207,15 +212,16 @@ class DeveloperClient:
             }
             
             print("Sending to server (please wait)...")
-            send_json(self.sock, req)
+            self.send(req)
             
-            # 4. 等待回應 (Timeout 加大到 60 秒)
+            # 4. 等待回應 (可能要排隊)
             print("Waiting for server response...")
-            res = self.get_response(timeout=10)
+            res = self.get_response(timeout=TRANSFER_TIMEOUT)
             
             if res:
                 if res.get("status") == "OK":
                     print(f"✅ Success: {res.get('message')}")
+                    print("   (Check 'List My Games' for the validation result.)")
                 else:
                     print(f"❌ Failed: {res.get('message')}")
             else:
@@ -231,10 +237,15 @@ class DeveloperClient:
 
     # D2: unpublish games
     def do_list_and_manage_games(self):
-        send_json(self.sock, {"cmd": Protocol.CMD_LIST_MY_GAMES})
+        self.send({"cmd": Protocol.CMD_LIST_MY_GAMES})
         res = self.get_response()
         if not res or res.get("status") != "OK": return
         
+        # 背景驗證中 / 失敗的上傳
+        for u in res.get("uploads", []):
+            if u['state'] != 'published':
+                print(f"[Upload] {u['game_name']} v{u['version']}: {u['state']} {u['message']}")
+
         games = res.get("games", [])
         if not games: 
             print("No games.")
@@ -245,7 +256,7 @@ class DeveloperClient:
         
         gid = input("Unpublish ID (0 cancel): ").strip()
         if gid and gid != '0':
-            send_json(self.sock, {"cmd": Protocol.CMD_UNPUBLISH_GAME, "game_id": gid})
+            self.send({"cmd": Protocol.CMD_UNPUBLISH_GAME, "game_id": gid})
             res = self.get_response()
             if res: print(res.get('message'))
 
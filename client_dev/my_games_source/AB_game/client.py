@@ -2,10 +2,12 @@ import socket
 import threading
 import sys
 import argparse
+import json
 
 class BullsAndCowsClient:
-    def __init__(self, host, port):
+    def __init__(self, host, port, token=""):
         self.server_addr = (host, port)
+        self.token = token
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.running = True
 
@@ -27,6 +29,9 @@ class BullsAndCowsClient:
     def start(self):
         try:
             self.sock.connect(self.server_addr)
+            # 多房間模式：先告訴 Server 要進哪個房間
+            if self.token:
+                self.sock.sendall(json.dumps({"token": self.token}).encode('utf-8') + b'\n')
             # print("=== 已連線 ===") # 讓 Server 的歡迎訊息來顯示就好
             
             recv_thread = threading.Thread(target=self.receive_messages)
@@ -56,7 +61,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-ip", "--ip", type=str, default="127.0.0.1")
     parser.add_argument("-p", "--port", type=int, default=9000)
+    parser.add_argument("-t", "--token", type=str, default="")
     args = parser.parse_args()
 
-    client = BullsAndCowsClient(args.ip, args.port)
+    client = BullsAndCowsClient(args.ip, args.port, args.token)
     client.start()
\ No newline at end of file
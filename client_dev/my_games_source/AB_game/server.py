@@ -2,22 +2,73 @@ import socket
 import threading
 import time
 import argparse
+import json
+import os
 
-class PvPGameServer:
-    def __init__(self, host='0.0.0.0', port=9000):
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server.bind((host, port))
-        self.server.listen(2)
-        
+class LobbyReporter:
+    """
+    把房間狀態回報給 Lobby (Unix datagram，路徑在環境變數 LOBBY_REPORT_SOCKET)。
+    不是 Lobby 開的 (沒有這個變數) 就什麼都不做；送不到也不影響遊戲。
+    """
+    def __init__(self, port):
+        self.port = port
+        self.path = os.environ.get("LOBBY_REPORT_SOCKET")
+        self.interval = float(os.environ.get("LOBBY_REPORT_INTERVAL", 2))
+        self.sock = None
+        if self.path and hasattr(socket, "AF_UNIX"):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def send(self, players, state, room=None, tick_rate=None):
+        if self.sock is None:
+            return
+        msg = {"port": self.port, "players": players, "state": state}
+        if room is not None:
+            msg["room"] = room
+        if tick_rate is not None:
+            msg["tick_rate"] = round(tick_rate, 2)
+        try:
+            self.sock.sendto(json.dumps(msg).encode(), self.path)
+        except OSError:
+            pass
+
+
+class PvPMatch:
+    """一場 1v1 對戰的狀態 (單房間模式只有一場，多房間模式每個房間一場)"""
+    def __init__(self, reporter=None, room=None):
         self.clients = []      # [conn1, conn2]
         self.secrets = {}      # {conn: "1234"}
         self.player_ids = {}   # {conn: 1}
         self.lock = threading.Lock()
         self.game_started = False
         self.turn_index = 0    # 0 or 1
+        self.reporter = reporter
+        self.room = room       # 多房間模式的 room_id
+        self.state = "waiting" # waiting -> playing -> finished
+
+    def report(self):
+        if self.reporter:
+            # 對戰結束後連線會被關掉 (fileno = -1)，不算在線
+            players = sum(1 for c in self.clients if c.fileno() != -1)
+            self.reporter.send(players, self.state, self.room)
+
+    def add_player(self, conn, addr):
+        pid = len(self.clients) + 1
+        self.clients.append(conn)
+        self.player_ids[conn] = pid
+        print(f"Player {pid} ({addr}) joined.")
+        self.send_to(conn, f"歡迎！你是 Player {pid}。等待另一位玩家...\n")
+        self.report()
+        return pid
+
+    def run(self):
+        self.state = "playing"
+        self.report()
+        self.handle_setup_phase()
         
-        print(f"PvP 1A2B Server started on {port}")
+        # 遊戲結束，清理連線
+        for c in self.clients: c.close()
+        self.state = "finished"
+        self.report()
 
     def broadcast(self, msg, exclude=None):
         """廣播訊息給所有人 (可排除某人)"""
@@ -127,24 +178,145 @@ class PvPGameServer:
                 print(e)
                 break
 
+
+class PvPGameServer:
+    """單房間模式：一個 process 一場對戰，結束就關閉"""
+    def __init__(self, host='0.0.0.0', port=9000):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(2)
+        self.reporter = LobbyReporter(port)
+        self.match = PvPMatch(self.reporter)
+        
+        print(f"PvP 1A2B Server started on {port}")
+
+    def report_loop(self):
+        while True:
+            self.match.report()
+            time.sleep(self.reporter.interval)
+
     def start(self):
         print("等待玩家加入 (需 2 人)...")
-        while len(self.clients) < 2:
+        threading.Thread(target=self.report_loop, daemon=True).start()
+        while len(self.match.clients) < 2:
             conn, addr = self.server.accept()
-            pid = len(self.clients) + 1
-            self.clients.append(conn)
-            self.player_ids[conn] = pid
-            print(f"Player {pid} ({addr}) joined.")
-            self.send_to(conn, f"歡迎！你是 Player {pid}。等待另一位玩家...\n")
+            self.match.add_player(conn, addr)
 
-        self.handle_setup_phase()
-        
-        # 遊戲結束，清理連線
-        for c in self.clients: c.close()
+        self.match.run()
+
+
+class MultiRoomServer:
+    """
+    多房間模式 (game_config.json 的 multi_room)：所有房間共用一個 port。
+    Lobby 從 control (Unix socket) 送 open/close/ping；玩家連上後第一行送 {"token": ...}
+    """
+    def __init__(self, control_path, host='0.0.0.0', port=9000):
+        self.matches = {}  # token -> PvPMatch
+        self.tokens = {}   # room_id -> token
+        self.lock = threading.Lock()
+
+        # 控制通道先準備好，port 開始 listen 時 Lobby 就能下指令
+        if os.path.exists(control_path):
+            os.unlink(control_path)
+        self.control = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.control.bind(control_path)
+        self.control.listen()
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen()
+        self.reporter = LobbyReporter(port)
+        print(f"PvP 1A2B Multi-room Server started on {port}")
+
+    def handle_command(self, cmd):
+        op = cmd.get('op')
+        with self.lock:
+            if op == 'open':
+                self.matches[cmd['token']] = PvPMatch(self.reporter, cmd['room'])
+                self.tokens[cmd['room']] = cmd['token']
+                print(f"Room {cmd['room']} opened.")
+            elif op == 'close':
+                token = self.tokens.pop(cmd.get('room'), None)
+                match = self.matches.pop(token, None)
+                if match:
+                    # shutdown 才會叫醒卡在 recv 的對戰執行緒
+                    for c in match.clients:
+                        try: c.shutdown(socket.SHUT_RDWR)
+                        except: pass
+                    print(f"Room {cmd['room']} closed.")
+            elif op != 'ping':
+                return {"ok": False, "error": f"unknown op {op}"}
+            # 對戰結束後連線會被關掉 (fileno = -1)，不算在線
+            players = {rid: sum(1 for c in self.matches[token].clients if c.fileno() != -1)
+                       for rid, token in self.tokens.items()}
+            return {"ok": True, "rooms": len(self.matches), "players": players}
+
+    def control_loop(self):
+        while True:
+            conn, _ = self.control.accept()
+            with conn:
+                try:
+                    line = conn.makefile('r').readline()
+                    reply = self.handle_command(json.loads(line))
+                except Exception as e:
+                    reply = {"ok": False, "error": str(e)}
+                try:
+                    conn.sendall(json.dumps(reply).encode() + b'\n')
+                except OSError:
+                    pass
+
+    def report_loop(self):
+        while True:
+            time.sleep(self.reporter.interval)
+            with self.lock:
+                matches = list(self.matches.values())
+            for match in matches:
+                match.report()
+
+    def handshake(self, conn, addr):
+        """讀第一行的 token，找到房間後加入；湊滿 2 人就開打"""
+        try:
+            conn.settimeout(5)
+            data = b''
+            while b'\n' not in data:
+                chunk = conn.recv(1024)
+                if not chunk: break
+                data += chunk
+            conn.settimeout(None)
+            token = json.loads(data.split(b'\n', 1)[0].decode()).get('token')
+        except Exception:
+            token = None
+
+        with self.lock:
+            match = self.matches.get(token)
+            full = match is not None and len(match.clients) >= 2
+            if match and not full:
+                match.add_player(conn, addr)
+                ready = len(match.clients) == 2
+        if match is None or full:
+            try: conn.sendall("❌ 房間不存在或已滿。\n".encode('utf-8'))
+            except: pass
+            conn.close()
+            return
+        if ready:
+            threading.Thread(target=match.run, daemon=True).start()
+
+    def start(self):
+        threading.Thread(target=self.control_loop, daemon=True).start()
+        threading.Thread(target=self.report_loop, daemon=True).start()
+        while True:
+            conn, addr = self.server.accept()
+            threading.Thread(target=self.handshake, args=(conn, addr), daemon=True).start()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-p", "--port", type=int, default=9000)
+    parser.add_argument("--control", type=str, default="", help="多房間模式的控制通道 (Unix socket 路徑)")
     args = parser.parse_args()
     
-    PvPGameServer(port=args.port).start()
\ No newline at end of file
+    if args.control:
+        MultiRoomServer(args.control, port=args.port).start()
+    else:
+        PvPGameServer(port=args.port).start()
\ No newline at end of file
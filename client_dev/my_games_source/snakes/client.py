@@ -13,8 +13,9 @@ GREEN = (0, 255, 0)
 GRID_SIZE = 20
 
 class GameClient:
-    def __init__(self, host='127.0.0.1', port=9000):
+    def __init__(self, host='127.0.0.1', port=9000, token=""):
         self.server_addr = (host, port)
+        self.token = token
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.game_state = {'snakes': [], 'food': [0,0]}
         self.my_id = -1
@@ -31,6 +32,9 @@ class GameClient:
         try:
             self.sock.connect(self.server_addr)
             print("Connected!")
+            # 多房間模式：先告訴 Server 要進哪個房間
+            if self.token:
+                self.sock.sendall(json.dumps({"token": self.token}).encode() + b'\n')
             
             # Handshake
             data = self.sock.recv(1024).decode()
@@ -152,5 +156,6 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-ip", "--ip", type=str, default="127.0.0.1")
     parser.add_argument("-p", "--port", type=int, default=9000)
+    parser.add_argument("-t", "--token", type=str, default="")
     args = parser.parse_args()
-    GameClient(host=args.ip, port=args.port).run()
\ No newline at end of file
+    GameClient(host=args.ip, port=args.port, token=args.token).run()
\ No newline at end of file
@@ -4,6 +4,7 @@ import json
 import time
 import random
 import argparse
+import os
 
 # 遊戲設定
 WIDTH, HEIGHT = 600, 400
@@ -16,14 +17,36 @@ COLORS = [
     (0, 255, 255), (255, 0, 255), (255, 165, 0), (128, 0, 128)
 ]
 
-class GameServer:
-    def __init__(self, host='0.0.0.0', port=9000):
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server.bind((host, port))
-        self.server.listen()
-        print(f"[GAME SERVER] Listening on {host}:{port}")
+class LobbyReporter:
+    """
+    把房間狀態回報給 Lobby (Unix datagram，路徑在環境變數 LOBBY_REPORT_SOCKET)。
+    不是 Lobby 開的 (沒有這個變數) 就什麼都不做；送不到也不影響遊戲。
+    """
+    def __init__(self, port):
+        self.port = port
+        self.path = os.environ.get("LOBBY_REPORT_SOCKET")
+        self.interval = float(os.environ.get("LOBBY_REPORT_INTERVAL", 2))
+        self.sock = None
+        if self.path and hasattr(socket, "AF_UNIX"):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def send(self, players, state, room=None, tick_rate=None):
+        if self.sock is None:
+            return
+        msg = {"port": self.port, "players": players, "state": state}
+        if room is not None:
+            msg["room"] = room
+        if tick_rate is not None:
+            msg["tick_rate"] = round(tick_rate, 2)
+        try:
+            self.sock.sendto(json.dumps(msg).encode(), self.path)
+        except OSError:
+            pass
+
 
+class SnakeRoom:
+    """一個房間的遊戲狀態 (單房間模式只有一個，多房間模式每個房間一個)"""
+    def __init__(self, reporter=None, room=None):
         self.clients = {} 
         self.snakes = {} 
         self.food = [random.randint(0, (WIDTH//GRID_SIZE)-1), random.randint(0, (HEIGHT//GRID_SIZE)-1)]
@@ -31,6 +54,31 @@ class GameServer:
         # ★★★ 修正關鍵：改用 RLock (可重入鎖) 避免 Deadlock ★★★
         self.lock = threading.RLock() 
         self.running = True
+        self.next_pid = 0
+        self.reporter = reporter
+        self.room = room  # 多房間模式的 room_id
+        # 實際 tick 速率 (回報給 Lobby)
+        self.ticks = 0
+        self.last_ticks = 0
+        self.last_beat = time.monotonic()
+
+    def report(self, tick_rate=None):
+        if self.reporter:
+            players = len(self.clients)
+            self.reporter.send(players, "playing" if players else "waiting", self.room, tick_rate)
+
+    def heartbeat(self):
+        """定期回報 (含這段時間的平均 tick 速率)"""
+        now = time.monotonic()
+        rate = (self.ticks - self.last_ticks) / (now - self.last_beat) if now > self.last_beat else None
+        self.last_ticks, self.last_beat = self.ticks, now
+        self.report(rate)
+
+    def add_player(self, conn, addr):
+        with self.lock:
+            player_id = self.next_pid
+            self.next_pid += 1
+        self.handle_client(conn, addr, player_id)
 
     def respawn_snake(self, player_id):
         """重生"""
@@ -63,6 +111,7 @@ class GameServer:
             self.clients[player_id] = conn
             # 呼叫 respawn_snake，它裡面也會上鎖 -> RLock 允許這樣做
             self.respawn_snake(player_id)
+        self.report()
 
         try:
             while self.running:
@@ -99,81 +148,210 @@ class GameServer:
             with self.lock:
                 if player_id in self.clients: del self.clients[player_id]
                 if player_id in self.snakes: del self.snakes[player_id]
+            self.report()
 
-    def game_loop(self):
-        while self.running:
-            time.sleep(1/FPS)
+    def step(self):
+        """前進一格並廣播 (每 1/FPS 秒呼叫一次)"""
+        with self.lock:
+            self.ticks += 1
+            state_update = {'type': 'update', 'snakes': [], 'food': self.food}
             
-            with self.lock:
-                state_update = {'type': 'update', 'snakes': [], 'food': self.food}
+            # 收集所有身體座標用於碰撞
+            all_bodies = []
+            for s in self.snakes.values():
+                all_bodies.extend(s['body'])
+
+            dead_players = []
+
+            for pid, snake in self.snakes.items():
+                if snake['dir'] == [0, 0]:
+                    state_update['snakes'].append(snake)
+                    continue
+
+                head = snake['body'][0]
+                new_head = [head[0] + snake['dir'][0], head[1] + snake['dir'][1]]
+                new_head[0] %= (WIDTH // GRID_SIZE)
+                new_head[1] %= (HEIGHT // GRID_SIZE)
+
+                # 碰撞判定
+                if new_head in all_bodies:
+                    dead_players.append(pid)
+                    continue
+
+                # 吃食物
+                if new_head == self.food:
+                    snake['score'] += 10
+                    snake['body'].insert(0, new_head)
+                    while True:
+                        nf = [random.randint(0, (WIDTH//GRID_SIZE)-1), random.randint(0, (HEIGHT//GRID_SIZE)-1)]
+                        if nf not in all_bodies and nf != new_head:
+                            self.food = nf
+                            break
+                else:
+                    snake['body'].insert(0, new_head)
+                    snake['body'].pop()
                 
-                # 收集所有身體座標用於碰撞
-                all_bodies = []
-                for s in self.snakes.values():
-                    all_bodies.extend(s['body'])
-
-                dead_players = []
-
-                for pid, snake in self.snakes.items():
-                    if snake['dir'] == [0, 0]:
-                        state_update['snakes'].append(snake)
-                        continue
-
-                    head = snake['body'][0]
-                    new_head = [head[0] + snake['dir'][0], head[1] + snake['dir'][1]]
-                    new_head[0] %= (WIDTH // GRID_SIZE)
-                    new_head[1] %= (HEIGHT // GRID_SIZE)
-
-                    # 碰撞判定
-                    if new_head in all_bodies:
-                        dead_players.append(pid)
-                        continue
-
-                    # 吃食物
-                    if new_head == self.food:
-                        snake['score'] += 10
-                        snake['body'].insert(0, new_head)
-                        while True:
-                            nf = [random.randint(0, (WIDTH//GRID_SIZE)-1), random.randint(0, (HEIGHT//GRID_SIZE)-1)]
-                            if nf not in all_bodies and nf != new_head:
-                                self.food = nf
-                                break
-                    else:
-                        snake['body'].insert(0, new_head)
-                        snake['body'].pop()
+                state_update['snakes'].append(snake)
+
+            # 處理死亡
+            for pid in dead_players:
+                if pid in self.snakes:
+                    final_score = self.snakes[pid]['score']
+                    del self.snakes[pid] # 從地圖移除
                     
-                    state_update['snakes'].append(snake)
+                    # 通知該玩家 Game Over
+                    if pid in self.clients:
+                        try:
+                            msg = json.dumps({"type": "game_over", "score": final_score})
+                            self.clients[pid].sendall(msg.encode() + b'\n')
+                        except: pass
 
-                # 處理死亡
-                for pid in dead_players:
-                    if pid in self.snakes:
-                        final_score = self.snakes[pid]['score']
-                        del self.snakes[pid] # 從地圖移除
-                        
-                        # 通知該玩家 Game Over
-                        if pid in self.clients:
-                            try:
-                                msg = json.dumps({"type": "game_over", "score": final_score})
-                                self.clients[pid].sendall(msg.encode() + b'\n')
+            # 廣播更新
+            msg = json.dumps(state_update).encode() + b'\n'
+            for client in self.clients.values():
+                try: client.sendall(msg)
+                except: pass
+
+
+class GameServer:
+    """單房間模式：一個 process 一個房間"""
+    def __init__(self, host='0.0.0.0', port=9000):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen()
+        print(f"[GAME SERVER] Listening on {host}:{port}")
+        self.reporter = LobbyReporter(port)
+        self.room = SnakeRoom(self.reporter)
+
+    def game_loop(self):
+        next_beat = time.monotonic()
+        while self.room.running:
+            time.sleep(1/FPS)
+            self.room.step()
+            if time.monotonic() >= next_beat:
+                self.room.heartbeat()
+                next_beat = time.monotonic() + self.reporter.interval
+
+    def start(self):
+        threading.Thread(target=self.game_loop, daemon=True).start()
+        while True:
+            conn, addr = self.server.accept()
+            threading.Thread(target=self.room.add_player, args=(conn, addr), daemon=True).start()
+
+
+class MultiRoomServer:
+    """
+    多房間模式 (game_config.json 的 multi_room)：所有房間共用一個 port。
+    Lobby 從 control (Unix socket) 送 open/close/ping；玩家連上後第一行送 {"token": ...}
+    """
+    def __init__(self, control_path, host='0.0.0.0', port=9000):
+        self.rooms = {}    # token -> SnakeRoom
+        self.tokens = {}   # room_id -> token
+        self.lock = threading.Lock()
+
+        # 控制通道先準備好，port 開始 listen 時 Lobby 就能下指令
+        if os.path.exists(control_path):
+            os.unlink(control_path)
+        self.control = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.control.bind(control_path)
+        self.control.listen()
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen()
+        self.reporter = LobbyReporter(port)
+        print(f"[GAME SERVER] Multi-room listening on {host}:{port}")
+
+    def handle_command(self, cmd):
+        op = cmd.get('op')
+        with self.lock:
+            if op == 'open':
+                room = SnakeRoom(self.reporter, cmd['room'])
+                self.rooms[cmd['token']] = room
+                self.tokens[cmd['room']] = cmd['token']
+                print(f"[GAME SERVER] Room {cmd['room']} opened")
+            elif op == 'close':
+                token = self.tokens.pop(cmd.get('room'), None)
+                room = self.rooms.pop(token, None)
+                if room:
+                    room.running = False
+                    with room.lock:
+                        # shutdown 才會叫醒卡在 recv 的 handle_client
+                        for conn in room.clients.values():
+                            try: conn.shutdown(socket.SHUT_RDWR)
                             except: pass
+                    print(f"[GAME SERVER] Room {cmd['room']} closed")
+            elif op != 'ping':
+                return {"ok": False, "error": f"unknown op {op}"}
+            players = {rid: len(self.rooms[token].clients) for rid, token in self.tokens.items()}
+            return {"ok": True, "rooms": len(self.rooms), "players": players}
 
-                # 廣播更新
-                msg = json.dumps(state_update).encode() + b'\n'
-                for client in self.clients.values():
-                    try: client.sendall(msg)
-                    except: pass
+    def control_loop(self):
+        while True:
+            conn, _ = self.control.accept()
+            with conn:
+                try:
+                    line = conn.makefile('r').readline()
+                    reply = self.handle_command(json.loads(line))
+                except Exception as e:
+                    reply = {"ok": False, "error": str(e)}
+                try:
+                    conn.sendall(json.dumps(reply).encode() + b'\n')
+                except OSError:
+                    pass
+
+    def handshake(self, conn, addr):
+        """讀第一行的 token，找到房間後交給該房間"""
+        try:
+            conn.settimeout(5)
+            data = b''
+            while b'\n' not in data:
+                chunk = conn.recv(1024)
+                if not chunk: break
+                data += chunk
+            conn.settimeout(None)
+            token = json.loads(data.split(b'\n', 1)[0].decode()).get('token')
+        except Exception:
+            token = None
+        with self.lock:
+            room = self.rooms.get(token)
+        if room is None:
+            try:
+                conn.sendall(json.dumps({"type": "error", "message": "invalid room token"}).encode() + b'\n')
+            except: pass
+            conn.close()
+            return
+        room.add_player(conn, addr)
+
+    def game_loop(self):
+        next_beat = time.monotonic()
+        while True:
+            time.sleep(1/FPS)
+            with self.lock:
+                rooms = list(self.rooms.values())
+            for room in rooms:
+                room.step()
+            if time.monotonic() >= next_beat:
+                for room in rooms:
+                    room.heartbeat()
+                next_beat = time.monotonic() + self.reporter.interval
 
     def start(self):
+        threading.Thread(target=self.control_loop, daemon=True).start()
         threading.Thread(target=self.game_loop, daemon=True).start()
-        pid = 0
         while True:
             conn, addr = self.server.accept()
-            threading.Thread(target=self.handle_client, args=(conn, addr, pid), daemon=True).start()
-            pid += 1
+            threading.Thread(target=self.handshake, args=(conn, addr), daemon=True).start()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-p", "--port", type=int, default=9000)
+    parser.add_argument("--control", type=str, default="", help="多房間模式的控制通道 (Unix socket 路徑)")
     args = parser.parse_args()
-    server = GameServer(port=args.port)
+    if args.control:
+        server = MultiRoomServer(args.control, port=args.port)
+    else:
+        server = GameServer(port=args.port)
     server.start()
\ No newline at end of file
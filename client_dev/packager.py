@@ -0,0 +1,199 @@
+# packager.py
+# 增量打包：每個檔案的壓縮結果 (raw deflate) 快取在 client_dev/.pack_cache/<遊戲資料夾>/
+# 以 (path, size, mtime, hash) 為 key，沒變的檔案直接拿快取拼進 ZIP，不用重新壓縮。
+
+import os
+import json
+import time
+import struct
+import zlib
+import hashlib
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+CACHE_ROOT = os.path.join(current_dir, ".pack_cache")
+INDEX_NAME = "index.json"
+
+# 定義要排除的目錄名
+EXCLUDE_DIRS = {'.git', '__pycache__', 'venv', 'env', '.idea', '.vscode', 'node_modules', 'bin', 'obj'}
+# 定義要排除的副檔名或檔名
+EXCLUDE_FILES = {'.DS_Store', 'db.sqlite3', 'Thumbs.db'}
+
+COMPRESS_LEVEL = 6
+CHUNK_SIZE = 1024 * 1024
+# 改動的檔案少於這個數量就直接在本 process 壓，不值得開 process pool
+POOL_MIN_FILES = 4
+
+
+def collect_files(folder_path):
+    """回傳 [(rel_path, abs_path)]，排除垃圾檔案，順序固定 (讓 ZIP 內容可重現)"""
+    result = []
+    for root, dirs, files in os.walk(folder_path):
+        # 修改 dirs 列表以排除不需要的資料夾 (這樣 os.walk 就不會進去)
+        dirs[:] = sorted(d for d in dirs if d not in EXCLUDE_DIRS)
+        for file in sorted(files):
+            if file in EXCLUDE_FILES or file.endswith('.pyc'):
+                continue
+            abs_path = os.path.join(root, file)
+            # ZIP 內一律用 '/' 當分隔
+            rel_path = os.path.relpath(abs_path, folder_path).replace(os.sep, '/')
+            result.append((rel_path, abs_path))
+    return result
+
+
+def file_digest(abs_path):
+    h = hashlib.sha1()
+    with open(abs_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def compress_file(abs_path, blob_path):
+    """(在 worker process 執行) 壓縮單一檔案成 raw deflate 並寫入快取 blob"""
+    h = hashlib.sha1()
+    crc = 0
+    size = 0
+    comp = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15)
+    tmp_path = blob_path + ".tmp"
+    with open(abs_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            dst.write(comp.compress(chunk))
+        dst.write(comp.flush())
+    os.replace(tmp_path, blob_path)
+    return {
+        "sha1": h.hexdigest(),
+        "crc": crc & 0xFFFFFFFF,
+        "size": size,
+        "csize": os.path.getsize(blob_path),
+    }
+
+
+def _load_index(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, INDEX_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_index(cache_dir, index):
+    path = os.path.join(cache_dir, INDEX_NAME)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(path + ".tmp", path)
+
+
+def _blob_name(rel_path, st):
+    # 每個版本的檔案用不同 blob，壓縮中途失敗也不會蓋掉舊索引指向的內容
+    key = f"{rel_path}\0{st.st_size}\0{st.st_mtime_ns}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest() + ".bin"
+
+
+def _dos_datetime(mtime):
+    t = time.localtime(mtime)
+    year = max(t.tm_year, 1980)
+    dos_date = ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    return dos_time, dos_date
+
+
+def _write_zip(zip_path, entries, cache_dir):
+    """把快取中的 raw deflate blob 直接拼成標準 ZIP (不支援 ZIP64)"""
+    central = []
+    with open(zip_path, 'wb') as out:
+        for rel_path, meta in entries:
+            name = rel_path.encode('utf-8')
+            dos_time, dos_date = _dos_datetime(meta["mtime"])
+            offset = out.tell()
+            # Local file header (flag 0x800 = 檔名為 UTF-8)
+            out.write(struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, 0x800, zipfile.ZIP_DEFLATED,
+                                  dos_time, dos_date, meta["crc"], meta["csize"], meta["size"],
+                                  len(name), 0))
+            out.write(name)
+            with open(os.path.join(cache_dir, meta["blob"]), 'rb') as blob:
+                for chunk in iter(lambda: blob.read(CHUNK_SIZE), b''):
+                    out.write(chunk)
+            central.append(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, 20, 20, 0x800,
+                                       zipfile.ZIP_DEFLATED, dos_time, dos_date, meta["crc"],
+                                       meta["csize"], meta["size"], len(name), 0, 0, 0, 0,
+                                       (meta["mode"] & 0xFFFF) << 16, offset) + name)
+        cd_offset = out.tell()
+        for rec in central:
+            out.write(rec)
+        cd_size = out.tell() - cd_offset
+        out.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, len(central), len(central),
+                              cd_size, cd_offset, 0))
+
+
+def build_zip(folder_path, zip_path, cache_key=None):
+    """
+    打包 folder_path 到 zip_path。沒變的檔案重用快取，變動的檔案平行壓縮。
+    回傳統計 {"files", "reused", "compressed"}。
+    """
+    cache_key = cache_key or os.path.basename(os.path.normpath(folder_path))
+    cache_dir = os.path.join(CACHE_ROOT, cache_key)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    old_index = _load_index(cache_dir)
+    new_index = {}
+    todo = []  # [(rel_path, abs_path, blob)]
+
+    for rel_path, abs_path in collect_files(folder_path):
+        st = os.stat(abs_path)
+        cached = old_index.get(rel_path)
+        blob_ok = cached and os.path.exists(os.path.join(cache_dir, cached["blob"]))
+
+        if blob_ok and cached["size"] == st.st_size:
+            if cached["mtime_ns"] == st.st_mtime_ns:
+                new_index[rel_path] = cached
+                continue
+            # mtime 變了但內容可能沒變 (例如 git checkout)，比對 hash
+            if file_digest(abs_path) == cached["sha1"]:
+                cached = dict(cached, mtime_ns=st.st_mtime_ns, mtime=st.st_mtime)
+                new_index[rel_path] = cached
+                continue
+
+        new_index[rel_path] = {
+            "blob": _blob_name(rel_path, st),
+            "mtime_ns": st.st_mtime_ns,
+            "mtime": st.st_mtime,
+            "mode": st.st_mode,
+        }
+        todo.append((rel_path, abs_path, os.path.join(cache_dir, new_index[rel_path]["blob"])))
+
+    if len(todo) >= POOL_MIN_FILES:
+        with ProcessPoolExecutor() as pool:
+            futures = [(rel, pool.submit(compress_file, abs_p, blob)) for rel, abs_p, blob in todo]
+            results = [(rel, fut.result()) for rel, fut in futures]
+    else:
+        results = [(rel, compress_file(abs_p, blob)) for rel, abs_p, blob in todo]
+
+    for rel_path, info in results:
+        new_index[rel_path].update(info)
+
+    # 清掉已刪除檔案的舊 blob
+    live_blobs = {meta["blob"] for meta in new_index.values()}
+    for meta in old_index.values():
+        if meta.get("blob") not in live_blobs:
+            try:
+                os.remove(os.path.join(cache_dir, meta["blob"]))
+            except OSError:
+                pass
+
+    entries = list(new_index.items())
+    total = sum(meta["csize"] for _, meta in entries)
+    if len(entries) >= 0xFFFF or total >= 0xFFFFFFFF or any(m["size"] >= 0xFFFFFFFF for _, m in entries):
+        # 超過傳統 ZIP 上限，退回 zipfile (會自動使用 ZIP64)
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            for rel_path, abs_path in collect_files(folder_path):
+                zipf.write(abs_path, rel_path)
+    else:
+        _write_zip(zip_path, entries, cache_dir)
+
+    _save_index(cache_dir, new_index)
+    return {"files": len(entries), "reused": len(entries) - len(todo), "compressed": len(todo)}
@@ -2,6 +2,7 @@ import socket
 import sys
 import os
 import threading
+import time
 import queue
 import json
 import base64
@@ -14,12 +15,18 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(current_dir)
 sys.path.append(project_root)
 
-from common.utils import send_json, recv_json
+from common.utils import send_json, recv_json, Heartbeat, set_keepalive, build_argv
 from common.protocol import Protocol
 
 # Host & Port -> Connect to server
 HOST = '140.113.17.11'
 PORT = 30800
+# 自動配對最多等幾秒
+MATCH_WAIT = 60
+# 加入房間時最多列出幾間 (Server 端過濾掉已滿的房間，人多的在前)
+ROOM_LIST_LIMIT = 30
+# 下載要等多久：Server 可能先排隊 (最多 LOBBY_TRANSFER_WAIT 秒) 再控速傳送大檔
+TRANSFER_TIMEOUT = 120
 
 class LobbyClient:
     def __init__(self):
@@ -28,14 +35,26 @@ class LobbyClient:
         self.user_token = None 
         self.username = None
         self.msg_queue = queue.Queue()
+        self.send_lock = threading.Lock()  # 心跳 thread 也會寫 socket
+        self.seq = 0  # 每個請求的編號，Server 原樣帶回；用來丟掉逾時後才到的舊回覆
+        self.heartbeat = None
         self.current_room_id = None
+        # 訂閱推播後在本地維護的房間 / 商城列表 {topic: {id: data}}；None = 還沒拿到快照或要重抓
+        self.live = {"rooms": None, "catalog": None}
+        self.early_events = []  # 快照回來之前先到的推播
+        self.subscribed = False
+        self.subscribing = False
+        self.live_lock = threading.Lock()
 
 
     def connect(self):
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.connect((HOST, PORT))
+            set_keepalive(self.sock)
             print(f"[*] 已連線至大廳伺服器 {HOST}:{PORT}")
+            self.heartbeat = Heartbeat(self.sock, self.send_lock)
+            self.heartbeat.start()
             
             recv_thread = threading.Thread(target=self.listen_to_server)
             recv_thread.daemon = True
@@ -50,6 +69,13 @@ class LobbyClient:
             try:
                 msg = recv_json(self.sock)
                 if msg:
+                    self.heartbeat.touch()
+                if msg and msg.get("cmd") == Protocol.CMD_PONG:
+                    continue
+                if msg and msg.get("cmd") == Protocol.PUSH_EVENT:
+                    # Server 主動推播，不是請求的回覆，不能放進 msg_queue
+                    self.on_event(msg)
+                elif msg:
                     self.msg_queue.put(msg)
                 else:
                     print("\n[!] 伺服器已斷開連線。")
@@ -58,11 +84,80 @@ class LobbyClient:
             except:
                 break
 
-    def get_response(self, timeout=5):
-        try:
-            return self.msg_queue.get(timeout=timeout)
-        except queue.Empty:
+    def on_event(self, msg):
+        topic = msg.get("topic")
+        with self.live_lock:
+            if topic not in self.live:
+                return
+            if self.live[topic] is None:
+                if self.subscribing:
+                    self.early_events.append(msg)
+                return
+            self._apply_events(topic, msg.get("events", []))
+
+    def _apply_events(self, topic, events):
+        """需持有 live_lock"""
+        view = self.live[topic]
+        for ev in events:
+            op = ev.get("op")
+            if op == "resync":
+                # Server 那邊積太多沒送，整份重抓
+                self.live[topic] = None
+                return
+            if op == "removed":
+                view.pop(str(ev["id"]), None)
+            else:
+                # 推播只帶變動的欄位 (商城的下載數 / 評分不會跟著推)，保留原本的
+                view[str(ev["id"])] = dict(view.get(str(ev["id"]), {}), **ev["data"])
+            if topic == "catalog" and op in ("added", "updated"):
+                data = ev["data"]
+                print(f"\n📢 {data['name']} v{data['version']} 已上架！")
+
+    def subscribe_lobby(self):
+        """登入後訂閱房間與商城變動，之後列表不用每次重問 Server"""
+        with self.live_lock:
+            self.subscribing = True
+        self.send({"cmd": Protocol.CMD_SUBSCRIBE, "topics": list(self.live)})
+        res = self.get_response()
+        with self.live_lock:
+            self.subscribing = False
+            self.subscribed = bool(res and res.get("status") == "OK")
+            if not self.subscribed:
+                self.early_events = []
+                return
+            snapshot = res.get("snapshot", {})
+            self.live["rooms"] = {str(r["id"]): r for r in snapshot.get("rooms") or []}
+            self.live["catalog"] = {str(g["id"]): g for g in snapshot.get("catalog") or []}
+            early, self.early_events = self.early_events, []
+            for msg in early:
+                if self.live.get(msg.get("topic")) is not None:
+                    self._apply_events(msg["topic"], msg.get("events", []))
+
+    def _live_list(self, topic):
+        """本地列表；收到 resync 後重新訂閱拿一份新快照。沒訂閱成功回傳 None (改用 LIST_*)"""
+        if not self.subscribed:
             return None
+        if self.live.get(topic) is None:
+            self.subscribe_lobby()
+        with self.live_lock:
+            view = self.live.get(topic)
+            return list(view.values()) if view is not None else None
+
+    def send(self, req):
+        with self.send_lock:
+            self.seq += 1
+            return send_json(self.sock, dict(req, seq=self.seq))
+
+    def get_response(self, timeout=5):
+        """等最近一個請求的回覆；之前逾時的請求後來才到的回覆直接丟掉"""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                msg = self.msg_queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                return None
+            if msg.get("seq", self.seq) == self.seq:
+                return msg
 
     # ================= UI / Menu Logic =================
 
@@ -77,6 +172,7 @@ class LobbyClient:
         except KeyboardInterrupt:
             print("\nExiting...")
         finally:
+            if self.heartbeat: self.heartbeat.stop()
             if self.sock: self.sock.close()
 
     def login_menu(self):
@@ -107,25 +203,37 @@ class LobbyClient:
         elif choice == '5': self.do_view_details()
         elif choice == '6': 
             self.username = None
+            if self.subscribed:
+                self.send({"cmd": Protocol.CMD_UNSUBSCRIBE})
+                self.get_response()
+            with self.live_lock:
+                self.subscribed = False
+                self.live = {"rooms": None, "catalog": None}
             print("已登出。")
 
     def room_menu(self):
         print("\n=== 房間選單 ===")
         print("1. 建立房間 (Create Room)")
         print("2. 列表並加入 (List & Join)")
-        print("3. 返回 (Back)")
-        choice = input("請選擇 (1-3): ").strip()
+        print("3. 自動配對 (Quick Match)")
+        print("4. 快速加入 (Quick Join)")
+        print("5. 返回 (Back)")
+        choice = input("請選擇 (1-5): ").strip()
 
         if choice == '1':
             self.do_create_room()
         elif choice == '2':
             self.do_join_room()
         elif choice == '3':
+            self.do_queue_match()
+        elif choice == '4':
+            self.do_quick_join()
+        elif choice == '5':
             return
 
     # ================= Core Game Launch & Update Logic =================
 
-    def launch_game(self, game_name, ip, port):
+    def launch_game(self, game_name, ip, port, token=None):
         """核心功能：啟動本地遊戲程式 (Blocking Mode)"""
         game_dir = os.path.join(current_dir, "downloads", self.username, game_name)
         config_path = os.path.join(game_dir, "game_config.json")
@@ -138,13 +246,14 @@ class LobbyClient:
             with open(config_path, 'r') as f:
                 config = json.load(f)
             
-            cmd_template = config.get("exe_cmd", "")
-            cmd = cmd_template.replace("{ip}", ip).replace("{port}", str(port))
+            # 拆成 argv 直接執行 (不經過 shell)，python 會換成目前的直譯器
+            # {token}：多房間模式的 Game Server 用來分辨要進哪個房間
+            argv = build_argv(config.get("exe_cmd", ""), ip=ip, port=port, token=token or "")
             
-            print(f"🚀 啟動遊戲中: {cmd}")
+            print(f"🚀 啟動遊戲中: {' '.join(argv)}")
             
             # 1. 啟動 Process
-            process = subprocess.Popen(cmd, shell=True, cwd=game_dir)
+            process = subprocess.Popen(argv, cwd=game_dir)
             
             # 2. 暫停 Lobby，等待遊戲結束
             print("\n" + "="*50)
@@ -165,7 +274,7 @@ class LobbyClient:
         print(f"正在請求離開房間 {self.current_room_id}...")
         # 注意：請確認 common/protocol.py 裡有加 CMD_LEAVE_ROOM = "LEAVE_ROOM"
         req = {"cmd": Protocol.CMD_LEAVE_ROOM, "room_id": self.current_room_id}
-        send_json(self.sock, req)
+        self.send(req)
         
         # 等待 Server 確認 (非必要但比較保險)
         self.get_response(timeout=2)
@@ -199,9 +308,9 @@ class LobbyClient:
             print(f"⬇ 正在下載 {game_name}...")
 
         req = {"cmd": Protocol.CMD_DOWNLOAD_GAME, "game_id": str(game_id)}
-        send_json(self.sock, req)
+        self.send(req)
         
-        res = self.get_response(timeout=15)
+        res = self.get_response(timeout=TRANSFER_TIMEOUT)
         if res and res.get("status") == "OK":
             try:
                 b64_data = res.get("file_data")
@@ -225,9 +334,16 @@ class LobbyClient:
              msg = res.get("message") if res else "Timeout"
              print(f"❌ 下載失敗: {msg}")
 
-    def _fetch_game_list(self):
-        """內部呼叫：取得遊戲列表資料"""
-        send_json(self.sock, {"cmd": Protocol.CMD_LIST_GAMES})
+    def _fetch_game_list(self, order_by=None):
+        """內部呼叫：取得遊戲列表資料 (order_by: popular / top_rated / newest)"""
+        if not order_by:
+            games = self._live_list("catalog")
+            if games is not None:
+                return sorted(games, key=lambda g: int(g["id"]))
+        req = {"cmd": Protocol.CMD_LIST_GAMES}
+        if order_by:
+            req["order_by"] = order_by
+        self.send(req)
         res = self.get_response()
         if res and res.get("status") == "OK":
             return res.get("games", [])
@@ -240,7 +356,7 @@ class LobbyClient:
         u = input("帳號: ")
         p = input("密碼: ")
         req = {"cmd": Protocol.CMD_REGISTER, "username": u, "password": p, "role": "player"}
-        send_json(self.sock, req)
+        self.send(req)
         res = self.get_response()
         if res: print(f"Server: {res.get('message')}")
 
@@ -248,11 +364,13 @@ class LobbyClient:
         u = input("帳號: ")
         p = input("密碼: ")
         req = {"cmd": Protocol.CMD_LOGIN_PLAYER, "username": u, "password": p}
-        send_json(self.sock, req)
+        self.send(req)
         res = self.get_response()
         if res and res.get("status") == "OK":
             self.username = res.get("username")
+            self.heartbeat.interval = res.get("heartbeat_interval", self.heartbeat.interval)
             print("登入成功！")
+            self.subscribe_lobby()
         else:
             print(f"登入失敗: {res.get('message') if res else 'Timeout'}")
 
@@ -261,12 +379,15 @@ class LobbyClient:
 
     def do_list_games(self):
         print("\n--- 遊戲列表 ---")
-        games = self._fetch_game_list()
+        orders = {'1': None, '2': 'popular', '3': 'top_rated', '4': 'newest'}
+        choice = input("排序 (1.預設 2.熱門 3.評分 4.最新): ").strip()
+        games = self._fetch_game_list(orders.get(choice))
         if games:
-            print(f"{'ID':<5} {'Name':<15} {'Version':<10} {'Author':<10} {'Description'}")
-            print("-" * 60)
+            print(f"{'ID':<5} {'Name':<15} {'Version':<10} {'Author':<10} {'DL':<6} {'★':<5} {'Description'}")
+            print("-" * 72)
             for g in games:
-                print(f"{g['id']:<5} {g['name']:<15} {g['version']:<10} {g['author']:<10} {g['description']}")
+                print(f"{g['id']:<5} {g['name']:<15} {g['version']:<10} {g.get('author', '-'):<10} "
+                      f"{g.get('downloads', 0):<6} {g.get('average_rating', 0):<5} {g['description']}")
         else:
             print("目前沒有遊戲上架。")
 
@@ -324,7 +445,7 @@ class LobbyClient:
         comment = input("留言 (選填): ").strip()
         
         req = {"cmd": Protocol.CMD_REVIEW_GAME, "game_id": gid, "rating": rating, "comment": comment}
-        send_json(self.sock, req)
+        self.send(req)
         res = self.get_response()
         if res: print(f"Server: {res.get('message')}")
 
@@ -346,7 +467,7 @@ class LobbyClient:
         # 3. 正常流程
         gid = input("輸入遊戲 ID 查看: ").strip()
         if not gid: return
-        send_json(self.sock, {"cmd": Protocol.CMD_GET_REVIEWS, "game_id": gid})
+        self.send({"cmd": Protocol.CMD_GET_REVIEWS, "game_id": gid})
         res = self.get_response()
         if res and res.get("status") == "OK":
             reviews = res.get("reviews", [])
@@ -378,10 +499,11 @@ class LobbyClient:
             return
 
         req = {"cmd": Protocol.CMD_CREATE_ROOM, "game_id": gid_str}
-        send_json(self.sock, req)
+        self.send(req)
         
         print("正在請求 Server 建立房間...")
-        res = self.get_response(timeout=10)
+        # Server 會等 Game Server 就緒才回覆 (最多約 10 秒)
+        res = self.get_response(timeout=15)
         
         if res and res.get("status") == "OK":
             print(f"✅ 房間已建立! ID: {res['room_id']}, Port: {res['port']}")
@@ -390,31 +512,43 @@ class LobbyClient:
             server_ver = res.get("game_version", "1.0")
             self.check_and_update_game(gid_str, res['game_name'], server_ver)
             
-            self.launch_game(res['game_name'], HOST, res['port'])
+            self.launch_game(res['game_name'], res.get('game_host') or HOST, res['port'], res.get('room_token'))
         else:
             msg = res.get("message") if res else "Timeout"
             print(f"❌ 建立失敗: {msg}")
 
     def do_join_room(self):
         print("\n--- 加入房間 ---")
-        send_json(self.sock, {"cmd": Protocol.CMD_LIST_ROOMS})
-        res = self.get_response()
-        
-        rooms = res.get("rooms", [])
+        # 有訂閱推播就直接用本地維護的列表 (同樣只留有空位的)，否則請 Server 過濾排序好
+        rooms = self._live_list("rooms")
+        total = None
+        if rooms is None:
+            self.send({"cmd": Protocol.CMD_LIST_ROOMS, "open": True, "sort": "players", "limit": ROOM_LIST_LIMIT})
+            res = self.get_response()
+            rooms = res.get("rooms", []) if res else []
+            total = res.get("total") if res else None
+        else:
+            rooms = [r for r in rooms if r.get("max_players") is None or r["players"] < r["max_players"]]
+            rooms.sort(key=lambda r: (-r["players"], int(r["id"])))
+            total = len(rooms)
+            rooms = rooms[:ROOM_LIST_LIMIT]
         if not rooms:
-            print("目前沒有房間。")
+            print("目前沒有可加入的房間。")
             return
             
         print(f"\n{'RoomID':<8} {'Game':<15} {'Host':<10} {'Players'}")
         print("-" * 50)
         for r in rooms:
-            print(f"{r['id']:<8} {r['game_name']:<15} {r['host']:<10} {r['players']}/2")
+            capacity = r.get('max_players') or '-'
+            print(f"{r['id']:<8} {r['game_name']:<15} {r['host']:<10} {r['players']}/{capacity}")
+        if total and total > len(rooms):
+            print(f"(只列出 {len(rooms)} / {total} 間)")
             
         rid = input("輸入房間 ID: ").strip()
         if rid == '0': return
         
         req = {"cmd": Protocol.CMD_JOIN_ROOM, "room_id": rid}
-        send_json(self.sock, req)
+        self.send(req)
         
         res = self.get_response()
         if res and res.get("status") == "OK":
@@ -424,10 +558,72 @@ class LobbyClient:
             server_ver = res.get("game_version", "1.0")
             self.check_and_update_game(res['game_id'], res['game_name'], server_ver)
             
-            self.launch_game(res['game_name'], HOST, res['port'])
+            self.launch_game(res['game_name'], res.get('game_host') or HOST, res['port'], res.get('room_token'))
         else:
              print(f"❌ 加入失敗: {res.get('message') if res else 'Timeout'}")
 
+    def do_quick_join(self):
+        print("\n--- 快速加入 ---")
+        games = self._fetch_game_list()
+        if not games:
+            print("無法取得列表。")
+            return
+
+        for g in games:
+            print(f"{g['id']}. {g['name']}")
+
+        gid_str = input("輸入遊戲 ID: ").strip()
+        if gid_str == '0': return
+
+        self.send({"cmd": Protocol.CMD_QUICK_JOIN, "game_id": gid_str})
+        res = self.get_response()
+        if res and res.get("status") == "OK":
+            print(f"✅ 加入房間 {res['room_id']}!")
+
+            self.current_room_id = res['room_id']
+            server_ver = res.get("game_version", "1.0")
+            self.check_and_update_game(res['game_id'], res['game_name'], server_ver)
+
+            self.launch_game(res['game_name'], res.get('game_host') or HOST, res['port'], res.get('room_token'))
+        else:
+            print(f"❌ 快速加入失敗: {res.get('message') if res else 'Timeout'}")
+
+    def do_queue_match(self):
+        print("\n--- 自動配對 ---")
+        games = self._fetch_game_list()
+        if not games:
+            print("無法取得列表。")
+            return
+
+        for g in games:
+            print(f"{g['id']}. {g['name']}")
+
+        gid_str = input("輸入遊戲 ID: ").strip()
+        if gid_str == '0': return
+
+        target_game = next((g for g in games if str(g['id']) == gid_str), None)
+        if not target_game:
+            print("❌ 無效 ID。")
+            return
+
+        req = {"cmd": Protocol.CMD_QUEUE_MATCH, "game_id": gid_str, "timeout": MATCH_WAIT}
+        self.send(req)
+
+        print(f"排隊中，等待其他玩家 (最多 {MATCH_WAIT} 秒)...")
+        # Server 配對成功或逾時才回覆；多留一點時間給開房
+        res = self.get_response(timeout=MATCH_WAIT + 15)
+
+        if res and res.get("status") == "OK":
+            print(f"✅ 配對成功! 房間 ID: {res['room_id']} (等了 {res.get('wait_seconds', 0)} 秒)")
+
+            self.current_room_id = res['room_id']
+            server_ver = res.get("game_version", "1.0")
+            self.check_and_update_game(gid_str, res['game_name'], server_ver)
+
+            self.launch_game(res['game_name'], res.get('game_host') or HOST, res['port'], res.get('room_token'))
+        else:
+            print(f"❌ 配對失敗: {res.get('message') if res else 'Timeout'}")
+
 
 
 
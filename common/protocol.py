@@ -21,6 +21,21 @@ class Protocol:
 
     # U3
     CMD_CREATE_ROOM = "CREATE_ROOM"
-    CMD_LIST_ROOMS = "LIST_ROOMS"
+    CMD_LIST_ROOMS = "LIST_ROOMS" # 選填條件: game_id, version, host, open, sort, limit
     CMD_JOIN_ROOM = "JOIN_ROOM"
-    CMD_LEAVE_ROOM = "LEAVE_ROOM" 
\ No newline at end of file
+    CMD_LEAVE_ROOM = "LEAVE_ROOM" 
+    CMD_QUEUE_MATCH = "QUEUE_MATCH" # 自動配對 (排隊到有房間為止)
+    CMD_QUICK_JOIN = "QUICK_JOIN" # 直接加入有空位的房間 (沒有就失敗，不排隊)
+
+    # 推播訂閱：topics = ["rooms", "catalog", "reviews:<game_id>"]
+    CMD_SUBSCRIBE = "SUBSCRIBE"
+    CMD_UNSUBSCRIBE = "UNSUBSCRIBE"
+    # Server 主動送出的事件 (沒有 status，用 cmd 分辨，不是任何請求的回覆)
+    PUSH_EVENT = "EVENT"
+
+    # 心跳：Client 每隔 heartbeat_interval 秒送 PING，Server 回 {"cmd": "PONG"} (沒有 status，不是一般回覆)
+    CMD_PING = "PING"
+    CMD_PONG = "PONG"
+
+    # Server status / metrics
+    CMD_STATS = "STATS"
\ No newline at end of file
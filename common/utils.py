@@ -1,6 +1,16 @@
 import socket
+import errno
 import json
 import struct
+import os
+import sys
+import shlex
+import time
+import threading
+from common.protocol import Protocol
+
+# 對方整台消失 (TCP keepalive / 重送逾時) 時 recv 會丟的錯誤：不當作一般斷線吞掉，交給呼叫端
+DEAD_PEER_ERRNOS = {errno.ETIMEDOUT, errno.EHOSTUNREACH, errno.ENETUNREACH}
 
 def send_json(sock, data):
     try:
@@ -36,12 +46,20 @@ def recv_json(sock):
         json_str = data_bytes.decode('utf-8')
         return json.loads(json_str)
 
+    except socket.timeout:
+        # 有設 timeout 的 socket (Server 的閒置逾時) 交給呼叫端處理
+        raise
     except UnicodeDecodeError as e:
         print(f"[Utils Error] JSON Decode Error: {e}")
         return None
     except json.JSONDecodeError as e:
         print(f"[Utils Error] JSON Parse Error: {e}")
         return None
+    except OSError as e:
+        if e.errno in DEAD_PEER_ERRNOS:
+            raise
+        print(f"[Utils Error] recv_json socket error: {e}")
+        return None
     except Exception as e:
         print(f"[Utils Error] recv_json unknown error: {e}")
         return None
@@ -54,7 +72,76 @@ def recv_all(sock, n):
             if not chunk:
                 return None # 對方關閉連線
             data += chunk
-        except Exception as e:
+        except socket.timeout:
+            raise
+        except OSError as e:
+            if e.errno in DEAD_PEER_ERRNOS:
+                raise
             print(f"[Utils Error] recv_all socket error: {e}")
             return None
-    return data
\ No newline at end of file
+    return data
+
+def set_keepalive(sock, idle=60, interval=10, count=3):
+    """
+    開啟 TCP keepalive：連線 idle 秒沒有流量後每 interval 秒探測一次，count 次沒回應就當作斷線
+    (對方睡眠 / 拔網路線造成的半開連線)。平台沒有的選項就略過。
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for name, value in (("TCP_KEEPIDLE", idle), ("TCP_KEEPINTVL", interval), ("TCP_KEEPCNT", count)):
+        if hasattr(socket, name):
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+            except OSError:
+                pass
+
+class Heartbeat:
+    """
+    Client 端心跳：背景每 interval 秒送一次 PING，Server 會回 PONG。
+    收到 Server 任何封包都要呼叫 touch()；超過 3 個間隔都沒收到就當作 Server 已經消失，
+    直接 shutdown socket，讓卡在 recv 的 thread 醒來走斷線流程。
+    """
+
+    def __init__(self, sock, send_lock, interval=30):
+        self.sock = sock
+        self.send_lock = send_lock
+        self.interval = interval
+        self.last_seen = time.monotonic()
+        self.running = True
+
+    def start(self):
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+    def stop(self):
+        self.running = False
+
+    def _loop(self):
+        while self.running:
+            time.sleep(self.interval)
+            if not self.running:
+                break
+            if time.monotonic() - self.last_seen > self.interval * 3:
+                print("\n[!] 伺服器沒有回應，中斷連線。")
+                try:
+                    self.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                break
+            with self.send_lock:
+                if not send_json(self.sock, {"cmd": Protocol.CMD_PING}):
+                    break
+
+def build_argv(cmd_template, **values):
+    """
+    把 game_config.json 的指令 (例如 "python server.py -p {port}") 拆成 argv list，
+    不經過 shell 直接執行。{port}/{ip} 在拆開後才替換，值裡有空白也不會被拆開；
+    開頭的 python / python3 換成目前的直譯器。
+    """
+    argv = shlex.split(cmd_template, posix=(os.name != 'nt'))
+    for key, value in values.items():
+        argv = [arg.replace("{" + key + "}", str(value)) for arg in argv]
+    if argv and argv[0] in ('python', 'python3', 'py'):
+        argv[0] = sys.executable
+    return argv
@@ -0,0 +1,247 @@
+import os
+import sys
+import time
+import base64
+import socket
+import argparse
+import tempfile
+import threading
+
+# --- 路徑設定 ---
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.append(project_root)
+
+from common.utils import send_json, recv_json, set_keepalive
+from server.services import pipeline
+from server.services import spawner
+from server.services import supervisor
+from server.services import reports
+from server.services.ports import PortPool
+
+# Game host agent：在另一台機器上替 Lobby 開 Game Server
+#   python server/agent.py --lobby 10.0.0.1:30810 --address 10.0.0.2 --ports 21050-21150
+# 連到 Lobby 的 agent port (services/agents.py) 註冊後定期回報負載，Lobby 要開房時送 spawn 過來。
+# 遊戲檔案第一次用到時由 Lobby 連同 spawn 一起傳 ZIP，解壓在 --dir 底下，之後重複使用。
+# 跟 Lobby 斷線 (Lobby 重啟 / 部署 / 網路斷掉) 時 Game Server 繼續跑並一直重連，重新註冊時回報還在跑的 process，
+# Lobby 接回對得上的房間；斷線超過 GRACE 秒才把自己開的 Game Server 全部關掉 (Lobby 那邊也已經放棄了)。
+
+RECONNECT_DELAY = 3.0
+GRACE = float(os.environ.get("LOBBY_AGENT_GRACE", 120))  # 跟 Lobby 設一樣
+
+
+class Agent:
+    def __init__(self, lobby, name, address, ports, run_root, secret):
+        self.lobby = lobby
+        self.name = name
+        self.address = address
+        self.ports = ports
+        self.run_root = run_root
+        self.secret = secret
+        self.report_interval = 5
+        self.conn = None
+        self.lost_at = None  # 跟 Lobby 斷線的時間；連著是 None
+        self.send_lock = threading.Lock()
+        self.processes = {}  # pid -> (process, port)
+        self.lock = threading.Lock()
+        self.extract_lock = threading.Lock()
+
+    # ---------- 狀態 ----------
+    def versions(self):
+        try:
+            return sorted(d for d in os.listdir(self.run_root)
+                          if os.path.isdir(os.path.join(self.run_root, d))
+                          and ".staging-" not in d and ".old-" not in d)
+        except OSError:
+            return []
+
+    def report(self):
+        with self.lock:
+            games = list(self.processes.values())
+        players = {}
+        for _, port in games:
+            # Game Server 自己有回報就用回報的人數
+            report = reports.get(port)
+            count = report.players if report is not None else spawner.connection_count(port)
+            if count is not None:
+                players[str(port)] = count
+        try:
+            load = os.getloadavg()[0]
+        except (AttributeError, OSError):
+            load = 0.0
+        return {
+            "op": "report",
+            "load": load,
+            "free_ports": self.ports.stats()["free"],
+            "players": players,
+            "versions": self.versions(),
+        }
+
+    def live_processes(self):
+        with self.lock:
+            return [{"pid": pid, "port": port} for pid, (_, port) in self.processes.items()]
+
+    def send(self, message):
+        with self.send_lock:
+            return self.conn is not None and send_json(self.conn, message)
+
+    # ---------- Lobby 的請求 ----------
+    def _spawn(self, msg):
+        version = os.path.basename(msg.get("version") or "")
+        if not version or version.startswith("."):
+            return {"ok": False, "error": "Bad version."}
+        run_dir = os.path.join(self.run_root, version)
+        if msg.get("zip"):
+            with self.extract_lock:
+                fd, zip_path = tempfile.mkstemp(suffix=".zip", dir=self.run_root)
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(base64.b64decode(msg["zip"]))
+                    pipeline.check_zip(zip_path)
+                    pipeline.extract_artifact(zip_path, run_dir)
+                finally:
+                    os.unlink(zip_path)
+        if not os.path.isdir(run_dir):
+            return {"ok": False, "error": f"{version} is not on this agent."}
+
+        config = spawner.load_game_config(run_dir)
+        port = self.ports.lease()
+        if not port:
+            return {"ok": False, "error": "No free ports on agent."}
+        process = spawner.spawn_game_server(config, run_dir, port)
+        ready, info = spawner.wait_until_ready(process, port, label=version)
+        if not ready:
+            spawner.kill_process(process)
+            self.ports.release(port)
+            return {"ok": False, "error": info}
+        with self.lock:
+            self.processes[process.pid] = (process, port)
+        supervisor.watch(process, label=version, on_exit=lambda code, pid=process.pid: self._exited(pid, code))
+        print(f"[Agent] Game Server {version} on port {port} (pid {process.pid})")
+        return {"ok": True, "pid": process.pid, "port": port}
+
+    def _exited(self, pid, code):
+        with self.lock:
+            entry = self.processes.pop(pid, None)
+        if entry is None:
+            return
+        self.ports.release(entry[1])
+        self.send({"op": "exited", "pid": pid, "code": code})
+
+    def _stop(self, pid, kill=False):
+        with self.lock:
+            entry = self.processes.pop(pid, None)
+        if entry is None:
+            return
+        process, port = entry
+        if kill:
+            supervisor.retire(process, grace=0)
+        else:
+            supervisor.retire(process)
+        self.ports.release(port)
+
+    def _handle(self, msg):
+        try:
+            if msg.get("op") == "spawn":
+                reply = self._spawn(msg)
+            else:
+                reply = {"ok": False, "error": f"Unknown op: {msg.get('op')}"}
+        except Exception as e:
+            print(f"[Agent Error] {e}")
+            reply = {"ok": False, "error": str(e)}
+        self.send(dict(reply, op="reply", id=msg.get("id")))
+
+    # ---------- 連線 ----------
+    def _report_loop(self, conn):
+        while self.conn is conn:
+            if not self.send(self.report()):
+                return
+            time.sleep(self.report_interval)
+
+    def session(self):
+        host, port = self.lobby
+        conn = socket.create_connection((host, port))
+        set_keepalive(conn)
+        send_json(conn, {"op": "register", "name": self.name, "address": self.address,
+                         "cpu_count": os.cpu_count(), "versions": self.versions(), "secret": self.secret,
+                         "processes": self.live_processes()})
+        welcome = recv_json(conn)
+        if not welcome or not welcome.get("ok"):
+            conn.close()
+            raise OSError((welcome or {}).get("error", "registration refused"))
+        self.report_interval = welcome.get("report_interval", self.report_interval)
+        self.conn = conn
+        self.lost_at = None
+        print(f"[Agent] Registered with Lobby {host}:{port} as {self.name}")
+        threading.Thread(target=self._report_loop, args=(conn,), daemon=True).start()
+        try:
+            while True:
+                msg = recv_json(conn)
+                if msg is None:
+                    break
+                if msg.get("op") == "stop":
+                    self._stop(msg.get("pid"), msg.get("kill", False))
+                else:
+                    # spawn 要等 Game Server 就緒，不要擋住其他請求
+                    threading.Thread(target=self._handle, args=(msg,), daemon=True).start()
+        finally:
+            with self.send_lock:
+                self.conn = None
+                self.lost_at = time.monotonic()
+            conn.close()
+            print(f"[Agent] Lost the Lobby. Keeping {len(self.processes)} game servers for {GRACE:.0f}s.")
+
+    def _grace_loop(self):
+        """跟 Lobby 斷線太久 (Lobby 已經把房間收了) 就關掉所有 Game Server"""
+        while True:
+            time.sleep(1)
+            lost_at = self.lost_at
+            if lost_at is not None and time.monotonic() - lost_at > GRACE:
+                self.lost_at = None
+                self.stop_all()
+
+    def stop_all(self):
+        with self.lock:
+            pids = list(self.processes)
+        for pid in pids:
+            self._stop(pid)
+        if pids:
+            print(f"[Agent] Stopped {len(pids)} game servers.")
+
+    def run(self):
+        supervisor.start()
+        spawner.GAME_ENV.update(reports.start(os.path.join(self.run_root, "reports.sock")))
+        threading.Thread(target=self._grace_loop, daemon=True).start()
+        while True:
+            try:
+                self.session()
+            except OSError as e:
+                print(f"[Agent] Lobby {self.lobby[0]}:{self.lobby[1]} unreachable: {e}")
+            time.sleep(RECONNECT_DELAY)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Game host agent")
+    parser.add_argument("--lobby", default="127.0.0.1:30810", help="Lobby 的 agent port (host:port)")
+    parser.add_argument("--name", default=socket.gethostname())
+    parser.add_argument("--address", default=None, help="玩家連 Game Server 用的 IP (預設用連線的來源 IP)")
+    parser.add_argument("--ports", default="21050-21150", help="Game Server 可用的 port 範圍 (不含結尾)")
+    parser.add_argument("--dir", default=os.path.join(current_dir, "agent_games"), help="遊戲檔案解壓位置")
+    args = parser.parse_args()
+    secret = os.environ.get("LOBBY_AGENT_SECRET", "")
+    if not secret:
+        parser.error("set LOBBY_AGENT_SECRET (the same value as on the Lobby)")
+
+    host, _, port = args.lobby.rpartition(":")
+    start, _, end = args.ports.partition("-")
+    os.makedirs(args.dir, exist_ok=True)
+    agent = Agent((host or "127.0.0.1", int(port)), args.name, args.address, PortPool(int(start), int(end)),
+                  args.dir, secret)
+    try:
+        agent.run()
+    except KeyboardInterrupt:
+        agent.stop_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,111 @@
 import socket
+import select
 import threading
 import sys
 import os
+import time
+import signal
+import argparse
+import tempfile
+import subprocess
 
 # --- 路徑設定 ---
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(current_dir)
 sys.path.append(project_root)
 
-from common.utils import send_json, recv_json
+from common.utils import send_json, recv_json, set_keepalive, DEAD_PEER_ERRNOS
 from common.protocol import Protocol
 
 # 引入服務模組
 from server.services import auth
 from server.services import store
 from server.services import lobby
+from server.services import retention
+from server.services import metrics
+from server.services import popularity
+from server.services import prewarm
+from server.services import hosting
+from server.services import supervisor
+from server.services import matchmaking
+from server.services import events
+from server.services import sessions
+from server.services import state
+from server.services import agents
+from server.services import reports
+from server.services import spawner
+from server.services import warmup
+from server.services import throttle
 from server.services.db import db_instance
 
 HOST = '0.0.0.0'
-PORT = 30800
+PORT = int(os.environ.get("LOBBY_PORT", 30800))
 
-# 線上使用者追蹤 { "username:role": ("ip", port) }
-online_users = {}
-online_lock = threading.Lock()
+# 多 worker 模式 (--workers N)：N 個 worker process 用 SO_REUSEPORT 一起 accept 同一個 port，
+# 房間 / 線上名單 / port pool / Game Server 都在主 process (coordinator)，worker 經由這個 Unix socket 存取
+WORKERS = int(os.environ.get("LOBBY_WORKERS", 1))
+STATE_SOCKET = os.environ.get("LOBBY_STATE_SOCKET", os.path.join(tempfile.gettempdir(), f"lobby-state-{PORT}.sock"))
+
+# 連線存活偵測
+#   Client 每 HEARTBEAT_INTERVAL 秒送一次 PING (登入回覆會告訴 client 間隔)；
+#   超過 IDLE_TIMEOUT 秒完全沒收到東西就踢掉連線 (釋放 thread、線上名單、房間)。
+#   TCP keepalive 再多擋一層：對方整台消失時 kernel 也會把連線斷掉。
+HEARTBEAT_INTERVAL = int(os.environ.get("LOBBY_HEARTBEAT_INTERVAL", 30))
+IDLE_TIMEOUT = int(os.environ.get("LOBBY_IDLE_TIMEOUT", HEARTBEAT_INTERVAL * 3))
+KEEPALIVE_IDLE = int(os.environ.get("LOBBY_KEEPALIVE_IDLE", 60))
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 3
+
+# 這個 process 目前開著的 client 連線數 (線上名單在 services/sessions.py)
+open_connections = 0
+open_lock = threading.Lock()
+
+def connection_stats():
+    stats = {"open": open_connections, "heartbeat_interval": HEARTBEAT_INTERVAL, "idle_timeout": IDLE_TIMEOUT}
+    if not state.is_worker():
+        stats["online_users"] = sessions.count()
+    return stats
+
+metrics.register_source("connections", connection_stats)
+
+def _shared(fn, *args):
+    """呼叫共享狀態 (房間 / 配對)；多 worker 模式下 coordinator 連不上時回錯誤，不要讓連線斷掉"""
+    try:
+        return state.call(fn, *args)
+    except state.StateError as e:
+        print(f"[ERROR] {e}")
+        return {"status": Protocol.STATUS_ERROR, "message": "Lobby is temporarily unavailable. Please retry."}
+
+class IdleTimeout(Exception):
+    pass
 
 def handle_client(conn, addr):
+    global open_connections
     print(f"[NEW CONNECTION] {addr} connected.")
+    with open_lock:
+        open_connections += 1
+    # 線上名單裡代表這條連線的字串 (多 worker 時要分得出是哪個 process)
+    owner = f"{os.getpid()}:{addr[0]}:{addr[1]}"
     
     current_user = None 
     user_key = None
     current_room_id = None # 記錄目前所在的房間 ID
+    # 推播 (SUBSCRIBE) 會從別的 thread 寫同一條連線，回覆跟推播都要拿這個 lock
+    send_lock = threading.Lock()
+    subscriber = None
+    # 每類指令的頻率限制；transfer_user 不是 None 代表手上有一個下載 / 上傳名額 (回覆送完才還)
+    limiter = throttle.Limiter()
+    transfer_user = None
+
+    # 閒置逾時只管「等下一個請求」：用 select 等，不用 settimeout (那會變成每個 sendall 的期限，
+    # 慢的 client 下載大檔會被砍掉)
+    conn.settimeout(None)
+    set_keepalive(conn, KEEPALIVE_IDLE, KEEPALIVE_INTERVAL, KEEPALIVE_COUNT)
     
     try:
         while True:
+            if not select.select([conn], [], [], IDLE_TIMEOUT)[0]:
+                raise IdleTimeout()
             # 接收請求
             request = recv_json(conn)
             
@@ -42,13 +115,22 @@ def handle_client(conn, addr):
                 break
             
             cmd = request.get("cmd")
-            # Debug Log: 印出收到的指令
-            print(f"[{addr}] Received CMD: {cmd}") 
+            # Debug Log: 印出收到的指令 (心跳太頻繁不印)
+            if cmd != Protocol.CMD_PING:
+                print(f"[{addr}] Received CMD: {cmd}") 
 
             response = {}
+            limited = limiter.check(cmd)
+
+            if limited:
+                response = limited
+
+            # ==================== Heartbeat ====================
+            elif cmd == Protocol.CMD_PING:
+                response = {"cmd": Protocol.CMD_PONG}
 
             # ==================== Auth (驗證) ====================
-            if cmd == Protocol.CMD_REGISTER:
+            elif cmd == Protocol.CMD_REGISTER:
                 response = auth.handle_register(request)
             
             elif cmd == Protocol.CMD_LOGIN_DEV or cmd == Protocol.CMD_LOGIN_PLAYER:
@@ -61,21 +143,15 @@ def handle_client(conn, addr):
                     username = auth_resp["username"]
                     temp_key = f"{username}:{role}"
                     
-                    # 檢查重複登入
-                    is_duplicate = False
-                    with online_lock:
-                        if temp_key in online_users:
-                            existing_addr = online_users[temp_key]
-                            if existing_addr != addr:
-                                is_duplicate = True
-                        
-                        if not is_duplicate:
-                            online_users[temp_key] = addr
-                    
-                    if is_duplicate:
+                    # 檢查重複登入 (多 worker 時由 coordinator 統一判斷)
+                    claimed = _shared("claim_login", temp_key, owner)
+                    if isinstance(claimed, dict):
+                        response = claimed  # coordinator 連不上
+                    elif not claimed:
                         response = {"status": Protocol.STATUS_ERROR, "message": "帳號已在其他地方登入。"}
                     else:
                         response = auth_resp
+                        response["heartbeat_interval"] = HEARTBEAT_INTERVAL
                         current_user = {
                             "id": response["user_id"],
                             "username": response["username"],
@@ -91,9 +167,15 @@ def handle_client(conn, addr):
                 if not current_user or current_user["role"] != "dev":
                     response = {"status": Protocol.STATUS_ERROR, "message": "Permission denied."}
                 else:
-                    print(f"[{addr}] Processing Upload...")
-                    response = store.handle_upload_game(request, current_user["id"])
-                    print(f"[{addr}] Upload result: {response.get('status')}")
+                    wait_error = throttle.acquire_transfer(current_user["username"])
+                    if wait_error:
+                        response = {"status": Protocol.STATUS_ERROR, "message": wait_error,
+                                    "retry_after": throttle.TRANSFER_RETRY_AFTER}
+                    else:
+                        transfer_user = current_user["username"]
+                        print(f"[{addr}] Processing Upload...")
+                        response = store.handle_upload_game(request, current_user["id"])
+                        print(f"[{addr}] Upload result: {response.get('status')}")
 
             elif cmd == Protocol.CMD_UPDATE_GAME:
                 if not current_user or current_user["role"] != "dev":
@@ -119,14 +201,20 @@ def handle_client(conn, addr):
                 if not current_user:
                      response = {"status": Protocol.STATUS_ERROR, "message": "Please login first."}
                 else:
-                    response = store.handle_list_games()
+                    response = store.handle_list_games(request)
 
             elif cmd == Protocol.CMD_DOWNLOAD_GAME:
                 if not current_user:
                     response = {"status": Protocol.STATUS_ERROR, "message": "Please login first."}
                 else:
-                    print(f"[{addr}] Processing Download...")
-                    response = store.handle_download_game(request)
+                    wait_error = throttle.acquire_transfer(current_user["username"])
+                    if wait_error:
+                        response = {"status": Protocol.STATUS_ERROR, "message": wait_error,
+                                    "retry_after": throttle.TRANSFER_RETRY_AFTER}
+                    else:
+                        transfer_user = current_user["username"]
+                        print(f"[{addr}] Processing Download...")
+                        response = store.handle_download_game(request)
 
             # ==================== Lobby (大廳 / 房間) ====================
             elif cmd == Protocol.CMD_CREATE_ROOM:
@@ -134,28 +222,48 @@ def handle_client(conn, addr):
                     response = {"status": Protocol.STATUS_ERROR, "message": "Login first."}
                 else:
                     gid = request.get("game_id")
-                    response = lobby.handle_create_room(current_user["id"], current_user["username"], gid)
+                    response = _shared("create_room", current_user["id"], current_user["username"], gid)
                     if response["status"] == Protocol.STATUS_OK:
                         current_room_id = response["room_id"]
 
             elif cmd == Protocol.CMD_LIST_ROOMS:
-                response = lobby.handle_list_rooms()
+                filters = {k: request[k] for k in ("game_id", "version", "host", "open", "sort", "limit")
+                           if k in request}
+                response = _shared("list_rooms", filters)
 
             elif cmd == Protocol.CMD_JOIN_ROOM:
                 if not current_user:
                     response = {"status": Protocol.STATUS_ERROR, "message": "Login first."}
                 else:
                     rid = request.get("room_id")
-                    response = lobby.handle_join_room(rid, current_user["id"], current_user["username"])
+                    response = _shared("join_room", rid, current_user["id"], current_user["username"])
                     if response["status"] == Protocol.STATUS_OK:
                         current_room_id = rid
 
+            elif cmd == Protocol.CMD_QUEUE_MATCH:
+                if not current_user:
+                    response = {"status": Protocol.STATUS_ERROR, "message": "Login first."}
+                else:
+                    response = _shared("queue_match", current_user["id"], current_user["username"],
+                                       request.get("game_id"), request.get("timeout"))
+                    if response["status"] == Protocol.STATUS_OK:
+                        current_room_id = response["room_id"]
+
+            elif cmd == Protocol.CMD_QUICK_JOIN:
+                if not current_user:
+                    response = {"status": Protocol.STATUS_ERROR, "message": "Login first."}
+                else:
+                    response = _shared("quick_join", request.get("game_id"), current_user["id"],
+                                       current_user["username"])
+                    if response["status"] == Protocol.STATUS_OK:
+                        current_room_id = response["room_id"]
+
             elif cmd == Protocol.CMD_LEAVE_ROOM:
                 if not current_user:
                     response = {"status": Protocol.STATUS_ERROR, "message": "Login first."}
                 else:
                     rid = request.get("room_id")
-                    response = lobby.handle_leave_room(rid, current_user["username"])
+                    response = _shared("leave_room", rid, current_user["username"])
                     if response["status"] == Protocol.STATUS_OK:
                         current_room_id = None
 
@@ -164,11 +272,34 @@ def handle_client(conn, addr):
                 if not current_user or current_user["role"] != "player":
                     response = {"status": Protocol.STATUS_ERROR, "message": "Permission denied."}
                 else:
-                    response = store.handle_review_game(request, current_user["id"])
+                    response = store.handle_review_game(request, current_user["id"], current_user["username"])
 
             elif cmd == Protocol.CMD_GET_REVIEWS:
                 response = store.handle_get_reviews(request)
+
+            # ==================== Push (訂閱推播) ====================
+            elif cmd == Protocol.CMD_SUBSCRIBE:
+                if not current_user:
+                    response = {"status": Protocol.STATUS_ERROR, "message": "Login first."}
+                else:
+                    if subscriber is None:
+                        subscriber = events.Subscriber(conn, send_lock)
+                    response = events.handle_subscribe(subscriber, request)
+
+            elif cmd == Protocol.CMD_UNSUBSCRIBE:
+                response = events.handle_unsubscribe(subscriber, request)
             
+            # ==================== Metrics ====================
+            elif cmd == Protocol.CMD_STATS:
+                if not current_user:
+                    response = {"status": Protocol.STATUS_ERROR, "message": "Login first."}
+                else:
+                    stats = metrics.snapshot()
+                    if state.is_worker():
+                        stats["worker_pid"] = os.getpid()
+                        stats["coordinator"] = _shared("stats")
+                    response = {"status": Protocol.STATUS_OK, "stats": stats}
+
             # ==================== Default ====================
             else:
                 response = {
@@ -176,52 +307,201 @@ def handle_client(conn, addr):
                     "message": f"Unknown command: {cmd}"
                 }
 
-            send_json(conn, response)
+            # client 帶了 seq 就原樣帶回，讓它認得出逾時後才到的舊回覆
+            if "seq" in request:
+                response["seq"] = request["seq"]
 
+            if transfer_user is None:
+                with send_lock:
+                    send_json(conn, response)
+            else:
+                # 大檔分塊控速送，送完才把名額交給下一個
+                try:
+                    with send_lock:
+                        throttle.send_paced(conn, response)
+                finally:
+                    throttle.release_transfer(transfer_user)
+                    transfer_user = None
+
+    except IdleTimeout:
+        # 超過 IDLE_TIMEOUT 沒有任何封包 (連 PING 都沒有)
+        who = current_user["username"] if current_user else "anonymous"
+        print(f"[EVICT] {addr} ({who}) idle for more than {IDLE_TIMEOUT}s. Closing.")
+        metrics.incr("lobby.connections_evicted")
+        metrics.incr("lobby.connections_idle_evicted")
+    except OSError as e:
+        if e.errno not in DEAD_PEER_ERRNOS:
+            print(f"[ERROR] Socket error on client {addr}: {e}")
+        else:
+            # TCP keepalive 偵測到對方已消失 (整台關機、拔網路線)
+            who = current_user["username"] if current_user else "anonymous"
+            print(f"[EVICT] {addr} ({who}) unreachable ({e}). Closing.")
+            metrics.incr("lobby.connections_evicted")
+            metrics.incr("lobby.connections_keepalive_dropped")
     except Exception as e:
         print(f"[ERROR] Exception handling client {addr}: {e}")
         import traceback
         traceback.print_exc()
     finally:
+        if transfer_user is not None:
+            throttle.release_transfer(transfer_user)
+
         # 清除線上狀態
         if user_key:
-            with online_lock:
-                if user_key in online_users and online_users[user_key] == addr:
-                    del online_users[user_key]
+            _shared("release_login", user_key, owner)
         
+        if subscriber is not None:
+            events.unsubscribe(subscriber)
+
         # 斷線時觸發離開房間
         if current_room_id and current_user:
             print(f"[{addr}] User {current_user['username']} disconnected. Leaving room {current_room_id}...")
-            lobby.handle_leave_room(current_room_id, current_user["username"])
+            _shared("leave_room", current_room_id, current_user["username"])
 
         conn.close()
+        with open_lock:
+            open_connections -= 1
         print(f"[DISCONNECT] {addr} disconnected.")
 
-def start_server():
+def _listen(reuse_port=False):
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    
+    if reuse_port:
+        # 每個 worker 各自 bind 同一個 port，kernel 把新連線分給它們
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server.bind((HOST, PORT))
+    server.listen()
+    return server
+
+def _accept_loop(server):
+    while True:
+        conn, addr = server.accept()
+        thread = threading.Thread(target=handle_client, args=(conn, addr))
+        thread.daemon = True 
+        thread.start()
+
+def _start_background():
+    """房間 / Game Server 相關的背景工作，只在持有共享狀態的 process 跑"""
+    # Game Server 的狀態回報通道 (路徑用環境變數傳給之後開的 Game Server)
+    spawner.GAME_ENV.update(reports.start(os.path.join(hosting.CONTROL_DIR, "reports.sock")))
+    # 重新接管上次 Lobby 關閉 (或當掉) 時還在跑的房間
+    restored = lobby.restore_rooms()
+    print(f"[INFO] Restored {restored} rooms from journal.")
+
+    # 背景清理舊版本 ZIP 與解壓目錄
+    retention.start_gc_thread()
+    # 熱門度計數定期寫入 DB
+    popularity.start_flush_thread()
+    # 熱門版本的 Game Server 預熱池
+    prewarm.start()
+    # 回收/監看 Game Server process
+    supervisor.start()
+    # 配對佇列
+    matchmaking.start()
+    # 回收閒置房間
+    lobby.start_reaper()
+    # 等 game host agent (server/agent.py) 連上來，開房時分散到各台
+    agents.start()
+
+def _run_workers(count):
+    """主 process：開 count 個 worker，掛掉就重開 (它的登入紀錄與玩家所在的房間一起清掉)"""
+    workers = {}
+
+    def spawn(slot):
+        argv = [sys.executable, os.path.abspath(__file__), "--worker", STATE_SOCKET]
+        workers[slot] = subprocess.Popen(argv, cwd=project_root)
+
+    for slot in range(count):
+        spawn(slot)
+    print(f"[STARTING] {count} workers accepting on {HOST}:{PORT} (SO_REUSEPORT)")
+    try:
+        while True:
+            time.sleep(1)
+            for slot, proc in list(workers.items()):
+                if proc.poll() is None:
+                    continue
+                dropped = sessions.release_owner_prefix(f"{proc.pid}:")
+                # worker 沒機會替斷掉的連線 LEAVE_ROOM，這裡代它離開
+                left = 0
+                for key in dropped:
+                    username, _, role = key.rpartition(":")
+                    if role != "player":
+                        continue
+                    for room in lobby.rooms.rooms_of_player(username):
+                        if lobby.handle_leave_room(room.room_id, username)["status"] == Protocol.STATUS_OK:
+                            left += 1
+                print(f"[WORKER] pid {proc.pid} exited ({proc.returncode}), released {len(dropped)} logins "
+                      f"and {left} room seats. Restarting...")
+                metrics.incr("lobby.worker_restarts")
+                spawn(slot)
+    finally:
+        for proc in workers.values():
+            proc.terminate()
+        for proc in workers.values():
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+def run_worker(state_socket):
+    """worker process：只處理 client 連線，共享狀態都問 coordinator"""
+    # 主 process 用 terminate() 關 worker：當成 Ctrl+C 處理，下載計數才會寫回 DB
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    state.connect(state_socket)
+    # 解壓 coordinator 做過了，這裡只暖這個 process 自己的快取 (商城排行、熱門 ZIP)；暖完才 listen
+    warmup.run(extract=False)
+    popularity.start_flush_thread()
+    server = _listen(reuse_port=True)
+    print(f"[WORKER {os.getpid()}] Ready, listening on {HOST}:{PORT}")
+    try:
+        _accept_loop(server)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        popularity.flush()
+        server.close()
+
+def start_server(workers=WORKERS):
+    if workers > 1 and not (hasattr(socket, "SO_REUSEPORT") and hasattr(socket, "AF_UNIX")):
+        print("[WARN] SO_REUSEPORT / Unix sockets not available on this platform. Running a single process.")
+        workers = 1
+
+    server = None
     try:
-        server.bind((HOST, PORT))
-        server.listen()
-        print(f"[STARTING] Server is listening on {HOST}:{PORT}")
-        print(f"[INFO] Database checked/initialized.")
-        
         storage_path = os.path.join(project_root, 'server', 'storage', 'games')
         if not os.path.exists(storage_path):
             os.makedirs(storage_path)
+        print(f"[INFO] Database checked/initialized.")
         print(f"[INFO] Storage directory: {storage_path}")
 
-        while True:
-            conn, addr = server.accept()
-            thread = threading.Thread(target=handle_client, args=(conn, addr))
-            thread.daemon = True 
-            thread.start()
+        # 開機暖身 (平行解壓、預熱快取，有時間上限)；做完才開始接受連線，port 通了就代表已就緒
+        if workers > 1:
+            warmup.run(caches=False)
+            state.serve(STATE_SOCKET)
+            _start_background()
+            _run_workers(workers)
+        else:
+            warmup.run()
+            _start_background()
+            server = _listen()
+            print(f"[READY] Server is listening on {HOST}:{PORT}")
+            _accept_loop(server)
             
     except KeyboardInterrupt:
         print("\n[SHUTDOWN] Server is shutting down...")
     finally:
-        server.close()
+        popularity.flush()
+        prewarm.drain_all()
+        hosting.drain_all()
+        if server:
+            server.close()
 
 if __name__ == "__main__":
-    start_server()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=WORKERS, help="worker process 數 (1 = 單 process)")
+    parser.add_argument("--worker", metavar="STATE_SOCKET", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        run_worker(args.worker)
+    else:
+        start_server(args.workers)
@@ -0,0 +1,110 @@
+import os
+import time
+import threading
+from collections import deque
+from server.services import metrics
+
+# 開房名額控制 (admission control)
+#   - 全域上限 MAX_ROOMS：同時存在的房間數，滿了的 CREATE_ROOM 依先來後到排隊，
+#     有房間關掉就把名額直接交給排最前面的人 (不會被後來的插隊)，等超過 ADMISSION_WAIT 秒就放棄
+#   - 每個玩家上限 MAX_ROOMS_PER_USER：自己開的 (host) 房間數，超過直接拒絕，不排隊
+# 開房失敗或房間關閉都要 release()，名額才會還回來。
+
+MAX_ROOMS = int(os.environ.get("LOBBY_MAX_ROOMS", 80))
+MAX_ROOMS_PER_USER = int(os.environ.get("LOBBY_MAX_ROOMS_PER_USER", 2))
+ADMISSION_WAIT = float(os.environ.get("LOBBY_ADMISSION_WAIT", 10))
+
+# 排隊等待時間分布 (秒)
+WAIT_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30)
+
+
+class _Waiter:
+    __slots__ = ("username", "event", "granted")
+
+    def __init__(self, username):
+        self.username = username
+        self.event = threading.Event()
+        self.granted = False
+
+
+_active = 0        # 已發出的名額 (= 房間數 + 正在開的)
+_per_user = {}     # username -> 名額數 (含排隊中的)
+_waiters = deque()
+_lock = threading.Lock()
+
+
+def acquire(username, timeout=ADMISSION_WAIT):
+    """取得一個開房名額；成功回傳 None，失敗回傳錯誤訊息"""
+    global _active
+    with _lock:
+        if _per_user.get(username, 0) >= MAX_ROOMS_PER_USER:
+            metrics.incr("admission.rejected_user_limit")
+            return f"You can host at most {MAX_ROOMS_PER_USER} rooms at a time."
+        _per_user[username] = _per_user.get(username, 0) + 1
+        if _active < MAX_ROOMS and not _waiters:
+            _active += 1
+            metrics.incr("admission.admitted")
+            return None
+        waiter = _Waiter(username)
+        _waiters.append(waiter)
+    metrics.incr("admission.queued")
+
+    start = time.monotonic()
+    waiter.event.wait(timeout)
+    with _lock:
+        if not waiter.granted:
+            _waiters.remove(waiter)
+            _drop_user(username)
+            metrics.incr("admission.timeouts")
+            return "Server is busy (room limit reached). Please try again later."
+    metrics.incr("admission.admitted")
+    metrics.observe("admission.wait_seconds", time.monotonic() - start, WAIT_BUCKETS)
+    return None
+
+
+def at_user_limit(username):
+    """這個玩家自己開的房間是不是已經到 MAX_ROOMS_PER_USER (不能再當房主，但還可以加入別人的房間)"""
+    with _lock:
+        return _per_user.get(username, 0) >= MAX_ROOMS_PER_USER
+
+
+def _drop_user(username):
+    count = _per_user.get(username, 0) - 1
+    if count > 0:
+        _per_user[username] = count
+    else:
+        _per_user.pop(username, None)
+
+
+def release(username):
+    """歸還名額 (開房失敗或房間關閉時呼叫)；有人在排隊就直接交給他"""
+    global _active
+    with _lock:
+        _drop_user(username)
+        if _waiters:
+            waiter = _waiters.popleft()
+            waiter.granted = True
+            waiter.event.set()
+        else:
+            _active = max(0, _active - 1)
+
+
+def reserve(username):
+    """重啟後接管回來的房間直接佔名額 (不檢查上限、不排隊)"""
+    global _active
+    with _lock:
+        _active += 1
+        _per_user[username] = _per_user.get(username, 0) + 1
+
+
+def stats():
+    with _lock:
+        return {
+            "active": _active,
+            "limit": MAX_ROOMS,
+            "per_user_limit": MAX_ROOMS_PER_USER,
+            "waiting": len(_waiters),
+        }
+
+
+metrics.register_source("admission", stats)
@@ -0,0 +1,418 @@
+import os
+import hmac
+import time
+import socket
+import itertools
+import threading
+from common.utils import send_json, recv_json, set_keepalive
+from server.services import metrics
+from server.services import pipeline
+from server.services import spawner
+from server.services.artifact_cache import artifact_cache
+
+# Game host agent (server/agent.py)：在別台機器上開 / 回收 Game Server
+#   agent 連到 Lobby 的 AGENT_PORT 註冊，之後每 REPORT_INTERVAL 秒回報負載；Lobby 開房時挑最閒的 agent。
+#   length-prefixed JSON (同 common/utils)，一條連線雙向使用：
+#     agent -> {"op": "register", "name", "address", "cpu_count", "versions": [...], "secret",
+#               "processes": [{"pid", "port"}, ...]}  <- {"ok": true}
+#     agent -> {"op": "report", "load", "free_ports", "players": {port: 人數}, "versions": [...]}
+#     agent -> {"op": "exited", "pid", "code"}              (Game Server 結束)
+#     agent -> {"op": "reply", "id", "ok", ...}             (回覆 Lobby 的請求)
+#     lobby -> {"op": "spawn", "id", "version": "Snake_3.3", "zip": base64 或 null}  <- {"pid", "port"}
+#     lobby -> {"op": "stop", "pid", "kill": false}
+#   agent 還沒有某版本的檔案時 spawn 會附上 ZIP (從 artifact_cache 拿)，之後 agent 就有了。
+#   agent 斷線時上面的 Game Server 先留著 (agent 那邊也會等 AGENT_GRACE 秒)：同名 agent 重新註冊時帶上還在跑的
+#   process，Lobby 接回對得上的、關掉沒人認領的；逾時沒回來才當作全部結束。Lobby 重啟時 restore() 從 journal
+#   建回斷線狀態的 agent，等它連上來接回房間。
+# agent 會拿到遊戲 ZIP，它回報的 address 也會直接給玩家連，所以一定要設 LOBBY_AGENT_SECRET (兩邊一樣) 才會開這個 port；
+# 同名的 agent 還活著 (REPORT_TIMEOUT 內有回報) 時新的註冊會被拒絕，不會把正在用的 agent 踢掉。
+
+AGENT_HOST = os.environ.get("LOBBY_AGENT_HOST", "0.0.0.0")
+AGENT_PORT = int(os.environ.get("LOBBY_AGENT_PORT", 30810))
+AGENT_SECRET = os.environ.get("LOBBY_AGENT_SECRET", "")
+REPORT_INTERVAL = 5
+REPORT_TIMEOUT = REPORT_INTERVAL * 3  # 這麼久沒收到任何訊息就當 agent 斷線了
+AGENT_GRACE = float(os.environ.get("LOBBY_AGENT_GRACE", 120))  # 斷線後等它重新註冊多久 (agent 那邊用同一個值)
+SPAWN_TIMEOUT = spawner.READY_TIMEOUT + 30  # 含傳 ZIP 與解壓
+
+
+class AgentError(Exception):
+    pass
+
+
+class Agent:
+    __slots__ = ("name", "address", "conn", "send_lock", "cpu_count", "load", "free_ports", "players",
+                 "versions", "processes", "spawning", "pending", "closed", "last_report", "detached_at")
+
+    def __init__(self, name, address, conn, cpu_count, versions):
+        self.name = name
+        self.address = address      # 玩家連 Game Server 用的 IP
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        self.cpu_count = max(1, int(cpu_count or 1))
+        self.load = 0.0
+        self.free_ports = None      # None = 還沒回報過
+        self.players = {}           # "port" -> 連線數 (最近一次回報)
+        self.versions = set(versions or ())
+        self.processes = {}         # pid -> RemoteProcess
+        self.spawning = 0           # 正在開的 Game Server (還沒算進 processes 也要算負載)
+        self.pending = {}           # request id -> [Event, reply]
+        self.closed = False         # 逾時沒重連，上面的 Game Server 都當作結束了
+        self.last_report = time.monotonic()
+        self.detached_at = None     # 斷線的時間 (conn 是 None)；等重新註冊
+
+    def score(self):
+        """越小越閒：每顆 CPU 分到的 load + Game Server 數"""
+        return (self.load + len(self.processes) + self.spawning) / self.cpu_count
+
+    def summary(self):
+        return {
+            "name": self.name,
+            "address": self.address,
+            "cpu_count": self.cpu_count,
+            "load": self.load,
+            "free_ports": self.free_ports,
+            "game_servers": len(self.processes),
+            "connected": self.conn is not None,
+            "score": round(self.score(), 3),
+        }
+
+
+class RemoteProcess:
+    """agent 上的 Game Server；介面跟 subprocess.Popen 一樣 (poll / terminate / kill)"""
+
+    def __init__(self, agent, pid, port, on_exit=None):
+        self.agent = agent
+        self.pid = pid
+        self.port = port
+        self.returncode = None
+        self.on_exit = on_exit
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        stop(self)
+
+    def kill(self):
+        stop(self, kill=True)
+
+
+_agents = {}   # name -> Agent
+_ids = itertools.count(1)
+_lock = threading.Lock()
+
+
+def _send(agent, message):
+    with agent.send_lock:
+        if agent.conn is None or not send_json(agent.conn, message):
+            raise AgentError(f"Agent {agent.name} unreachable.")
+
+
+def _request(agent, message, timeout):
+    rid = next(_ids)
+    waiter = [threading.Event(), None]
+    with _lock:
+        agent.pending[rid] = waiter
+    try:
+        _send(agent, dict(message, id=rid))
+        if not waiter[0].wait(timeout):
+            raise AgentError(f"Agent {agent.name} did not answer in {timeout:.0f}s.")
+    finally:
+        with _lock:
+            agent.pending.pop(rid, None)
+    reply = waiter[1]
+    if reply is None:
+        raise AgentError(f"Agent {agent.name} disconnected.")
+    if not reply.get("ok"):
+        raise AgentError(reply.get("error", "Agent request failed."))
+    return reply
+
+
+def pick():
+    """負載最低、還有空 port 的 agent；沒有 agent 回傳 None (開在 Lobby 本機)"""
+    with _lock:
+        candidates = [a for a in _agents.values() if not a.closed and a.conn is not None and a.free_ports != 0]
+        if not candidates:
+            return None
+        agent = min(candidates, key=Agent.score)
+        agent.spawning += 1
+    return agent
+
+
+def spawn(agent, run_dir, on_exit=None):
+    """
+    在 agent 上開一個 Game Server (呼叫前要先 pick()，不論成功失敗都會把 spawning 扣回來)。
+    回傳 RemoteProcess；失敗丟 AgentError。on_exit(code) 在 Game Server 結束或 agent 斷線時呼叫。
+    """
+    version = os.path.basename(run_dir)
+    try:
+        zip_b64 = None
+        if version not in agent.versions:
+            zip_b64 = artifact_cache.get_b64(os.path.join(pipeline.STORAGE_DIR, f"{version}.zip"))
+            metrics.incr("agents.artifact_pushed")
+        start = time.monotonic()
+        reply = _request(agent, {"op": "spawn", "version": version, "zip": zip_b64}, SPAWN_TIMEOUT)
+        process = RemoteProcess(agent, reply["pid"], reply["port"], on_exit)
+        with _lock:
+            agent.versions.add(version)
+            if agent.closed:
+                raise AgentError(f"Agent {agent.name} disconnected.")
+            agent.processes[process.pid] = process
+        metrics.observe("agents.spawn_seconds", time.monotonic() - start, spawner.READY_BUCKETS)
+        metrics.incr("agents.spawned")
+        return process
+    except OSError as e:
+        raise AgentError(f"Cannot read game ZIP for {version}: {e}")
+    finally:
+        with _lock:
+            agent.spawning -= 1
+
+
+def stop(process, kill=False):
+    """
+    請 agent 關掉 Game Server (不等它結束；之後也不會再呼叫 on_exit)。
+    agent 斷線中送不出去：它重新註冊時這個 pid 已經沒人認領，會在那時關掉。
+    """
+    agent = process.agent
+    with _lock:
+        if process.returncode is not None or agent.closed:
+            return
+        agent.processes.pop(process.pid, None)
+        process.returncode = -9 if kill else -15
+        if agent.conn is None:
+            return
+    try:
+        _send(agent, {"op": "stop", "pid": process.pid, "kill": kill})
+    except AgentError as e:
+        print(f"[Agents] {e}")
+
+
+def players_on(process):
+    """agent 最近一次回報的連線數；沒回報過回傳 None"""
+    return process.agent.players.get(str(process.port))
+
+
+def _process_exited(agent, pid, code):
+    with _lock:
+        process = agent.processes.pop(pid, None)
+        if process is None or process.returncode is not None:
+            return
+        process.returncode = code
+    if process.on_exit:
+        process.on_exit(code)
+
+
+def _detach(agent, conn, reason):
+    """連線斷了：Game Server 先留著，AGENT_GRACE 內重新註冊就接回來"""
+    with _lock:
+        if agent.closed or agent.conn is not conn:
+            return  # 已經被新的註冊接手了
+        agent.conn = None
+        agent.detached_at = time.monotonic()
+        waiters = list(agent.pending.values())
+        count = len(agent.processes)
+    for waiter in waiters:
+        waiter[0].set()
+    try:
+        conn.close()
+    except OSError:
+        pass
+    print(f"[Agents] Agent {agent.name} ({agent.address}) disconnected: {reason}. "
+          f"Keeping {count} game servers for {AGENT_GRACE:.0f}s.")
+    metrics.incr("agents.disconnected")
+
+
+def _drop(agent, reason):
+    """agent 不會回來了：上面的 Game Server 都當作結束"""
+    with _lock:
+        if agent.closed:
+            return
+        agent.closed = True
+        if _agents.get(agent.name) is agent:
+            del _agents[agent.name]
+        pids = list(agent.processes)
+    print(f"[Agents] Agent {agent.name} ({agent.address}) {reason}. {len(pids)} game servers lost.")
+    metrics.incr("agents.dropped")
+    for pid in pids:
+        _process_exited(agent, pid, -1)
+
+
+def expire_detached(grace=AGENT_GRACE):
+    """斷線超過 grace 秒還沒重新註冊的 agent 丟掉"""
+    now = time.monotonic()
+    with _lock:
+        expired = [a for a in _agents.values()
+                   if a.conn is None and a.detached_at is not None and now - a.detached_at > grace]
+    for agent in expired:
+        _drop(agent, f"did not come back in {grace:.0f}s")
+
+
+def _expire_loop():
+    while True:
+        time.sleep(REPORT_INTERVAL)
+        try:
+            expire_detached()
+        except Exception as e:
+            print(f"[Agents Error] {e}")
+
+
+def restore(name, address, pid, port, on_exit=None):
+    """
+    Lobby 重啟後從 journal 接回 agent 上的 Game Server：先掛在斷線狀態的 agent 上，
+    agent 重新註冊時回報的 process 裡有這個 pid 才算接回來，沒有就呼叫 on_exit(-1)。
+    沒開 agent port 回傳 None (agent 連不上來，房間不用接)。
+    """
+    if not AGENT_SECRET:
+        return None
+    with _lock:
+        agent = _agents.get(name)
+        if agent is None:
+            agent = Agent(name, address, None, None, ())
+            agent.detached_at = time.monotonic()
+            _agents[name] = agent
+        process = RemoteProcess(agent, pid, port, on_exit)
+        agent.processes[pid] = process
+    metrics.incr("agents.restored")
+    return process
+
+
+def _reattach(agent, conn, hello, live):
+    """同名 agent 重新註冊 (需持有 _lock)：換上新連線，回傳 (接不回來的 pid, 沒人認領的 pid)"""
+    stale = agent.conn
+    agent.conn = conn
+    agent.detached_at = None
+    agent.last_report = time.monotonic()
+    agent.address = hello.get("address") or agent.address
+    agent.cpu_count = max(1, int(hello.get("cpu_count") or agent.cpu_count))
+    agent.versions.update(hello.get("versions") or ())
+    lost = [pid for pid, process in agent.processes.items() if live.get(pid) != process.port]
+    unclaimed = [pid for pid in live if pid not in agent.processes]
+    waiters = list(agent.pending.values()) if stale is not None else []
+    return stale, waiters, lost, unclaimed
+
+
+def _serve_agent(conn, addr):
+    conn.settimeout(REPORT_TIMEOUT)
+    set_keepalive(conn)
+    try:
+        hello = recv_json(conn)
+    except socket.timeout:
+        hello = None
+    if not hello or hello.get("op") != "register":
+        conn.close()
+        return
+    secret = hello.get("secret")
+    if not AGENT_SECRET or not isinstance(secret, str) or \
+            not hmac.compare_digest(secret.encode('utf-8'), AGENT_SECRET.encode('utf-8')):
+        print(f"[Agents] Rejected agent registration from {addr[0]}: bad secret")
+        metrics.incr("agents.rejected")
+        send_json(conn, {"ok": False, "error": "Bad agent secret."})
+        conn.close()
+        return
+
+    name = str(hello.get("name") or f"{addr[0]}:{addr[1]}")
+    try:
+        live = {int(p["pid"]): int(p["port"]) for p in hello.get("processes") or ()}
+    except (TypeError, ValueError, KeyError):
+        live = {}
+    stale, waiters, lost, unclaimed = None, [], [], list(live)
+    with _lock:
+        old = _agents.get(name)
+        alive = old is not None and old.conn is not None and time.monotonic() - old.last_report <= REPORT_TIMEOUT
+        if alive:
+            agent = None
+        elif old is not None:
+            # 斷線中 (或逾時還沒發現) 的同一台 agent：接回原本的物件，房間手上的參考才不會失效
+            agent = old
+            stale, waiters, lost, unclaimed = _reattach(agent, conn, hello, live)
+        else:
+            agent = Agent(name, hello.get("address") or addr[0], conn, hello.get("cpu_count"), hello.get("versions"))
+            _agents[name] = agent
+    if agent is None:
+        # 同名 agent 還在回報：不讓新連線把它 (跟上面的房間) 踢掉，舊的逾時後才能重新註冊
+        print(f"[Agents] Rejected agent {name} from {addr[0]}: name in use")
+        metrics.incr("agents.rejected")
+        send_json(conn, {"ok": False, "error": f"Agent name '{name}' is already registered."})
+        conn.close()
+        return
+    if stale is not None:
+        for waiter in waiters:
+            waiter[0].set()
+        try:
+            stale.close()
+        except OSError:
+            pass
+    send_json(conn, {"ok": True, "report_interval": REPORT_INTERVAL})
+    if old is agent:
+        print(f"[Agents] Agent {name} re-registered ({agent.address}): {len(live) - len(unclaimed)} game servers "
+              f"reattached, {len(lost)} gone, {len(unclaimed)} unclaimed")
+        metrics.incr("agents.reattached")
+    else:
+        print(f"[Agents] Agent {name} registered ({agent.address}, {agent.cpu_count} CPUs)")
+        metrics.incr("agents.registered")
+    for pid in lost:
+        _process_exited(agent, pid, -1)
+    for pid in unclaimed:
+        # 斷線期間房間已經收掉 (或 Lobby 沒有紀錄)：請 agent 關掉
+        try:
+            _send(agent, {"op": "stop", "pid": pid})
+        except AgentError as e:
+            print(f"[Agents] {e}")
+
+    reason = "connection closed"
+    try:
+        while True:
+            msg = recv_json(conn)
+            if msg is None:
+                break
+            agent.last_report = time.monotonic()
+            op = msg.get("op")
+            if op == "report":
+                agent.load = float(msg.get("load") or 0)
+                agent.free_ports = msg.get("free_ports")
+                agent.players = msg.get("players") or {}
+                agent.versions.update(msg.get("versions") or ())
+            elif op == "exited":
+                _process_exited(agent, msg.get("pid"), msg.get("code"))
+            elif op == "reply":
+                with _lock:
+                    waiter = agent.pending.get(msg.get("id"))
+                if waiter:
+                    waiter[1] = msg
+                    waiter[0].set()
+    except socket.timeout:
+        reason = f"no report for {REPORT_TIMEOUT}s"
+    except Exception as e:
+        reason = str(e)
+    _detach(agent, conn, reason)
+
+
+def start(port=AGENT_PORT):
+    """開 agent port；沒設 LOBBY_AGENT_SECRET 就不開 (房間都開在 Lobby 本機)，回傳 None"""
+    if not AGENT_SECRET:
+        print("[Agents] LOBBY_AGENT_SECRET not set. Remote game host agents are disabled.")
+        return None
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((AGENT_HOST, port))
+    server.listen()
+
+    def accept_loop():
+        while True:
+            conn, addr = server.accept()
+            threading.Thread(target=_serve_agent, args=(conn, addr), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    threading.Thread(target=_expire_loop, daemon=True).start()
+    print(f"[Agents] Waiting for game host agents on {AGENT_HOST}:{port}")
+    return server
+
+
+def stats():
+    with _lock:
+        agents = [a.summary() for a in _agents.values()]
+    return {"agents": agents, "game_servers": sum(a["game_servers"] for a in agents)}
+
+
+metrics.register_source("agents", stats)
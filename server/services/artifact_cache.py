@@ -0,0 +1,90 @@
+import os
+import base64
+import threading
+from collections import OrderedDict
+
+# 熱門遊戲 ZIP 的記憶體快取 (LRU，以 bytes 為上限)
+# 直接存 base64 後的字串，DOWNLOAD_GAME 命中時連編碼都省了
+
+DEFAULT_BUDGET_BYTES = 256 * 1024 * 1024
+
+
+class ArtifactCache:
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self.entries = OrderedDict()  # (path, size, mtime_ns) -> b64 str
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        # 同一個檔案同時 miss 時只讓一個人讀硬碟
+        self.loading = {}
+
+    def _key(self, path):
+        st = os.stat(path)
+        return (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+    def get_b64(self, path):
+        """取得檔案的 base64 內容 (命中快取就不碰硬碟)"""
+        key = self._key(path)
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return data
+            self.misses += 1
+            load_lock = self.loading.setdefault(key, threading.Lock())
+
+        with load_lock:
+            with self.lock:
+                data = self.entries.get(key)
+                if data is not None:
+                    return data
+            try:
+                with open(path, "rb") as f:
+                    data = base64.b64encode(f.read()).decode('utf-8')
+                with self.lock:
+                    self._put(key, data)
+                return data
+            finally:
+                with self.lock:
+                    self.loading.pop(key, None)
+
+    def _put(self, key, data):
+        size = len(data)
+        if size > self.budget_bytes:
+            return  # 太大就不快取
+        # 同一路徑的舊內容 (檔案被覆蓋) 先移除
+        for old in [k for k in self.entries if k[0] == key[0]]:
+            self.used_bytes -= len(self.entries.pop(old))
+        self.entries[key] = data
+        self.used_bytes += size
+        while self.used_bytes > self.budget_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.used_bytes -= len(evicted)
+            self.evictions += 1
+
+    def invalidate(self, path):
+        """移除某個檔案的快取 (版本被取代時呼叫)"""
+        abs_path = os.path.abspath(path)
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == abs_path]:
+                self.used_bytes -= len(self.entries.pop(key))
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "used_bytes": self.used_bytes,
+                "budget_bytes": self.budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 3) if total else 0,
+            }
+
+
+artifact_cache = ArtifactCache()
@@ -4,14 +4,19 @@ import sqlite3
 import hashlib
 import os
 import datetime
+import threading
 
 # 設定資料庫路徑
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'db.sqlite3')
+DB_PATH = os.environ.get("LOBBY_DB", os.path.join(os.path.dirname(os.path.dirname(__file__)), 'db.sqlite3'))
 
 class Database:
     def __init__(self):
         self.conn = sqlite3.connect(DB_PATH, check_same_thread=False)
         self.create_tables()
+        # 計數批次寫入用自己的連線：self.conn 是所有 thread 共用的，別的 thread 的 commit / rollback
+        # 會把寫到一半的批次一起送出或一起丟掉 (失敗重試時就重複計數了)
+        self._stats_conn = None
+        self._stats_lock = threading.Lock()
 
     def create_tables(self):
         cursor = self.conn.cursor()
@@ -67,6 +72,36 @@ class Database:
             )
         ''')
         
+        # 5. Game Versions (每次上架/更新的檔案紀錄，用於保留最近幾版與清理舊檔)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS game_versions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                game_id INTEGER,
+                version TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY(game_id) REFERENCES games(id)
+            )
+        ''')
+        
+        # 6. Game Stats (下載/開房/玩家數，由 popularity 批次寫入)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS game_stats (
+                game_id INTEGER PRIMARY KEY,
+                downloads INTEGER DEFAULT 0,
+                rooms_created INTEGER DEFAULT 0,
+                unique_players INTEGER DEFAULT 0,
+                FOREIGN KEY(game_id) REFERENCES games(id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS game_players (
+                game_id INTEGER,
+                player_id INTEGER,
+                PRIMARY KEY(game_id, player_id)
+            )
+        ''')
+
         self.conn.commit()
 
     # ================= Auth =================
@@ -88,20 +123,37 @@ class Database:
         return row[0] if row else None
 
     # ================= Game Management =================
-    def add_game(self, name, version, dev_id, description, file_path):
+    def add_game(self, name, version, dev_id, description, file_path, active=True):
+        """新增遊戲；同名遊戲已存在 (包含別的 process 剛新增的) 回傳 False"""
         try:
-            self.conn.execute('''
+            cursor = self.conn.execute('''
                 INSERT INTO games (name, version, developer_id, description, file_path, is_active)
-                VALUES (?, ?, ?, ?, ?, 1)
-            ''', (name, version, dev_id, description, file_path))
+                SELECT ?, ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM games WHERE name=?)
+            ''', (name, version, dev_id, description, file_path, 1 if active else 0, name))
+            if cursor.rowcount != 1:
+                self.conn.rollback()
+                return False
+            self.conn.execute('INSERT INTO game_versions (game_id, version, file_path) VALUES (?, ?, ?)',
+                              (cursor.lastrowid, version, file_path))
             self.conn.commit()
             return True
         except: return False
 
-    def update_game_version(self, game_id, new_version, new_desc, new_file_path):
+    def update_game_version(self, game_id, new_version, new_desc, new_file_path, expect_version=None):
+        """換版本；有給 expect_version 時目前版本不是它 (被別的上傳先改了) 就不動，回傳 False"""
         try:
-            self.conn.execute('UPDATE games SET version=?, description=?, file_path=? WHERE id=?', 
-                              (new_version, new_desc, new_file_path, game_id))
+            if expect_version is None:
+                cursor = self.conn.execute('UPDATE games SET version=?, description=?, file_path=? WHERE id=?',
+                                           (new_version, new_desc, new_file_path, game_id))
+            else:
+                cursor = self.conn.execute('UPDATE games SET version=?, description=?, file_path=? '
+                                           'WHERE id=? AND version=?',
+                                           (new_version, new_desc, new_file_path, game_id, expect_version))
+            if cursor.rowcount != 1:
+                self.conn.rollback()
+                return False
+            self.conn.execute('INSERT INTO game_versions (game_id, version, file_path) VALUES (?, ?, ?)',
+                              (game_id, new_version, new_file_path))
             self.conn.commit()
             return True
         except: return False
@@ -132,6 +184,92 @@ class Database:
         row = cursor.fetchone()
         return (row[0], row[1], bool(row[2])) if row else None
 
+    # ================= Popularity =================
+    def apply_game_stats(self, batch):
+        """
+        批次寫入計數: batch = {game_id: {"downloads": n, "rooms": n, "players": set()}}
+        players 同時寫入 play_history；整批在同一個 transaction，要嘛全寫進去要嘛全部沒寫
+        """
+        with self._stats_lock:
+            if self._stats_conn is None:
+                self._stats_conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=30)
+            try:
+                with self._stats_conn as conn:
+                    self._write_game_stats(conn, batch)
+                return True
+            except Exception as e:
+                print(f"Stats Error: {e}")
+                return False
+
+    @staticmethod
+    def _write_game_stats(conn, batch):
+        for game_id, c in batch.items():
+            conn.execute('''
+                INSERT INTO game_stats (game_id, downloads, rooms_created) VALUES (?, ?, ?)
+                ON CONFLICT(game_id) DO UPDATE SET
+                    downloads = downloads + excluded.downloads,
+                    rooms_created = rooms_created + excluded.rooms_created
+            ''', (game_id, c["downloads"], c["rooms"]))
+            if c["players"]:
+                conn.executemany('INSERT OR IGNORE INTO game_players (game_id, player_id) VALUES (?, ?)',
+                                 [(game_id, p) for p in c["players"]])
+                # 遊玩歷史 (評論資格) 也在同一個 transaction 寫入
+                conn.executemany('INSERT INTO play_history (player_id, game_id) VALUES (?, ?)',
+                                 [(p, game_id) for p in c["players"]])
+                conn.execute('''
+                    UPDATE game_stats SET unique_players =
+                        (SELECT COUNT(*) FROM game_players WHERE game_id = ?)
+                    WHERE game_id = ?
+                ''', (game_id, game_id))
+
+    def get_catalog_with_stats(self):
+        """上架中的遊戲 + 下載數/開房數/玩家數/平均評分/最後更新，用來預先排序"""
+        cursor = self.conn.execute('''
+            SELECT g.id, g.name, g.version, g.description, u.username,
+                   COALESCE(s.downloads, 0), COALESCE(s.rooms_created, 0), COALESCE(s.unique_players, 0),
+                   r.avg_rating, COALESCE(r.review_count, 0), v.updated_at
+            FROM games g
+            JOIN users u ON g.developer_id = u.id
+            LEFT JOIN game_stats s ON s.game_id = g.id
+            LEFT JOIN (SELECT game_id, AVG(rating) AS avg_rating, COUNT(*) AS review_count
+                       FROM reviews GROUP BY game_id) r ON r.game_id = g.id
+            LEFT JOIN (SELECT game_id, MAX(id) AS updated_at FROM game_versions GROUP BY game_id) v
+                   ON v.game_id = g.id
+            WHERE g.is_active = 1
+        ''')
+        return [{
+            "id": r[0], "name": r[1], "version": r[2], "description": r[3], "author": r[4],
+            "downloads": r[5], "rooms_created": r[6], "unique_players": r[7],
+            "average_rating": round(r[8], 1) if r[8] is not None else 0, "review_count": r[9],
+            "updated_seq": r[10] or 0
+        } for r in cursor.fetchall()]
+
+    def get_active_artifacts(self):
+        """上架中遊戲目前版本的 (game_id, file_path)，開機暖身用"""
+        cursor = self.conn.execute("SELECT id, file_path FROM games WHERE is_active = 1 AND file_path IS NOT NULL")
+        return cursor.fetchall()
+
+    # ================= Retention =================
+    def get_current_artifacts(self):
+        """所有遊戲目前指向的 ZIP 檔名 (不論是否上架，都不能被清掉)"""
+        cursor = self.conn.execute("SELECT file_path FROM games WHERE file_path IS NOT NULL")
+        return {r[0] for r in cursor.fetchall()}
+
+    def get_version_history(self):
+        """依遊戲分組、新到舊排列的版本紀錄"""
+        cursor = self.conn.execute('''
+            SELECT id, game_id, version, file_path FROM game_versions
+            ORDER BY game_id, id DESC
+        ''')
+        return [{"id": r[0], "game_id": r[1], "version": r[2], "file_path": r[3]} for r in cursor.fetchall()]
+
+    def delete_game_versions(self, version_ids):
+        try:
+            self.conn.executemany("DELETE FROM game_versions WHERE id=?", [(v,) for v in version_ids])
+            self.conn.commit()
+            return True
+        except: return False
+
     # ================= Developer =================
     def get_games_by_dev(self, dev_id):
         cursor = self.conn.execute('SELECT id, name, version, description, is_active FROM games WHERE developer_id = ?', (dev_id,))
@@ -0,0 +1,230 @@
+import time
+import itertools
+import threading
+from common.protocol import Protocol
+from common.utils import send_json
+from server.services import metrics
+
+# 大廳事件推播 (SUBSCRIBE)
+#   topic: "rooms" / "catalog" / "reviews:<game_id>"
+#   publish(topic, key, op, data) 只把事件合併進每個訂閱者的 pending (不碰 socket)，
+#   每個訂閱者有自己的推送 thread，醒來後等 PUSH_INTERVAL 收集一批再送，一次一個 frame：
+#     {"cmd": "EVENT", "topic": "rooms", "events": [{"op": "updated", "id": "3", "data": {...}}, ...]}
+#   同一個 (topic, key) 還沒送出前只留最後狀態 (added+updated -> added, added+removed -> 抵銷)，
+#   慢的 client 不會讓 Server 堆積事件；pending 超過 MAX_PENDING 就丟掉改送 {"op": "resync"}，
+#   client 收到後自己重新 LIST_ROOMS / LIST_GAMES。
+# 推播跟一般回覆共用同一條連線，寫入時都要拿 send_lock (見 main.handle_client)。
+# 多 worker 模式 (services/state.py)：worker 的 publish 轉給 coordinator，coordinator 用 subscribe_all
+# 把所有 topic 的事件推給每個 worker，worker 再用 deliver() 分送給自己的訂閱者。
+
+TOPIC_ROOMS = "rooms"
+TOPIC_CATALOG = "catalog"
+TOPIC_REVIEWS = "reviews:"  # 後面接 game_id
+
+PUSH_INTERVAL = 0.1  # 收到第一個事件後等多久再送 (合併同一批變動)
+MAX_PENDING = 500    # 單一 topic 未送出的事件超過這個數量就改送 resync
+
+
+class Subscriber:
+    def __init__(self, conn, send_lock):
+        self.conn = conn
+        self.send_lock = send_lock
+        self.topics = set()
+        self.pending = {}       # topic -> {key: (op, data)}，dict 保留先後順序
+        self.resync = set()     # 要送 resync 的 topic
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.thread = None
+
+
+_subscribers = {}   # topic -> set(Subscriber)
+_snapshots = {}     # topic 前綴 -> fn(topic)，SUBSCRIBE 時回傳目前的完整狀態當起點
+_firehose = set()   # 訂閱全部 topic 的 Subscriber (worker 的事件串流)
+_forward = None     # 設定後 publish 改呼叫它 (worker 模式轉給 coordinator)
+_seq = itertools.count(1)  # 不合併的事件 (key=None) 用流水號當 key
+_lock = threading.Lock()
+
+
+def valid_topic(topic):
+    if topic in (TOPIC_ROOMS, TOPIC_CATALOG):
+        return True
+    return isinstance(topic, str) and topic.startswith(TOPIC_REVIEWS) and topic[len(TOPIC_REVIEWS):].isdigit()
+
+
+def register_snapshot(prefix, fn):
+    _snapshots[prefix] = fn
+
+
+def _snapshot(topic):
+    for prefix, fn in _snapshots.items():
+        if topic == prefix or (prefix.endswith(":") and topic.startswith(prefix)):
+            return fn(topic)
+    return None
+
+
+def subscribe(sub, topics):
+    with _lock:
+        for topic in topics:
+            sub.topics.add(topic)
+            _subscribers.setdefault(topic, set()).add(sub)
+        if sub.thread is None:
+            sub.thread = threading.Thread(target=_push_loop, args=(sub,), daemon=True)
+            sub.thread.start()
+    metrics.incr("events.subscribe", len(topics))
+
+
+def subscribe_all(sub):
+    with _lock:
+        _firehose.add(sub)
+        if sub.thread is None:
+            sub.thread = threading.Thread(target=_push_loop, args=(sub,), daemon=True)
+            sub.thread.start()
+
+
+def set_forward(fn):
+    global _forward
+    _forward = fn
+
+
+def unsubscribe(sub, topics=None):
+    """topics=None 代表全部取消 (斷線時呼叫)"""
+    with _lock:
+        if topics is None:
+            _firehose.discard(sub)
+        for topic in list(sub.topics if topics is None else topics):
+            sub.topics.discard(topic)
+            sub.pending.pop(topic, None)
+            sub.resync.discard(topic)
+            subs = _subscribers.get(topic)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del _subscribers[topic]
+        if topics is None:
+            sub.closed = True
+            sub.wakeup.set()
+
+
+def handle_subscribe(sub, payload):
+    """
+    先登記訂閱再取快照：快照之後的變動一定會推播 (可能跟快照重複，client 以 id 覆蓋即可)
+    """
+    topics = payload.get("topics")
+    if isinstance(topics, str):
+        topics = [topics]
+    if not topics or not isinstance(topics, list):
+        return {"status": Protocol.STATUS_ERROR, "message": "Missing topics."}
+    bad = [t for t in topics if not valid_topic(t)]
+    if bad:
+        return {"status": Protocol.STATUS_ERROR, "message": f"Unknown topic: {bad[0]}"}
+    subscribe(sub, topics)
+    return {
+        "status": Protocol.STATUS_OK,
+        "topics": sorted(sub.topics),
+        "snapshot": {topic: _snapshot(topic) for topic in topics},
+    }
+
+
+def handle_unsubscribe(sub, payload):
+    topics = payload.get("topics")
+    if isinstance(topics, str):
+        topics = [topics]
+    if sub is not None:
+        unsubscribe(sub, topics or list(sub.topics))
+    return {"status": Protocol.STATUS_OK, "topics": sorted(sub.topics) if sub else []}
+
+
+def _merge(pending, key, op, data):
+    """合併同一個 key 尚未送出的事件；回傳 True 代表有被合併掉"""
+    prev = pending.get(key)
+    if prev is None:
+        pending[key] = (op, data)
+        return False
+    prev_op = prev[0]
+    if prev_op == "added" and op == "removed":
+        del pending[key]
+    elif prev_op == "added":
+        pending[key] = ("added", data)
+    else:
+        pending[key] = (op, data)
+    return True
+
+
+def publish(topic, key, op, data=None):
+    """op: added / updated / removed；key=None 的事件不合併 (例如新評論)"""
+    if _forward is not None:
+        _forward(topic, key, op, data)
+    else:
+        deliver(topic, key, op, data)
+
+
+def deliver(topic, key, op, data=None):
+    """把事件放進這個 process 裡訂閱者的 pending；op="resync" 代表要 client 整份重抓"""
+    with _lock:
+        subs = _subscribers.get(topic, set()) | _firehose
+        if not subs:
+            return
+        if key is None:
+            key = f"#{next(_seq)}"
+        coalesced = 0
+        for sub in subs:
+            if topic in sub.resync:
+                continue
+            if op == "resync":
+                sub.pending.pop(topic, None)
+                sub.resync.add(topic)
+                sub.wakeup.set()
+                continue
+            pending = sub.pending.setdefault(topic, {})
+            if _merge(pending, key, op, data):
+                coalesced += 1
+            elif len(pending) > MAX_PENDING:
+                sub.pending.pop(topic, None)
+                sub.resync.add(topic)
+                metrics.incr("events.resync")
+            sub.wakeup.set()
+    if coalesced:
+        metrics.incr("events.coalesced", coalesced)
+
+
+def _take(sub):
+    with _lock:
+        sub.wakeup.clear()
+        pending, sub.pending = sub.pending, {}
+        resync, sub.resync = sub.resync, set()
+    frames = [{"cmd": Protocol.PUSH_EVENT, "topic": topic, "events": [{"op": "resync"}]} for topic in resync]
+    for topic, events in pending.items():
+        if events:
+            frames.append({"cmd": Protocol.PUSH_EVENT, "topic": topic,
+                           "events": [{"op": op, "id": key, "data": data} for key, (op, data) in events.items()]})
+    return frames
+
+
+def _push_loop(sub):
+    while True:
+        sub.wakeup.wait()
+        if sub.closed:
+            return
+        # 等一下讓同一批變動合併成一個 frame
+        time.sleep(PUSH_INTERVAL)
+        for frame in _take(sub):
+            with sub.send_lock:
+                ok = send_json(sub.conn, frame)
+            if not ok:
+                unsubscribe(sub)
+                return
+            metrics.incr("events.pushed", len(frame["events"]))
+
+
+def stats():
+    with _lock:
+        subs = {s for topic_subs in _subscribers.values() for s in topic_subs} | _firehose
+        return {
+            "subscribers": len(subs),
+            "firehose": len(_firehose),
+            "topics": {topic: len(topic_subs) for topic, topic_subs in _subscribers.items()},
+            "pending": sum(len(events) for s in subs for events in s.pending.values()),
+        }
+
+
+metrics.register_source("events", stats)
@@ -0,0 +1,293 @@
+import os
+import json
+import time
+import socket
+import secrets
+import tempfile
+import threading
+from server.services import metrics
+from server.services import spawner
+from server.services import supervisor
+from server.services.ports import port_pool
+
+# 多房間 Game Server (game_config.json 的 "multi_room": true)
+#   同一版本的房間共用一個 process 與一個 port，玩家連上後第一行先送 {"token": "..."} 表明要進哪個房間。
+#   Lobby 透過 Unix socket 控制通道 (server_cmd 裡的 {control}) 叫 Game Server 開/關房間，每行一個 JSON：
+#     -> {"op": "open", "room": "12", "token": "...", "max_players": 2}   <- {"ok": true}
+#     -> {"op": "close", "room": "12"}                                    <- {"ok": true}
+#     -> {"op": "ping"}                                                   <- {"ok": true, "rooms": 3, "players": {"12": 2}}
+#   新房間優先放進已經開著的 process，滿了 (max_rooms_per_process) 才開新的；
+#   房間都關掉後，每個版本最多留一個空的 process 等下一次開房。
+
+CONTROL_DIR = os.environ.get("LOBBY_CONTROL_DIR", os.path.join(tempfile.gettempdir(), "lobby-control"))
+MAX_ROOMS_PER_PROCESS = int(os.environ.get("LOBBY_MAX_ROOMS_PER_PROCESS", 32))
+CONTROL_TIMEOUT = 3.0
+
+# 控制通道用 Unix socket；沒有 AF_UNIX 的平台退回一房一 process
+SUPPORTED = hasattr(socket, "AF_UNIX")
+
+
+class HostError(Exception):
+    pass
+
+
+class GameHost:
+    __slots__ = ("game_id", "run_dir", "process", "port", "control_path", "max_rooms", "rooms", "closed")
+
+    def __init__(self, game_id, run_dir, process, port, control_path, max_rooms):
+        self.game_id = str(game_id)
+        self.run_dir = run_dir
+        self.process = process
+        self.port = port
+        self.control_path = control_path
+        self.max_rooms = max_rooms
+        self.rooms = set()   # room_id (含正在開的)
+        self.closed = False
+
+
+_hosts = {}        # run_dir -> [GameHost]
+_spawn_locks = {}  # run_dir -> Lock (同一版本同時只開一個新 process)
+_lock = threading.Lock()
+
+
+def _control(path, message, timeout=CONTROL_TIMEOUT):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(path)
+        s.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        buf = b''
+        while b'\n' not in buf:
+            chunk = s.recv(4096)
+            if not chunk:
+                break
+            buf += chunk
+    try:
+        reply = json.loads(buf.split(b'\n', 1)[0].decode('utf-8'))
+    except ValueError:
+        raise HostError("Invalid reply on control channel.")
+    if not reply.get("ok"):
+        raise HostError(reply.get("error", "Control command failed."))
+    return reply
+
+
+def _pick(run_dir, room_id):
+    """找一個還有空位的 process 並先佔一個位子 (需持有 _lock)"""
+    for host in _hosts.get(run_dir, ()):
+        if not host.closed and len(host.rooms) < host.max_rooms:
+            host.rooms.add(room_id)
+            return host
+    return None
+
+
+def _spawn(game_id, run_dir, config, on_exit):
+    port = port_pool.lease()
+    if port is None:
+        metrics.incr("lobby.port_exhausted")
+        raise HostError("No free ports available.")
+
+    os.makedirs(CONTROL_DIR, exist_ok=True)
+    control_path = os.path.join(CONTROL_DIR, f"{port}.sock")
+    try:
+        os.unlink(control_path)
+    except FileNotFoundError:
+        pass
+
+    label = os.path.basename(run_dir)
+    try:
+        process = spawner.spawn_game_server(config, run_dir, port, control=control_path)
+    except OSError as e:
+        # 找不到直譯器 / 執行檔之類的：port 還沒被用過，直接還回去
+        port_pool.release(port, quarantine=False)
+        raise HostError(f"Cannot start Game Server: {e}")
+    try:
+        ready, info = spawner.wait_until_ready(process, port, label=label)
+    except OSError as e:
+        ready, info = False, f"Readiness check failed: {e}"
+    if ready:
+        # 控制通道也要能通
+        deadline = time.monotonic() + 2.0
+        while True:
+            try:
+                _control(control_path, {"op": "ping"}, timeout=0.5)
+                break
+            except (OSError, HostError) as e:
+                if time.monotonic() >= deadline or process.poll() is not None:
+                    ready, info = False, f"Control channel not ready: {e}"
+                    break
+                time.sleep(0.05)
+    if not ready:
+        spawner.kill_process(process)
+        port_pool.release(port)
+        raise HostError(info)
+
+    host = GameHost(game_id, run_dir, process, port, control_path,
+                    config.get("max_rooms_per_process", MAX_ROOMS_PER_PROCESS))
+    supervisor.watch(process, label=f"host {label}:{port}",
+                     on_exit=lambda code: _host_exited(host, code, on_exit))
+    metrics.incr("hosting.spawned")
+    print(f"[Hosting] Multi-room Game Server for {label} on port {port}")
+    return host
+
+
+def reattach(game_id, run_dir, process, port, control_path, max_rooms, on_exit=None):
+    """
+    Lobby 重啟後重新接管還在跑的多房間 Game Server。
+    回傳 (GameHost, {room_id: 人數})；控制通道不通回傳 (None, None)
+    """
+    try:
+        players = _control(control_path, {"op": "ping"}).get("players", {})
+    except (OSError, HostError) as e:
+        print(f"[Hosting] Cannot reattach host on port {port}: {e}")
+        return None, None
+    port_pool.reserve(port)
+    host = GameHost(game_id, run_dir, process, port, control_path, max_rooms or MAX_ROOMS_PER_PROCESS)
+    with _lock:
+        _hosts.setdefault(run_dir, []).append(host)
+    supervisor.watch(process, label=f"host {os.path.basename(run_dir)}:{port}",
+                     on_exit=lambda code: _host_exited(host, code, on_exit))
+    metrics.incr("hosting.reattached")
+    return host, players
+
+
+def adopt_room(host, room_id):
+    with _lock:
+        host.rooms.add(room_id)
+
+
+def _host_exited(host, code, on_exit):
+    with _lock:
+        host.closed = True
+        hosts = _hosts.get(host.run_dir, [])
+        if host in hosts:
+            hosts.remove(host)
+        host.rooms.clear()
+    port_pool.release(host.port)
+    _unlink(host)
+    if on_exit:
+        on_exit(host, code)
+
+
+def _unlink(host):
+    try:
+        os.unlink(host.control_path)
+    except OSError:
+        pass
+
+
+def _stop(host):
+    supervisor.retire(host.process)
+    port_pool.release(host.port)
+    _unlink(host)
+    metrics.incr("hosting.retired")
+
+
+def open_room(game_id, run_dir, config, room_id, max_players=None, on_exit=None):
+    """
+    在多房間 Game Server 裡開一個房間，回傳 (GameHost, token)；失敗丟 HostError。
+    on_exit(host, code) 在 process 結束時呼叫 (上面的房間都要收掉)。
+    """
+    with _lock:
+        host = _pick(run_dir, room_id)
+    if host is None:
+        with _lock:
+            spawn_lock = _spawn_locks.setdefault(run_dir, threading.Lock())
+        with spawn_lock:
+            with _lock:
+                host = _pick(run_dir, room_id)
+            if host is None:
+                host = _spawn(game_id, run_dir, config, on_exit)
+                with _lock:
+                    host.rooms.add(room_id)
+                    _hosts.setdefault(run_dir, []).append(host)
+
+    token = secrets.token_urlsafe(16)
+    try:
+        _control(host.control_path, {"op": "open", "room": room_id, "token": token,
+                                     "max_players": max_players})
+    except (OSError, HostError) as e:
+        with _lock:
+            host.rooms.discard(room_id)
+        raise HostError(f"Game server refused room: {e}")
+    metrics.incr("hosting.rooms_opened")
+    return host, token
+
+
+def close_room(host, room_id):
+    """關掉房間；process 空了且同版本已經有別的空 process 時就關掉它"""
+    with _lock:
+        host.rooms.discard(room_id)
+        closed = host.closed
+    if not closed:
+        try:
+            _control(host.control_path, {"op": "close", "room": room_id})
+        except (OSError, HostError) as e:
+            print(f"[Hosting] close room {room_id} on port {host.port} failed: {e}")
+
+    victims = []
+    with _lock:
+        idle = [h for h in _hosts.get(host.run_dir, ()) if not h.rooms]
+        for h in idle[1:]:
+            h.closed = True
+            _hosts[host.run_dir].remove(h)
+            victims.append(h)
+    for h in victims:
+        _stop(h)
+
+
+def room_players(host):
+    """每個房間目前連著幾個玩家 {room_id: 人數}；查不到回傳 None"""
+    if host.closed:
+        return None
+    try:
+        return _control(host.control_path, {"op": "ping"}).get("players", {})
+    except (OSError, HostError):
+        return None
+
+
+def drain(run_dir=None, game_id=None):
+    """關掉沒有房間的 process (指定版本 / 指定遊戲 / 全部)；還有房間的等房間結束"""
+    victims = []
+    with _lock:
+        for key, hosts in list(_hosts.items()):
+            if run_dir is not None and key != run_dir:
+                continue
+            for h in list(hosts):
+                if game_id is not None and h.game_id != str(game_id):
+                    continue
+                if not h.rooms:
+                    h.closed = True
+                    hosts.remove(h)
+                    victims.append(h)
+            if not hosts:
+                del _hosts[key]
+    for h in victims:
+        _stop(h)
+    return len(victims)
+
+
+def drain_all():
+    return drain()
+
+
+def run_dirs():
+    """多房間 Game Server 正在用的版本 (包含目前沒有房間的閒置 process)"""
+    with _lock:
+        return {run_dir for run_dir, hosts in _hosts.items() if hosts}
+
+
+def stats():
+    with _lock:
+        hosts = [{
+            "version": os.path.basename(h.run_dir),
+            "port": h.port,
+            "pid": h.process.pid,
+            "rooms": len(h.rooms),
+            "max_rooms": h.max_rooms,
+        } for hs in _hosts.values() for h in hs]
+    return {
+        "hosts": hosts,
+        "rooms": sum(h["rooms"] for h in hosts),
+    }
+
+
+metrics.register_source("hosting", stats)
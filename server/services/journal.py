@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import threading
+from server.services import metrics
+from server.services import spawner
+
+# 房間生命週期日誌 (append-only, 一行一個 JSON)
+#   create / join / leave / close 都會寫一行 (由 RoomRegistry 呼叫)，write + flush，不做 fsync：
+#   Lobby process 當掉或重啟時資料還在 OS 裡，重開機時 replay 回來重新接管還在跑的 Game Server。
+#   replay 必須是冪等的 (同一事件重複套用結果一樣)，壓縮 (compact) 時才不用擋住所有寫入：
+#   壓縮開始後寫的每一行都另外留一份，接在新檔的快照後面，快照前後的事件都不會掉。
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+server_dir = os.path.dirname(current_dir)
+JOURNAL_PATH = os.environ.get("LOBBY_JOURNAL", os.path.join(server_dir, "room_journal.log"))
+COMPACT_THRESHOLD = 5000  # 上次壓縮後超過這麼多筆就重寫成只剩現存房間
+
+_file = None
+_events = 0
+_pending = None  # 壓縮中：開始後寫入的行 (會接在快照後面)
+_lock = threading.Lock()
+
+
+def _open():
+    global _file
+    if _file is None:
+        _file = open(JOURNAL_PATH, 'a', encoding='utf-8')
+    return _file
+
+
+def _room_state(room, players=None):
+    """create 事件要記的欄位 (足夠在重啟後重建 Room 與重新接管 process)"""
+    pid = room.process.pid if room.process is not None else None
+    remote = room.agent is not None  # pid 在別台機器上，不能在本機查 start time
+    state = {
+        "room": room.room_id,
+        "game_id": room.game_id,
+        "game_name": room.game_name,
+        "port": room.port,
+        "host": room.host,
+        "pid": pid,
+        "pid_start": spawner.process_start_time(pid) if pid and not remote else None,
+        "version": room.version,
+        "run_dir": room.run_dir,
+        "max_players": room.max_players,
+        "created_at": room.created_at,
+        "players": dict(room.players) if players is None else players,
+    }
+    if remote:
+        state.update(agent=room.agent.name, agent_address=room.agent.address)
+    if room.shared is not None:
+        state.update(token=room.token, control=room.shared.control_path, max_rooms=room.shared.max_rooms)
+    return state
+
+
+def _write(lines):
+    global _events
+    f = _open()
+    f.write("".join(lines))
+    f.flush()
+    _events += len(lines)
+    if _pending is not None:
+        _pending.extend(lines)
+
+
+def record(event, room, **fields):
+    """event: create / join / leave / close"""
+    if event == "create":
+        entry = dict(_room_state(room), ev=event)
+    else:
+        entry = dict(fields, ev=event, room=room.room_id)
+    line = json.dumps(entry, ensure_ascii=False) + "\n"
+    try:
+        with _lock:
+            _write([line])
+    except OSError as e:
+        print(f"[Journal Error] {e}")
+
+
+def replay(path=None):
+    """讀日誌重建 {room_id: state}；最後一行寫到一半 (當機) 就略過"""
+    path = path or JOURNAL_PATH
+    states = {}
+    try:
+        f = open(path, 'r', encoding='utf-8')
+    except FileNotFoundError:
+        return states
+    with f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            ev = entry.pop("ev", None)
+            rid = entry.get("room")
+            if ev == "create":
+                states[rid] = entry
+            elif ev == "join" and rid in states:
+                states[rid]["players"][entry["username"]] = entry.get("user_id")
+            elif ev == "leave" and rid in states:
+                states[rid]["players"].pop(entry["username"], None)
+            elif ev == "close":
+                states.pop(rid, None)
+    return states
+
+
+def compact(live_rooms):
+    """
+    把日誌重寫成只有目前還在的房間 (每間一筆 create)，回傳幾間。
+    live_rooms() 回傳目前的房間；要在開始記錄新寫入之後才取快照，不能先傳一份 list 進來。
+    """
+    global _file, _events, _pending
+    with _lock:
+        _pending = []
+    try:
+        lines = []
+        for room in live_rooms():
+            # 玩家名單在 room.lock 下複製 (JOIN / LEAVE 會同時改)；不能拿著 journal 的 lock 去拿 room.lock
+            with room.lock:
+                if room.closed:
+                    continue
+                players = dict(room.players)
+            lines.append(json.dumps(dict(_room_state(room, players), ev="create"), ensure_ascii=False) + "\n")
+        rooms = len(lines)
+        with _lock:
+            lines.extend(_pending)
+            tmp = f"{JOURNAL_PATH}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write("".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            if _file is not None:
+                _file.close()
+                _file = None
+            os.replace(tmp, JOURNAL_PATH)
+            _events = len(_pending)
+    finally:
+        with _lock:
+            _pending = None
+    return rooms
+
+
+def maybe_compact(live_rooms, threshold=COMPACT_THRESHOLD):
+    if _events >= threshold:
+        start = time.time()
+        n = compact(live_rooms)
+        print(f"[Journal] Compacted to {n} rooms in {time.time() - start:.3f}s")
+
+
+def stats():
+    return {"path": JOURNAL_PATH, "events_since_compact": _events}
+
+
+metrics.register_source("journal", stats)
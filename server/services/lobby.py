@@ -1,224 +1,546 @@
-import subprocess
-import socket
-import threading
 import os
 import time
-import json 
-import zipfile
+import threading
 from common.protocol import Protocol
 from server.services.db import db_instance
+from server.services import pipeline
+from server.services import popularity
+from server.services import metrics
+from server.services.ports import port_pool
+from server.services.rooms import Room, RoomRegistry, SORT_KEYS
+from server.services import spawner
+from server.services import prewarm
+from server.services import supervisor
+from server.services import hosting
+from server.services import admission
+from server.services import journal
+from server.services import events
+from server.services import agents
+from server.services import reports
+
+# 用來存放所有房間的狀態 (Room 物件 + game_id / 玩家 / port 索引，見 rooms.py)
+# 每次變動都寫進 journal，Lobby 重啟時用 restore_rooms() 重建；也推播給 SUBSCRIBE rooms 的 client
+rooms = RoomRegistry(journal=journal, events=events)
+events.register_snapshot(events.TOPIC_ROOMS, lambda topic: rooms.snapshot())
 
-# 用來存放所有房間的狀態
-# 結構範例: { "1": { "game_id": 1, "port": 9000, "host": "p1", "players": ["p1"], "process": PopenObj, "version": "1.0" } }
-rooms = {}
-room_id_counter = 1
-lock = threading.Lock()
+metrics.register_source("ports", port_pool.stats)
 
-# 設定遊戲 Server 的 Port 範圍
-PORT_RANGE_START = 21050
-PORT_RANGE_END = 21150
+# 閒置房間回收：超過 ROOM_IDLE_TTL 秒沒有人進出、Game Server 上也沒有玩家連線的房間會被關掉
+ROOM_IDLE_TTL = float(os.environ.get("LOBBY_ROOM_IDLE_TTL", 300))
+REAP_INTERVAL = 30
+
+# LIST_ROOMS 一次最多回傳幾間 (有 "limit" 時不能超過)；QUICK_JOIN 搶不到位子 (被別人先加入) 時重試幾次
+MAX_LIST_ROOMS = 200
+QUICK_JOIN_RETRIES = 3
 
 def find_free_port():
-    """尋找一個沒被佔用的 Port"""
-    for port in range(PORT_RANGE_START, PORT_RANGE_END):
-        is_used = False
-        with lock:
-            for r in rooms.values():
-                if r['port'] == port:
-                    is_used = True
-                    break
-        if is_used: continue
-
-        # 雙重檢查：確認系統層面該 Port 真的沒被佔用
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            if s.connect_ex(('localhost', port)) != 0:
-                return port
-    return None
+    """從 Port 池租一個 Port (O(1)，不用掃房間)；用完要 port_pool.release()"""
+    port = port_pool.lease()
+    if port is None:
+        metrics.incr("lobby.port_exhausted")
+    return port
 
 def is_game_running(game_id):
     """檢查是否有任何房間正在運行此遊戲 (用於下架檢查)"""
-    target_gid = str(game_id)
-    with lock:
-        for room in rooms.values():
-            if str(room.get('game_id')) == target_gid:
-                return True
-    return False
+    return rooms.has_game(game_id)
 
-def handle_create_room(user_id, username, game_id):
-    global room_id_counter
-    
+def prepare_game(game_id):
+    """
+    開房前的準備：確認遊戲還在架上、解壓目錄存在、讀取 game_config.json。
+    回傳 ((game_name, run_dir, config), None)；失敗回傳 (None, 錯誤 response)
+    """
     # 0. 檢查遊戲是否被下架
     try:
         # 假設 db.py 有實作 get_game_status
         if hasattr(db_instance, 'get_game_status'):
             is_active = db_instance.get_game_status(game_id)
             if not is_active:
-                return {"status": Protocol.STATUS_ERROR, "message": "Game is unpublished/inactive."}
+                return None, {"status": Protocol.STATUS_ERROR, "message": "Game is unpublished/inactive."}
     except:
         pass
 
     # 1. 從 DB 取得真實的檔案路徑 (例如: Snake_1.1.zip)
     game_info = db_instance.get_game_file_info(game_id)
     if not game_info:
-        return {"status": Protocol.STATUS_ERROR, "message": "Game not found in DB."}
+        return None, {"status": Protocol.STATUS_ERROR, "message": "Game not found in DB."}
     
     file_rel_path, game_name = game_info 
     
     # 2. 準備路徑
-    # project_root/server/
-    server_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    zip_path = os.path.join(server_dir, "storage", "games", file_rel_path)
-    
     # 執行區位置: project_root/server/running_games/Snake_1.1/
-    # 我們用檔名(去掉.zip)當作資料夾名稱，這樣不同版本會分開
-    folder_name = file_rel_path.replace(".zip", "")
-    run_dir = os.path.join(server_dir, "running_games", folder_name)
+    # 上傳時 pipeline 已經預先解壓好，這裡只處理舊資料 (pipeline 之前上傳的版本)
+    zip_path = os.path.join(pipeline.STORAGE_DIR, file_rel_path)
+    run_dir = pipeline.run_dir_for(file_rel_path)
 
-    # 3. 檢查並解壓縮 (確保 Server 跑的是上傳的 ZIP)
+    # 3. 檢查並解壓縮 (確保 Server 跑的是上傳的 ZIP)；同一版本同時開房只會解壓一次
     if not os.path.exists(run_dir):
-        print(f"[Lobby] Extracting new version to {run_dir}...")
+        if not os.path.exists(zip_path):
+            return None, {"status": Protocol.STATUS_ERROR, "message": f"Game ZIP missing: {file_rel_path}"}
         try:
-            os.makedirs(run_dir, exist_ok=True)
-            if not os.path.exists(zip_path):
-                 return {"status": Protocol.STATUS_ERROR, "message": f"Game ZIP missing: {file_rel_path}"}
-            
-            with zipfile.ZipFile(zip_path, 'r') as zf:
-                zf.extractall(run_dir)
+            if pipeline.ensure_extracted(zip_path, run_dir):
+                print(f"[Lobby] Extracted new version to {run_dir}")
         except Exception as e:
-            return {"status": Protocol.STATUS_ERROR, "message": f"Unzip failed: {e}"}
+            return None, {"status": Protocol.STATUS_ERROR, "message": f"Unzip failed: {e}"}
 
     # 4. 讀取 Config
-    config_path = os.path.join(run_dir, "game_config.json")
-    if not os.path.exists(config_path):
-         return {"status": Protocol.STATUS_ERROR, "message": "game_config.json missing in ZIP."}
-    
     try:
-        with open(config_path, 'r') as f:
-            config = json.load(f)
-    except:
-        return {"status": Protocol.STATUS_ERROR, "message": "Config format error."}
+        config = spawner.load_game_config(run_dir)
+    except pipeline.ValidationError as e:
+        return None, {"status": Protocol.STATUS_ERROR, "message": str(e)}
+
+    return (game_name, run_dir, config), None
+
+def handle_create_room(user_id, username, game_id):
+    # 開房名額 (全域 / 每個玩家)；全域滿了會排隊等一下
+    denied = admission.acquire(username)
+    if denied:
+        return {"status": Protocol.STATUS_ERROR, "message": denied}
+    try:
+        response = _create_room(user_id, username, game_id)
+    except Exception as e:
+        print(f"[Lobby Error] create room: {e}")
+        response = {"status": Protocol.STATUS_ERROR, "message": f"Failed to create room: {e}"}
+    if response["status"] != Protocol.STATUS_OK:
+        admission.release(username)
+    return response
+
+def _create_room(user_id, username, game_id):
+    prepared, error = prepare_game(game_id)
+    if error:
+        return error
+    game_name, run_dir, config = prepared
     
     # 取得版本號
     current_server_version = config.get("version", "1.0") 
-    
-    # 準備 Port
-    port = find_free_port()
-    if not port:
-        return {"status": Protocol.STATUS_ERROR, "message": "No free ports available."}
-
-    # 準備啟動指令
-    server_cmd_template = config.get("server_cmd", "")
-    cmd = server_cmd_template.replace("{port}", str(port))
-    
-    print(f"[Lobby] Starting Game Server (v{current_server_version}): {cmd}")
 
-    try:
-        # 5. 啟動 Game Server Process
-        # ★★★ 關鍵：cwd 設定為 run_dir，這樣 Server 就在解壓後的目錄跑
-        process = subprocess.Popen(cmd, shell=True, cwd=run_dir)
-        
-        # 6. 記錄房間
-        with lock:
-            rid = str(room_id_counter)
-            room_id_counter += 1
-            rooms[rid] = {
-                "game_id": game_id,
-                "game_name": game_name,
-                "port": port,
-                "host": username,
-                "players": [username],
-                "process": process,
-                "version": current_server_version 
-            }
-        
-        # ★★★ 關鍵：記錄遊玩歷史 (為了讓評論功能生效) ★★★
+    # 5. 有 game host agent 連上來就開在負載最低的那台 (一房一個 process)；沒有 agent 或開失敗才開在本機
+    agent = agents.pick()
+    if agent is not None:
+        response = _create_remote_room(agent, user_id, username, game_id, game_name, run_dir, config)
+        if response is not None:
+            return response
+
+    # 5a. 多房間模式：放進共用的 Game Server process
+    if config.get("multi_room") and hosting.SUPPORTED:
+        rid = rooms.next_id()
         try:
-            db_instance.add_play_history(user_id, game_id)
-        except Exception as e:
-            print(f"[Lobby Warning] Failed to add play history: {e}")
+            host, token = hosting.open_room(game_id, run_dir, config, rid, config.get("max_players"),
+                                            on_exit=_on_host_exit)
+        except hosting.HostError as e:
+            print(f"[Lobby] Multi-room Game Server for {os.path.basename(run_dir)} failed: {e}")
+            return {"status": Protocol.STATUS_ERROR, "message": f"Failed to start server: {e}"}
+        room = Room(rid, game_id, game_name, host.port, username, host.process, current_server_version,
+                    run_dir, max_players=config.get("max_players"))
+        room.shared = host
+        room.token = token
+        return _register_room(room, user_id, username)
 
-        return {
-            "status": Protocol.STATUS_OK,
-            "message": "Room created.",
-            "room_id": rid,
-            "port": port,
-            "game_name": game_name,
-            "game_version": current_server_version 
-        }
+    # 5b. 優先使用預熱好的 Game Server，沒有才現場啟動
+    prewarm.record_demand(run_dir, game_id, config)
+    warm = prewarm.acquire(run_dir)
+    if warm:
+        process, port = warm
+        print(f"[Lobby] Using pre-warmed Game Server (v{current_server_version}) on port {port}")
+    else:
+        # 準備 Port
+        port = find_free_port()
+        if not port:
+            return {"status": Protocol.STATUS_ERROR, "message": "No free ports available."}
+
+    try:
+        if not warm:
+            process = spawner.spawn_game_server(config, run_dir, port)
+            # 等 Game Server 真的在 listen 才回覆，避免 Client 連太快
+            ready, info = spawner.wait_until_ready(process, port, label=os.path.basename(run_dir))
+            if not ready:
+                print(f"[Lobby] Game Server on port {port} failed readiness check: {info}")
+                spawner.kill_process(process)
+                port_pool.release(port)
+                return {"status": Protocol.STATUS_ERROR, "message": f"Failed to start server: {info}"}
+        
+        rid = rooms.next_id()
+        room = Room(rid, game_id, game_name, port, username, process, current_server_version, run_dir,
+                    max_players=config.get("max_players"))
+        return _register_room(room, user_id, username)
 
     except Exception as e:
         print(f"[Lobby Error] {e}")
+        port_pool.release(port, quarantine=False)
         return {"status": Protocol.STATUS_ERROR, "message": f"Failed to start server: {e}"}
 
-def handle_list_rooms():
-    with lock:
-        room_list = []
-        for rid, r in rooms.items():
-            room_list.append({
-                "id": rid,
-                "game_name": r['game_name'],
-                "host": r['host'],
-                "players": len(r['players']),
-                "port": r['port'],
-                "version": r.get('version', '1.0') 
-            })
-        return {"status": Protocol.STATUS_OK, "rooms": room_list}
+def _create_remote_room(agent, user_id, username, game_id, game_name, run_dir, config):
+    """在 agent 上開 Game Server；失敗回傳 None (呼叫端改開在本機)"""
+    rid = rooms.next_id()
+    try:
+        process = agents.spawn(agent, run_dir, on_exit=lambda code, rid=rid: _on_game_server_exit(rid, code))
+    except agents.AgentError as e:
+        print(f"[Lobby] Agent {agent.name} could not start {os.path.basename(run_dir)}: {e}. Hosting locally.")
+        metrics.incr("lobby.agent_fallback")
+        return None
+    room = Room(rid, game_id, game_name, process.port, username, process, config.get("version", "1.0"), run_dir,
+                max_players=config.get("max_players"))
+    room.agent = agent
+    response = _register_room(room, user_id, username)
+    if process.poll() is not None:
+        # 登記前 Game Server 就結束了 (on_exit 當時找不到房間)
+        _on_game_server_exit(rid, process.returncode)
+    return response
+
+def _game_host(room):
+    """玩家要連的 Game Server 位址；None = 跟 Lobby 同一台"""
+    return room.agent.address if room.agent is not None else None
 
-def handle_join_room(room_id, user_id, username):
-    with lock:
-        if room_id not in rooms:
-            return {"status": Protocol.STATUS_ERROR, "message": "Room not found."}
-        
-        room = rooms[room_id]
-        room["players"].append(username)
-        
-        # ★★★ 關鍵：記錄遊玩歷史 ★★★
+def _register_room(room, user_id, username):
+    # 6. 記錄房間
+    room.players[username] = user_id
+    rooms.add(room)
+    if room.shared is None and room.agent is None:
+        _watch_room(room)
+    
+    # ★★★ 關鍵：記錄遊玩歷史 (為了讓評論功能生效) ★★★
+    # 只記在記憶體，popularity 的背景執行緒批次寫入 play_history，不在請求路徑上 commit
+    popularity.record_room(room.game_id, user_id)
+
+    return {
+        "status": Protocol.STATUS_OK,
+        "message": "Room created.",
+        "room_id": room.room_id,
+        "game_host": _game_host(room),
+        "port": room.port,
+        "room_token": room.token,
+        "game_name": room.game_name,
+        "game_id": room.game_id,
+        "game_version": room.version,
+        "max_players": room.max_players
+    }
+
+def _watch_room(room):
+    # 交給 supervisor 監看：Game Server 結束或當掉時自動收掉房間
+    rid = room.room_id
+    supervisor.watch(room.process, label=f"room {rid} ({os.path.basename(room.run_dir)})",
+                     on_exit=lambda code, rid=rid: _on_game_server_exit(rid, code))
+
+def _shutdown_room(room):
+    """(房間已標記 closed 並移出 registry 後呼叫) 關閉 Game Server 並歸還 Port 與開房名額"""
+    admission.release(room.host)
+    if room.agent is None:
+        reports.forget(room.port, room.room_id if room.shared is not None else None)
+    if room.shared is not None:
+        # 多房間模式：只關這個房間，process 與 port 由 hosting 管
+        hosting.close_room(room.shared, room.room_id)
+        return
+    if room.agent is not None:
+        # agent 上的 Game Server：請 agent 關掉，port 是 agent 自己的
+        agents.stop(room.process)
+        return
+    if room.process:
+        # 非阻塞：terminate，逾時由 supervisor 改用 kill 並回收
+        supervisor.retire(room.process)
+    # Port 歸還 (先隔離一段時間)
+    port_pool.release(room.port)
+
+def _on_game_server_exit(room_id, code):
+    """supervisor 回報 Game Server 結束 (遊戲結束或當掉)：收掉房間"""
+    room = rooms.get(room_id)
+    if room is None:
+        return
+    with room.lock:
+        if room.closed:
+            return
+        room.closed = True
+        rooms.remove(room_id)
+    reason = "finished" if code == 0 else f"crashed (code {code})"
+    print(f"[Lobby] Game Server of room {room_id} {reason}. Room closed.")
+    metrics.incr("lobby.rooms_closed_by_exit")
+    _shutdown_room(room)
+
+def _reported_room(port, room_id):
+    """回報對應的房間 (多房間模式用 room_id，一房一 process 用 port)；找不到回傳 None"""
+    if room_id is not None:
+        room = rooms.get(room_id)
+        return room if room is not None and room.port == port and room.shared is not None else None
+    for room in rooms.rooms_on_port(port):
+        if room.shared is None and room.agent is None:
+            return room
+    return None
+
+def _on_report(port, room_id, report):
+    """Game Server 回報人數或狀態變了：更新房間 (列表 / 推播 / QUICK_JOIN)；打完且沒人了就收掉房間"""
+    room = _reported_room(port, room_id)
+    if room is None:
+        metrics.incr("lobby.report_unknown_room")
+        return
+    with room.lock:
+        if room.closed:
+            return
+        if report.state == "finished" and report.players == 0:
+            room.closed = True
+            rooms.remove(room.room_id)
+        else:
+            rooms.set_live(room, report.players, report.state)
+            return
+    print(f"[Lobby] Game in room {room.room_id} finished. Room closed.")
+    metrics.incr("lobby.rooms_closed_by_report")
+    _shutdown_room(room)
+
+reports.add_listener(_on_report)
+
+def _connected_players(room, host_reports):
+    """Game Server 上目前連著幾個玩家 (優先用 Game Server 自己的回報)；查不到回傳 None"""
+    if room.agent is None:
+        report = reports.get(room.port, room.room_id if room.shared is not None else None)
+        if report is not None:
+            return report.players
+    if room.shared is not None:
+        if room.shared not in host_reports:
+            host_reports[room.shared] = hosting.room_players(room.shared)
+        report = host_reports[room.shared]
+        return None if report is None else report.get(room.room_id, 0)
+    if room.agent is not None:
+        return agents.players_on(room.process)
+    return spawner.connection_count(room.port)
+
+def reap_idle_rooms(ttl=ROOM_IDLE_TTL):
+    """關掉閒置太久的房間 (玩家斷線沒離開、遊戲已經結束但 Game Server 還在...)，回傳關掉幾間"""
+    now = time.monotonic()
+    host_reports = {}
+    idle = []
+    for room in rooms.values():
+        if room.closed:
+            continue
+        if room.shared is None and room.process is not None and room.process.poll() is not None:
+            continue  # 已經結束，supervisor 會收
+        if room.connected is not None and room.agent is None and \
+                reports.get(room.port, room.room_id if room.shared is not None else None) is None:
+            # Game Server 不再回報：列表上的人數 / 狀態不可信了
+            with room.lock:
+                if not room.closed:
+                    rooms.set_live(room, None, None)
+        # 查不到人數 (None) 不能當作沒人：非 Linux、控制通道暫時不通、agent 還沒回報...
+        players = _connected_players(room, host_reports)
+        if players is None or players > 0:
+            room.last_active = now
+        elif now - room.last_active > ttl:
+            idle.append(room)
+
+    reaped = 0
+    for room in idle:
+        with room.lock:
+            if room.closed or now - room.last_active <= ttl:
+                continue
+            room.closed = True
+            rooms.remove(room.room_id)
+        print(f"[Lobby] Room {room.room_id} idle for {now - room.last_active:.0f}s. Reaping...")
+        _shutdown_room(room)
+        metrics.incr("lobby.rooms_reaped")
+        reaped += 1
+    return reaped
+
+def _reap_loop(interval):
+    while True:
+        time.sleep(interval)
         try:
-            db_instance.add_play_history(user_id, room["game_id"])
+            reap_idle_rooms()
+            journal.maybe_compact(rooms.values)
         except Exception as e:
-            print(f"[Lobby Warning] Failed to add play history: {e}")
+            print(f"[Lobby Error] reaper: {e}")
+
+def start_reaper(interval=REAP_INTERVAL):
+    t = threading.Thread(target=_reap_loop, args=(interval,), daemon=True)
+    t.start()
+    return t
+
+def restore_rooms():
+    """
+    Lobby 啟動時從 journal 重建房間：Game Server 的 pid 還活著 (且沒被重用) 就接管 process、
+    port 與開房名額，其他的丟掉；最後把 journal 壓縮成只剩接管成功的房間。回傳接管了幾間。
+    開在 agent 上的房間先接回來，等 agent 重新註冊時確認 Game Server 還在 (不在就照常收掉房間)。
+    玩家跟 Lobby 的連線已經斷了，他們玩完不會再送 LEAVE_ROOM，房間交給閒置回收處理。
+    """
+    states = journal.replay()
+    hosts = {}  # (pid, control) -> (GameHost, {room_id: 人數})
+    restored = 0
+    for rid, st in sorted(states.items(), key=lambda item: int(item[0])):
+        rooms.bump_next_id(rid)
+        if not st.get("players"):
+            continue
+        if st.get("agent"):
+            process = None
+            if st.get("agent_address") and st.get("pid"):
+                process = agents.restore(st["agent"], st["agent_address"], st["pid"], st["port"],
+                                         on_exit=lambda code, rid=rid: _on_game_server_exit(rid, code))
+            if process is None:
+                print(f"[Lobby] Room {rid} was on agent {st['agent']} and cannot be reattached. Dropped.")
+                continue
+        else:
+            process = spawner.attach_process(st.get("pid"), st.get("pid_start"))
+            if process is None:
+                print(f"[Lobby] Room {rid}: Game Server (pid {st.get('pid')}) is gone. Dropped.")
+                continue
+
+        room = Room(rid, st["game_id"], st["game_name"], st["port"], st["host"], process, st["version"],
+                    st["run_dir"], max_players=st.get("max_players"))
+        room.created_at = st.get("created_at", room.created_at)
+        room.players.update(st["players"])
+        if st.get("agent"):
+            room.agent = process.agent
+        elif st.get("control"):
+            key = (st["pid"], st["control"])
+            if key not in hosts:
+                hosts[key] = hosting.reattach(st["game_id"], st["run_dir"], process, st["port"], st["control"],
+                                              st.get("max_rooms"), on_exit=_on_host_exit)
+            host, live = hosts[key]
+            if host is None or rid not in live:
+                continue
+            hosting.adopt_room(host, rid)
+            room.process = host.process
+            room.shared = host
+            room.token = st.get("token")
+        else:
+            port_pool.reserve(room.port)
+
+        rooms.add(room, record=False)
+        if room.shared is None and room.agent is None:
+            _watch_room(room)
+        admission.reserve(room.host)
+        restored += 1
+        print(f"[Lobby] Reattached room {rid} ({room.game_name} v{room.version}, port {room.port}, "
+              f"pid {process.pid}, {len(room.players)} players)")
+
+    journal.compact(rooms.values)
+    metrics.incr("lobby.rooms_restored", restored)
+    return restored
+
+def find_open_room(game_id, run_dir):
+    """找同一版本、還有空位的房間 (優先選人最多的，把房間塞滿)；沒有回傳 None"""
+    best = None
+    for room in rooms.rooms_of_game(game_id):
+        if room.closed or room.run_dir != run_dir:
+            continue
+        slots = room.open_slots()
+        if slots == 0:
+            continue
+        if best is None or len(room.players) > len(best.players):
+            best = room
+    return best
 
-        return {
-            "status": Protocol.STATUS_OK,
-            "message": "Joined room.",
-            "port": room["port"],
-            "game_name": room["game_name"],
-            "game_id": room["game_id"],
-            "game_version": room.get("version", "1.0") 
-        }
+def _on_host_exit(host, code):
+    """多房間 Game Server 結束或當掉：上面所有房間一起收掉"""
+    for room in rooms.rooms_on_port(host.port):
+        if room.shared is not host:
+            continue
+        with room.lock:
+            if room.closed:
+                continue
+            room.closed = True
+            rooms.remove(room.room_id)
+        reports.forget(room.port, room.room_id)
+        print(f"[Lobby] Host of room {room.room_id} exited (code {code}). Room closed.")
+        metrics.incr("lobby.rooms_closed_by_exit")
+        admission.release(room.host)
+
+def handle_list_rooms(request=None):
+    """
+    LIST_ROOMS，可選的條件：game_id / version / host / open (只要還有空位的) / sort (SORT_KEYS) / limit
+    沒有任何條件時回傳快取的完整列表 (只有房間有變動時才會重建)
+    """
+    request = request or {}
+    game_id = request.get("game_id")
+    version = request.get("version")
+    host = request.get("host")
+    open_only = bool(request.get("open"))
+    sort = request.get("sort")
+    limit = request.get("limit")
+    if sort is not None and sort not in SORT_KEYS:
+        return {"status": Protocol.STATUS_ERROR, "message": f"Unknown sort: {sort}. Use one of {sorted(SORT_KEYS)}."}
+    if limit is not None and (not isinstance(limit, int) or limit < 1):
+        return {"status": Protocol.STATUS_ERROR, "message": "limit must be a positive integer."}
+
+    if game_id is None and version is None and host is None and not open_only and sort is None:
+        snapshot = rooms.snapshot()
+        if limit is None:
+            return {"status": Protocol.STATUS_OK, "rooms": snapshot, "total": len(snapshot)}
+        return {"status": Protocol.STATUS_OK, "rooms": snapshot[:min(limit, MAX_LIST_ROOMS)],
+                "total": len(snapshot)}
+
+    summaries, total = rooms.query(game_id=game_id, version=version, host=host, open_only=open_only,
+                                   sort=sort, limit=min(limit or MAX_LIST_ROOMS, MAX_LIST_ROOMS))
+    metrics.incr("lobby.list_rooms_filtered")
+    return {"status": Protocol.STATUS_OK, "rooms": summaries, "total": total}
+
+def handle_quick_join(game_id, user_id, username):
+    """QUICK_JOIN：加入這個遊戲還有空位、人數最多的房間 (回傳跟 JOIN_ROOM 一樣的格式 + room_id)"""
+    if game_id is None:
+        return {"status": Protocol.STATUS_ERROR, "message": "game_id required."}
+    if rooms.rooms_of_player(username):
+        return {"status": Protocol.STATUS_ERROR, "message": "Already in a room."}
+    for _ in range(QUICK_JOIN_RETRIES):
+        room = rooms.best_open_room(game_id)
+        if room is None:
+            break
+        response = handle_join_room(room.room_id, user_id, username)
+        if response["status"] == Protocol.STATUS_OK:
+            metrics.incr("lobby.quick_join")
+            return dict(response, room_id=room.room_id)
+        # 剛好被別人補滿或關掉了，挑下一間
+    metrics.incr("lobby.quick_join_miss")
+    return {"status": Protocol.STATUS_ERROR, "message": "No open room for this game. Create one or use Quick Match."}
+
+def handle_join_room(room_id, user_id, username):
+    room = rooms.get(room_id)
+    if room is None:
+        return {"status": Protocol.STATUS_ERROR, "message": "Room not found."}
+
+    with room.lock:
+        if room.closed:
+            return {"status": Protocol.STATUS_ERROR, "message": "Room not found."}
+        if username not in room.players and room.open_slots() == 0:
+            metrics.incr("lobby.join_full")
+            return {"status": Protocol.STATUS_ERROR, "message": "Room is full."}
+        rooms.add_player(room, username, user_id)
+
+    # ★★★ 關鍵：記錄遊玩歷史 ★★★ (同上，批次寫入)
+    popularity.record_player(room.game_id, user_id)
+
+    return {
+        "status": Protocol.STATUS_OK,
+        "message": "Joined room.",
+        "game_host": _game_host(room),
+        "port": room.port,
+        "game_name": room.game_name,
+        "game_id": room.game_id,
+        "game_version": room.version,
+        "max_players": room.max_players,
+        "room_token": room.token
+    }
 
 def handle_leave_room(room_id, username):
     """處理玩家離開房間：若房間沒人則關閉 Server"""
-    with lock:
-        if room_id not in rooms:
+    room = rooms.get(room_id)
+    if room is None:
+        return {"status": Protocol.STATUS_ERROR, "message": "Room not found."}
+
+    with room.lock:
+        if room.closed:
             return {"status": Protocol.STATUS_ERROR, "message": "Room not found."}
-        
-        room = rooms[room_id]
-        
+
         # 1. 從玩家名單移除
-        if username in room["players"]:
-            room["players"].remove(username)
-            print(f"[Lobby] Player {username} left room {room_id}")
-        else:
+        if not rooms.remove_player(room, username):
             return {"status": Protocol.STATUS_ERROR, "message": "Player not in room."}
+        print(f"[Lobby] Player {username} left room {room_id}")
 
         # 2. 檢查房間是否空了
-        if len(room["players"]) == 0:
-            print(f"[Lobby] Room {room_id} is empty. Shutting down Game Server...")
-            
-            # 殺死 Game Server Process
-            try:
-                if room["process"]:
-                    room["process"].terminate()
-                    # room["process"].wait() 
-            except Exception as e:
-                print(f"[Lobby Error] Killing process failed: {e}")
-            
-            # 刪除房間資料
-            del rooms[room_id]
-            msg = "Room closed (empty)."
-        else:
-            msg = f"Left room. {len(room['players'])} players remaining."
-            print(f"[Lobby] {msg}")
+        remaining = len(room.players)
+        if remaining == 0:
+            room.closed = True
+            rooms.remove(room_id)
+
+    if remaining == 0:
+        print(f"[Lobby] Room {room_id} is empty. Shutting down Game Server...")
+        _shutdown_room(room)
+        msg = "Room closed (empty)."
+    else:
+        msg = f"Left room. {remaining} players remaining."
+        print(f"[Lobby] {msg}")
 
-        return {"status": Protocol.STATUS_OK, "message": msg}
\ No newline at end of file
+    return {"status": Protocol.STATUS_OK, "message": msg}
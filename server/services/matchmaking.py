@@ -0,0 +1,233 @@
+import os
+import time
+import threading
+from collections import deque
+from common.protocol import Protocol
+from server.services import lobby
+from server.services import metrics
+from server.services import admission
+
+# 配對佇列 (QUEUE_MATCH)
+#   每個遊戲一條佇列。玩家排進來後：
+#     1. 先塞進同版本、還有空位的房間 (優先塞人多的房間，減少半空的房間)
+#     2. 排隊人數 >= min_players 就開新房，一次最多放 max_players 個人
+#   湊不到人就繼續等，背景執行緒定期重試 (有人離開房間空出位子時也能補進去)。
+#   開房的房主是這批裡第一個還能開房的人 (開房數到上限的人只能加入)；開房失敗時，
+#   只有遊戲本身的問題 (下架、Port 用完、Game Server 起不來) 才整批回報錯誤。
+#   呼叫端 (handle_client) 會等到配對成功或逾時才回覆。
+
+MATCH_TIMEOUT = float(os.environ.get("LOBBY_MATCH_TIMEOUT", 60))
+MATCH_TIMEOUT_MAX = 300.0
+TICK_INTERVAL = 1.0
+
+# 排隊等待時間分布 (秒)
+WAIT_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+
+class _Ticket:
+    __slots__ = ("user_id", "username", "game_id", "enqueued_at", "event", "result")
+
+    def __init__(self, user_id, username, game_id):
+        self.user_id = user_id
+        self.username = username
+        self.game_id = game_id
+        self.enqueued_at = time.monotonic()
+        self.event = threading.Event()
+        self.result = None
+
+
+_queues = {}       # game_id -> deque[_Ticket]
+_game_locks = {}   # game_id -> Lock (同一個遊戲一次只有一個人在配對)
+_lock = threading.Lock()
+_thread = None
+
+
+def _game_lock(game_id):
+    with _lock:
+        lock = _game_locks.get(game_id)
+        if lock is None:
+            lock = _game_locks[game_id] = threading.Lock()
+        return lock
+
+
+def _pop(queue, n):
+    """從佇列前面取出最多 n 張票 (需持有 _lock)"""
+    return [queue.popleft() for _ in range(min(n, len(queue)))]
+
+
+def _requeue(game_id, tickets):
+    """配對失敗的票放回佇列最前面 (保持先來先配)"""
+    with _lock:
+        queue = _queues.setdefault(game_id, deque())
+        for ticket in reversed(tickets):
+            queue.appendleft(ticket)
+
+
+def _resolve(ticket, response):
+    waited = time.monotonic() - ticket.enqueued_at
+    if response["status"] == Protocol.STATUS_OK:
+        metrics.incr("matchmaking.matched")
+        metrics.observe("matchmaking.wait_seconds", waited, WAIT_BUCKETS)
+        response = dict(response, wait_seconds=round(waited, 2))
+    else:
+        metrics.incr("matchmaking.failed")
+    ticket.result = response
+    ticket.event.set()
+
+
+def _fill_open_rooms(game_id, run_dir):
+    """把排隊的人塞進已經開好、還有空位的房間"""
+    while True:
+        room = lobby.find_open_room(game_id, run_dir)
+        if room is None:
+            return
+        with _lock:
+            queue = _queues.get(game_id)
+            if not queue:
+                return
+            ticket = queue.popleft()
+        response = lobby.handle_join_room(room.room_id, ticket.user_id, ticket.username)
+        if response["status"] != Protocol.STATUS_OK:
+            # 房間剛好滿了或關了：放回去，下一輪再找
+            _requeue(game_id, [ticket])
+            return
+        _resolve(ticket, dict(response, room_id=room.room_id))
+
+
+def _open_new_rooms(game_id, config):
+    min_players = config.get("min_players", 1)
+    max_players = config.get("max_players")
+    while True:
+        with _lock:
+            queue = _queues.get(game_id)
+            if not queue or len(queue) < min_players:
+                return
+            batch = _pop(queue, max_players or len(queue))
+
+        host = next((t for t in batch if not admission.at_user_limit(t.username)), None)
+        if host is None:
+            # 這批人都不能再開房：第一個回報錯誤，其他人放回去等別人開房或空位
+            _resolve(batch[0], {"status": Protocol.STATUS_ERROR,
+                                "message": f"You can host at most {admission.MAX_ROOMS_PER_USER} rooms at a time."})
+            _requeue(game_id, batch[1:])
+            continue
+        others = [t for t in batch if t is not host]
+        response = lobby.handle_create_room(host.user_id, host.username, game_id)
+        if response["status"] != Protocol.STATUS_OK:
+            if admission.at_user_limit(host.username):
+                # 房主自己的問題 (剛好開滿了)：只回報他，其他人放回去
+                _resolve(host, response)
+                _requeue(game_id, others)
+                continue
+            # 開不了房 (遊戲下架、Port 用完...)：整批回報錯誤
+            for ticket in batch:
+                _resolve(ticket, response)
+            return
+        _resolve(host, response)
+
+        room_id = response["room_id"]
+        leftover = []
+        for ticket in others:
+            joined = lobby.handle_join_room(room_id, ticket.user_id, ticket.username)
+            if joined["status"] == Protocol.STATUS_OK:
+                _resolve(ticket, dict(joined, room_id=room_id))
+            else:
+                leftover.append(ticket)
+        if leftover:
+            _requeue(game_id, leftover)
+            return
+
+
+def _match(game_id):
+    with _lock:
+        if not _queues.get(game_id):
+            return
+    with _game_lock(game_id):
+        prepared, error = lobby.prepare_game(game_id)
+        if error:
+            with _lock:
+                tickets = list(_queues.pop(game_id, ()))
+            for ticket in tickets:
+                _resolve(ticket, error)
+            return
+        _, run_dir, config = prepared
+        _fill_open_rooms(game_id, run_dir)
+        _open_new_rooms(game_id, config)
+
+
+def handle_queue_match(user_id, username, game_id, timeout=None):
+    """排隊配對；阻塞到配對成功 (回傳跟 JOIN_ROOM 一樣的格式 + room_id) 或逾時"""
+    if game_id is None:
+        return {"status": Protocol.STATUS_ERROR, "message": "Missing game_id."}
+    game_id = str(game_id)
+    try:
+        timeout = min(float(timeout), MATCH_TIMEOUT_MAX) if timeout is not None else MATCH_TIMEOUT
+    except (TypeError, ValueError):
+        return {"status": Protocol.STATUS_ERROR, "message": "Invalid timeout."}
+
+    if lobby.rooms.rooms_of_player(username):
+        return {"status": Protocol.STATUS_ERROR, "message": "Already in a room."}
+
+    ticket = _Ticket(user_id, username, game_id)
+    with _lock:
+        for queue in _queues.values():
+            if any(t.username == username for t in queue):
+                return {"status": Protocol.STATUS_ERROR, "message": "Already in a match queue."}
+        _queues.setdefault(game_id, deque()).append(ticket)
+    metrics.incr("matchmaking.enqueued")
+
+    try:
+        _match(game_id)
+    except Exception as e:
+        print(f"[Matchmaking Error] {e}")
+
+    deadline = time.monotonic() + timeout
+    while not ticket.event.wait(max(0.0, deadline - time.monotonic())):
+        with _lock:
+            queue = _queues.get(game_id)
+            if queue and ticket in queue:
+                queue.remove(ticket)
+                metrics.incr("matchmaking.timeouts")
+                metrics.observe("matchmaking.wait_seconds.timeout",
+                                time.monotonic() - ticket.enqueued_at, WAIT_BUCKETS)
+                return {"status": Protocol.STATUS_ERROR, "message": "No match found. Please try again."}
+        # 票正在被配對 (不在佇列裡)，稍等結果
+        deadline = time.monotonic() + 0.5
+    return ticket.result
+
+
+def _loop(interval):
+    while True:
+        time.sleep(interval)
+        with _lock:
+            for gid in [gid for gid, queue in _queues.items() if not queue]:
+                del _queues[gid]
+            game_ids = list(_queues)
+        for game_id in game_ids:
+            try:
+                _match(game_id)
+            except Exception as e:
+                print(f"[Matchmaking Error] {e}")
+
+
+def start(interval=TICK_INTERVAL):
+    global _thread
+    if _thread is None:
+        _thread = threading.Thread(target=_loop, args=(interval,), daemon=True)
+        _thread.start()
+    return _thread
+
+
+def stats():
+    now = time.monotonic()
+    with _lock:
+        return {
+            game_id: {
+                "waiting": len(queue),
+                "oldest_wait": round(now - queue[0].enqueued_at, 1) if queue else 0,
+            }
+            for game_id, queue in _queues.items()
+        }
+
+
+metrics.register_source("matchmaking", stats)
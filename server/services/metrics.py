@@ -0,0 +1,67 @@
+import time
+import threading
+
+# 簡單的計數器 / 直方圖，給 STATS 指令查詢
+# 其他模組可以用 register_source() 掛上自己的即時狀態 (例如 cache 大小)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_sources = {}
+_started_at = time.time()
+
+# 直方圖的 bucket 上界 (秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def incr(name, n=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS):
+    """記錄一筆數值到直方圖"""
+    with _lock:
+        h = _histograms.get(name)
+        if h is None:
+            h = {"buckets": list(buckets), "counts": [0] * (len(buckets) + 1), "count": 0, "sum": 0.0,
+                 "max": 0.0}
+            _histograms[name] = h
+        for i, upper in enumerate(h["buckets"]):
+            if value <= upper:
+                h["counts"][i] += 1
+                break
+        else:
+            h["counts"][-1] += 1
+        h["count"] += 1
+        h["sum"] += value
+        h["max"] = max(h["max"], value)
+
+
+def register_source(name, fn):
+    """fn() 回傳可 JSON 化的 dict，snapshot 時才呼叫"""
+    with _lock:
+        _sources[name] = fn
+
+
+def snapshot():
+    with _lock:
+        counters = dict(_counters)
+        histograms = {}
+        for name, h in _histograms.items():
+            histograms[name] = {
+                "count": h["count"],
+                "avg": round(h["sum"] / h["count"], 6) if h["count"] else 0,
+                "max": round(h["max"], 6),
+                "buckets": {("le_%g" % b): c for b, c in zip(h["buckets"], h["counts"])},
+                "overflow": h["counts"][-1],
+            }
+        sources = dict(_sources)
+
+    result = {"uptime": round(time.time() - _started_at, 1), "counters": counters, "histograms": histograms}
+    for name, fn in sources.items():
+        try:
+            result[name] = fn()
+        except Exception as e:
+            result[name] = {"error": str(e)}
+    return result
@@ -0,0 +1,298 @@
+import os
+import json
+import time
+import queue
+import shutil
+import zipfile
+import threading
+from server.services import metrics
+
+# 上傳後的背景處理流程：
+#   檢查 ZIP 完整性/大小 -> 驗證 game_config.json -> 解壓到 staging (每個上傳自己一個名字)
+#   -> publish(promote)：先在 DB 搶到這個名稱 / 版本，才呼叫 promote() 把 staging rename 成 running_games/<版本>、
+#      ZIP 搬到 storage/games。同名同版本的兩個上傳同時在跑時，輸的那個不會蓋掉贏的人的檔案。
+#   玩家第一次開房就不用再等解壓縮。
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+server_dir = os.path.dirname(current_dir)
+STORAGE_DIR = os.path.join(server_dir, 'storage', 'games')
+RUN_ROOT = os.path.join(server_dir, 'running_games')
+
+# ZIP 限制 (避免 zip bomb / 塞爆硬碟)
+MAX_ENTRIES = 10000
+MAX_UNCOMPRESSED_BYTES = 1024 * 1024 * 1024
+MAX_COMPRESSION_RATIO = 200
+
+REQUIRED_CONFIG_FIELDS = ("game_name", "version", "server_cmd", "exe_cmd")
+# 選填欄位與型別
+OPTIONAL_CONFIG_FIELDS = {
+    "description": str,
+    "ready_line": str,   # Game Server 就緒時 stdout 會印出的字串
+    "max_players": int,  # 房間人數上限 (沒填代表不限)
+    "min_players": int,  # 配對時湊滿幾個人才開房 (預設 1)
+    "multi_room": bool,  # 一個 Game Server process 開多個房間 (見 services/hosting.py)
+    "max_rooms_per_process": int,
+    "resources": dict,   # Game Server 的資源提示 (見 services/spawner.py)
+}
+# "resources" 裡可以填的欄位與允許範圍 (含兩端)
+RESOURCE_HINTS = {
+    "cpus": (1, 1024),             # 最多用幾顆 CPU
+    "memory_mb": (16, 1024 * 1024),  # RLIMIT_AS
+    "cpu_seconds": (1, 10 ** 7),   # RLIMIT_CPU (整個 process 累計)
+    "nice": (0, 19),
+}
+
+# 上傳狀態 { (dev_id, game_name): {"version", "state", "message", "updated_at"} }
+# state: pending -> validating -> extracting -> published / failed
+upload_status = {}
+status_lock = threading.Lock()
+# 正在處理中的 ZIP 檔名 (GC 不能動)
+in_flight = set()
+
+# 每個版本 (run_dir) 一把解壓鎖：同一版本同時只有一個人在解壓，其他人等它做完 (single-flight)
+_extract_latches = {}
+_latches_lock = threading.Lock()
+
+_jobs = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+class ValidationError(Exception):
+    pass
+
+
+def run_dir_for(file_rel_path):
+    """Snake_1.1.zip -> running_games/Snake_1.1 (不同版本分開資料夾)"""
+    return os.path.join(RUN_ROOT, file_rel_path.replace(".zip", ""))
+
+
+def check_zip(zip_path):
+    """檢查 ZIP 完整性、檔案數量、解壓後大小與路徑安全"""
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            infos = zf.infolist()
+            if len(infos) > MAX_ENTRIES:
+                raise ValidationError(f"Too many files in ZIP ({len(infos)} > {MAX_ENTRIES}).")
+
+            total = 0
+            for info in infos:
+                name = info.filename
+                if name.startswith(("/", "\\")) or ".." in name.replace("\\", "/").split("/"):
+                    raise ValidationError(f"Unsafe path in ZIP: {name}")
+                if info.compress_size and info.file_size / info.compress_size > MAX_COMPRESSION_RATIO:
+                    raise ValidationError(f"Suspicious compression ratio: {name}")
+                total += info.file_size
+            if total > MAX_UNCOMPRESSED_BYTES:
+                raise ValidationError(f"ZIP too large when extracted ({total} bytes).")
+
+            bad = zf.testzip()
+            if bad:
+                raise ValidationError(f"Corrupted file in ZIP: {bad}")
+
+            if "game_config.json" not in zf.namelist():
+                raise ValidationError("game_config.json missing in ZIP.")
+            try:
+                return json.loads(zf.read("game_config.json").decode('utf-8'))
+            except ValueError:
+                raise ValidationError("Config format error.")
+    except zipfile.BadZipFile as e:
+        raise ValidationError(f"Invalid ZIP: {e}")
+
+
+def validate_config(config, game_name=None, version=None):
+    """驗證 game_config.json 的欄位，回傳 config 本身"""
+    if not isinstance(config, dict):
+        raise ValidationError("Config must be a JSON object.")
+    for field in REQUIRED_CONFIG_FIELDS:
+        if not isinstance(config.get(field), str) or not config[field].strip():
+            raise ValidationError(f"Config field '{field}' missing or not a string.")
+    for field, field_type in OPTIONAL_CONFIG_FIELDS.items():
+        if field in config and not isinstance(config[field], field_type):
+            raise ValidationError(f"Config field '{field}' must be {field_type.__name__}.")
+    for field in ("max_players", "min_players", "max_rooms_per_process"):
+        if field in config and config[field] < 1:
+            raise ValidationError(f"Config field '{field}' must be at least 1.")
+    if config.get("min_players", 1) > config.get("max_players", config.get("min_players", 1)):
+        raise ValidationError("min_players cannot be larger than max_players.")
+    for field, value in config.get("resources", {}).items():
+        if field not in RESOURCE_HINTS:
+            raise ValidationError(f"Unknown resources field '{field}'.")
+        low, high = RESOURCE_HINTS[field]
+        if not isinstance(value, int) or isinstance(value, bool) or not low <= value <= high:
+            raise ValidationError(f"resources.{field} must be an integer between {low} and {high}.")
+    if "{port}" not in config["server_cmd"]:
+        raise ValidationError("server_cmd must contain '{port}'.")
+    if "{port}" not in config["exe_cmd"]:
+        raise ValidationError("exe_cmd must contain '{port}'.")
+    if config.get("multi_room"):
+        if "{control}" not in config["server_cmd"]:
+            raise ValidationError("multi_room server_cmd must contain '{control}'.")
+        if "{token}" not in config["exe_cmd"]:
+            raise ValidationError("multi_room exe_cmd must contain '{token}'.")
+    if game_name is not None and config["game_name"] != game_name:
+        raise ValidationError(f"game_name mismatch (config: {config['game_name']}, upload: {game_name}).")
+    if version is not None and str(config["version"]) != str(version):
+        raise ValidationError(f"version mismatch (config: {config['version']}, upload: {version}).")
+    return config
+
+
+def stage_artifact(zip_path, run_dir):
+    """解壓到 run_dir 旁邊一個只屬於這次呼叫的 staging 資料夾，回傳它的路徑"""
+    os.makedirs(RUN_ROOT, exist_ok=True)
+    staging = f"{run_dir}.staging-{os.getpid()}-{threading.get_ident()}-{time.monotonic_ns()}"
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            zf.extractall(staging)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return staging
+
+
+def promote_artifact(staging, run_dir, replace=False):
+    """
+    staging rename 成 run_dir，其他人不會看到解壓一半的目錄；回傳是否有放上去。
+    replace=False：run_dir 已經有了 (別的 thread / process 同時解壓好了同一個 ZIP) 就丟掉 staging，
+    不動已經在用的目錄。replace=True 只給同版本重新上傳用。
+    """
+    if os.path.exists(run_dir):
+        if not replace:
+            shutil.rmtree(staging, ignore_errors=True)
+            return False
+        # 同版本重新上傳：舊目錄移開但先不刪，可能還有 Game Server 在裡面跑；
+        # 更新 mtime，GC 過了 LEFTOVER_TTL 才會當殘留清掉
+        old = f"{run_dir}.old-{int(time.time() * 1000)}"
+        os.rename(run_dir, old)
+        os.utime(old)
+    try:
+        os.rename(staging, run_dir)
+    except OSError:
+        # 檢查完到 rename 之間別人放好了 (目錄不是空的，rename 失敗)
+        if replace or not os.path.isdir(run_dir):
+            raise
+        shutil.rmtree(staging, ignore_errors=True)
+        return False
+    return True
+
+
+def extract_artifact(zip_path, run_dir):
+    """解壓到 staging 資料夾後再 rename；run_dir 已經有了就不動它，回傳是否有解壓上去"""
+    staging = stage_artifact(zip_path, run_dir)
+    try:
+        return promote_artifact(staging, run_dir)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+
+def _latch(run_dir):
+    with _latches_lock:
+        latch = _extract_latches.get(run_dir)
+        if latch is None:
+            latch = _extract_latches[run_dir] = threading.Lock()
+        return latch
+
+
+def ensure_extracted(zip_path, run_dir):
+    """run_dir 不存在才解壓 (開房時補解壓舊資料用)；同時開同一版本只會解壓一次。回傳是否有解壓"""
+    if os.path.exists(run_dir):
+        return False
+    with _latch(run_dir):
+        if os.path.exists(run_dir):
+            # 等別人解壓完了
+            metrics.incr("pipeline.extract_coalesced")
+            return False
+        # 別的 process (開機暖身的 process pool、另一個 worker) 可能同時在解壓，晚到的不會蓋掉
+        if not extract_artifact(zip_path, run_dir):
+            metrics.incr("pipeline.extract_coalesced")
+            return False
+        return True
+
+
+def _set_status(key, version, state, message=""):
+    with status_lock:
+        upload_status[key] = {
+            "game_name": key[1],
+            "version": version,
+            "state": state,
+            "message": message,
+            "updated_at": time.time(),
+        }
+
+
+def get_upload_status(dev_id):
+    """取得某開發者的上傳處理狀態"""
+    with status_lock:
+        return [dict(v) for k, v in upload_status.items() if k[0] == dev_id]
+
+
+def _process(job):
+    key = (job["dev_id"], job["game_name"])
+    upload_path = job["upload_path"]
+    try:
+        _set_status(key, job["version"], "validating")
+        config = check_zip(upload_path)
+        validate_config(config, job["game_name"], job["version"])
+
+        _set_status(key, job["version"], "extracting")
+        run_dir = run_dir_for(job["file_name"])
+        staging = stage_artifact(upload_path, run_dir)
+
+        def promote():
+            with _latch(run_dir):
+                promote_artifact(staging, run_dir, replace=True)
+            os.replace(upload_path, os.path.join(STORAGE_DIR, job["file_name"]))
+
+        # 全部通過才真正上架；publish 在 DB 搶到名稱 / 版本之後才會呼叫 promote()
+        try:
+            ok, message = job["publish"](promote)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)  # 沒有 promote 的話留下的 staging
+        _set_status(key, job["version"], "published" if ok else "failed", message)
+        print(f"[Pipeline] {job['file_name']}: {message}")
+    except ValidationError as e:
+        _set_status(key, job["version"], "failed", str(e))
+        print(f"[Pipeline] {job['file_name']} rejected: {e}")
+    except Exception as e:
+        _set_status(key, job["version"], "failed", f"Processing error: {e}")
+        print(f"[Pipeline Error] {job['file_name']}: {e}")
+    finally:
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+        with status_lock:
+            in_flight.discard(job["file_name"])
+
+
+def _worker_loop():
+    while True:
+        job = _jobs.get()
+        try:
+            _process(job)
+        finally:
+            _jobs.task_done()
+
+
+def submit(dev_id, game_name, version, upload_path, file_name, publish):
+    """
+    排入背景處理。upload_path 是剛收到的暫存 ZIP。publish(promote) 在驗證/解壓都成功後才會被呼叫，
+    回傳 (ok, message)；它要先在 DB 佔好名稱 / 版本再呼叫 promote()，檔案才會搬到
+    storage/games/<file_name> 與 running_games/<版本>。沒呼叫 promote() 就什麼都不會動到。
+    """
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_worker_loop, daemon=True)
+            _worker.start()
+
+    _set_status((dev_id, game_name), version, "pending")
+    with status_lock:
+        in_flight.add(file_name)
+    _jobs.put({
+        "dev_id": dev_id,
+        "game_name": game_name,
+        "version": version,
+        "upload_path": upload_path,
+        "file_name": file_name,
+        "publish": publish,
+    })
@@ -0,0 +1,161 @@
+import time
+import threading
+from server.services.db import db_instance
+from server.services import metrics
+
+# 遊戲熱門度計數 (下載次數 / 開房次數 / 不重複玩家數)
+# 熱路徑只在記憶體累加，背景執行緒每 FLUSH_INTERVAL 秒批次寫入 SQLite，
+# 寫完順便重新計算排行榜，LIST_GAMES 直接拿排好的結果。
+
+FLUSH_INTERVAL = 10
+# 排行榜最多用多久就重算 (None = 只在 invalidate 時重算)；
+# 多 worker 模式下開房/玩家數是主 process 在寫，worker 只能靠這個定期更新
+RANKINGS_MAX_AGE = None
+
+ORDER_DEFAULT = "default"
+ORDER_POPULAR = "popular"
+ORDER_TOP_RATED = "top_rated"
+ORDER_NEWEST = "newest"
+ORDERS = (ORDER_DEFAULT, ORDER_POPULAR, ORDER_TOP_RATED, ORDER_NEWEST)
+
+# 權重：開房與實際玩家比單純下載更能代表熱門
+WEIGHT_DOWNLOAD = 1
+WEIGHT_ROOM = 3
+WEIGHT_PLAYER = 5
+
+_pending = {}  # game_id -> {"downloads": n, "rooms": n, "players": set()}
+_flushing = {}  # 正在寫入 DB 的那一批 (寫完前 has_pending_play 也要看得到)
+_pending_lock = threading.Lock()
+
+_rankings = None  # order -> [game dict]
+_rankings_dirty = True
+_rankings_built = 0.0
+_rankings_lock = threading.Lock()
+
+_flusher = None
+
+
+def _bucket(game_id):
+    # 呼叫前需持有 _pending_lock
+    c = _pending.get(game_id)
+    if c is None:
+        c = {"downloads": 0, "rooms": 0, "players": set()}
+        _pending[game_id] = c
+    return c
+
+
+def _gid(game_id):
+    try:
+        return int(game_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def record_download(game_id):
+    gid = _gid(game_id)
+    if gid is None: return
+    with _pending_lock:
+        _bucket(gid)["downloads"] += 1
+
+
+def record_room(game_id, player_id):
+    gid = _gid(game_id)
+    if gid is None: return
+    with _pending_lock:
+        c = _bucket(gid)
+        c["rooms"] += 1
+        c["players"].add(player_id)
+
+
+def record_player(game_id, player_id):
+    gid = _gid(game_id)
+    if gid is None: return
+    with _pending_lock:
+        _bucket(gid)["players"].add(player_id)
+
+
+def has_pending_play(player_id, game_id):
+    """玩家的遊玩紀錄是否還在記憶體裡 (尚未寫入 play_history)"""
+    gid = _gid(game_id)
+    with _pending_lock:
+        return any(player_id in batch[gid]["players"] for batch in (_pending, _flushing) if gid in batch)
+
+
+def invalidate_rankings():
+    """遊戲上架/下架/更新/新評論時呼叫，下次查詢會重新排序"""
+    global _rankings_dirty
+    _rankings_dirty = True
+
+
+def flush():
+    """把累積的計數寫入 DB (一次 commit)"""
+    global _pending, _flushing
+    with _pending_lock:
+        batch, _pending = _pending, {}
+        _flushing = batch
+    if not batch:
+        return 0
+
+    start = time.time()
+    ok = db_instance.apply_game_stats(batch)
+    if ok:
+        metrics.observe("popularity.flush_seconds", time.time() - start)
+        metrics.incr("popularity.flushed_games", len(batch))
+        invalidate_rankings()
+    with _pending_lock:
+        _flushing = {}
+        if not ok:
+            # 寫入失敗就把計數放回去，下次再試
+            for gid, c in batch.items():
+                b = _bucket(gid)
+                b["downloads"] += c["downloads"]
+                b["rooms"] += c["rooms"]
+                b["players"] |= c["players"]
+    return len(batch)
+
+
+def _popular_score(g):
+    return (g["downloads"] * WEIGHT_DOWNLOAD + g["rooms_created"] * WEIGHT_ROOM
+            + g["unique_players"] * WEIGHT_PLAYER)
+
+
+def rebuild_rankings():
+    global _rankings, _rankings_dirty, _rankings_built
+    with _rankings_lock:
+        _rankings_dirty = False
+        _rankings_built = time.monotonic()
+        games = db_instance.get_catalog_with_stats()
+        by_id = sorted(games, key=lambda g: g["id"])
+        _rankings = {
+            ORDER_DEFAULT: by_id,
+            ORDER_POPULAR: sorted(by_id, key=_popular_score, reverse=True),
+            ORDER_TOP_RATED: sorted(by_id, key=lambda g: (g["average_rating"], g["review_count"]), reverse=True),
+            ORDER_NEWEST: sorted(by_id, key=lambda g: (g["updated_seq"], g["id"]), reverse=True),
+        }
+        metrics.incr("popularity.ranking_rebuilds")
+        return _rankings
+
+
+def get_ranked_games(order_by=ORDER_DEFAULT):
+    rankings = _rankings
+    stale = RANKINGS_MAX_AGE is not None and time.monotonic() - _rankings_built > RANKINGS_MAX_AGE
+    if rankings is None or _rankings_dirty or stale:
+        rankings = rebuild_rankings()
+    return rankings.get(order_by or ORDER_DEFAULT, rankings[ORDER_DEFAULT])
+
+
+def _flush_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            flush()
+        except Exception as e:
+            print(f"[Popularity Error] {e}")
+
+
+def start_flush_thread(interval=FLUSH_INTERVAL):
+    global _flusher
+    if _flusher is None:
+        _flusher = threading.Thread(target=_flush_loop, args=(interval,), daemon=True)
+        _flusher.start()
+    return _flusher
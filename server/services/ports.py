@@ -0,0 +1,110 @@
+import os
+import time
+import socket
+import threading
+from collections import deque
+
+# Game Server 的 Port 池
+# 取用 (lease) / 歸還 (release) 都是 O(1)，不用再掃所有房間或對每個 port 做 connect 測試。
+# 歸還的 port 先進隔離區 (quarantine) 一段時間，讓舊 process 完全結束、TIME_WAIT 過去再重用。
+
+PORT_RANGE_START = int(os.environ.get("LOBBY_PORT_RANGE_START", 21050))
+PORT_RANGE_END = int(os.environ.get("LOBBY_PORT_RANGE_END", 21150))  # 不含
+QUARANTINE_SECONDS = float(os.environ.get("LOBBY_PORT_QUARANTINE", 5))
+
+
+class PortPool:
+    def __init__(self, start=PORT_RANGE_START, end=PORT_RANGE_END, quarantine=QUARANTINE_SECONDS):
+        self.start = start
+        self.end = end
+        self.quarantine_seconds = quarantine
+        self.free = deque(range(start, end))
+        self.leased = set()
+        self.quarantined = deque()  # (port, 可重用時間)，依時間排序
+        self.lock = threading.Lock()
+
+        self.lease_count = 0
+        self.exhausted_count = 0
+        self.busy_skips = 0  # 系統上被其他程式佔用而跳過的次數
+        self.min_free = len(self.free)
+
+    def _release_quarantine(self, now):
+        # 呼叫前需持有 self.lock
+        while self.quarantined and self.quarantined[0][1] <= now:
+            self.free.append(self.quarantined.popleft()[0])
+
+    def _take(self):
+        with self.lock:
+            self._release_quarantine(time.monotonic())
+            if not self.free:
+                self.exhausted_count += 1
+                return None
+            port = self.free.popleft()
+            self.leased.add(port)
+            self.lease_count += 1
+            self.min_free = min(self.min_free, len(self.free))
+            return port
+
+    @staticmethod
+    def _bindable(port):
+        """快速確認這個 port 沒被池外的程式佔用 (bind 測試，不做 TCP 連線)"""
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                s.bind(('0.0.0.0', port))
+                return True
+            except OSError:
+                return False
+
+    def lease(self, check_bind=True):
+        """取得一個可用 port，沒有就回傳 None"""
+        for _ in range(self.end - self.start):
+            port = self._take()
+            if port is None:
+                return None
+            if not check_bind or self._bindable(port):
+                return port
+            # 被外部程式佔用：丟進隔離區，換下一個
+            with self.lock:
+                self.busy_skips += 1
+            self.release(port)
+        return None
+
+    def reserve(self, port):
+        """把特定 port 標記為使用中 (例如重新接管已在執行的 Game Server)"""
+        with self.lock:
+            if port in self.leased:
+                return False
+            try:
+                self.free.remove(port)
+            except ValueError:
+                self.quarantined = deque((p, t) for p, t in self.quarantined if p != port)
+            self.leased.add(port)
+            return True
+
+    def release(self, port, quarantine=True):
+        with self.lock:
+            if port not in self.leased:
+                return
+            self.leased.discard(port)
+            if quarantine and self.quarantine_seconds > 0:
+                self.quarantined.append((port, time.monotonic() + self.quarantine_seconds))
+            else:
+                self.free.append(port)
+
+    def stats(self):
+        with self.lock:
+            self._release_quarantine(time.monotonic())
+            return {
+                "range": [self.start, self.end],
+                "free": len(self.free),
+                "leased": len(self.leased),
+                "quarantined": len(self.quarantined),
+                "leases": self.lease_count,
+                "exhausted": self.exhausted_count,
+                "busy_skips": self.busy_skips,
+                "min_free": self.min_free,
+            }
+
+
+port_pool = PortPool()
@@ -0,0 +1,196 @@
+import os
+import math
+import time
+import threading
+from collections import deque
+from server.services import metrics
+from server.services import spawner
+from server.services import supervisor
+from server.services.ports import port_pool
+
+# 預熱的 Game Server 池
+#   每個熱門版本 (以 run_dir 區分) 保留幾個已經啟動、正在 listen 的閒置 Game Server，
+#   CREATE_ROOM 直接拿一個來用，背景執行緒再補回去。
+#   要保留幾個由最近的開房速率 (指數衰減平均) 決定，沒人玩的版本會自動縮到 0。
+
+MAX_IDLE_PER_VERSION = int(os.environ.get("LOBBY_PREWARM_MAX", 2))
+RATE_TAU = 300.0        # 開房速率的衰減時間常數 (秒)
+LOOKAHEAD = 60.0        # 預估接下來幾秒內會有幾次開房
+MIN_EXPECTED = 0.1      # 預估值低於這個就不預熱
+TOPUP_INTERVAL = 2.0
+
+
+class _VersionPool:
+    __slots__ = ("run_dir", "game_id", "config", "idle", "rate", "last_event")
+
+    def __init__(self, run_dir, game_id, config):
+        self.run_dir = run_dir
+        self.game_id = str(game_id)
+        self.config = config
+        self.idle = deque()  # [(process, port, spawned_at)]
+        self.rate = 0.0
+        self.last_event = time.monotonic()
+
+    def decayed_rate(self, now):
+        return self.rate * math.exp(-(now - self.last_event) / RATE_TAU)
+
+    def target(self, now):
+        expected = self.decayed_rate(now) * LOOKAHEAD
+        if expected < MIN_EXPECTED:
+            return 0
+        return min(MAX_IDLE_PER_VERSION, max(1, math.ceil(expected)))
+
+
+_pools = {}  # run_dir -> _VersionPool
+_lock = threading.Lock()
+_thread = None
+
+
+def record_demand(run_dir, game_id, config):
+    """每次開房都呼叫，更新該版本的開房速率"""
+    now = time.monotonic()
+    with _lock:
+        pool = _pools.get(run_dir)
+        if pool is None:
+            pool = _VersionPool(run_dir, game_id, config)
+            _pools[run_dir] = pool
+        pool.config = config
+        pool.rate = pool.decayed_rate(now) + 1.0 / RATE_TAU
+        pool.last_event = now
+
+
+def acquire(run_dir):
+    """拿一個預熱好的 Game Server，回傳 (process, port)；沒有就回傳 None"""
+    dead = []
+    result = None
+    with _lock:
+        pool = _pools.get(run_dir)
+        while pool and pool.idle:
+            process, port, _ = pool.idle.popleft()
+            if process.poll() is None:
+                result = (process, port)
+                break
+            dead.append(port)
+    for port in dead:
+        port_pool.release(port)
+    metrics.incr("prewarm.hits" if result else "prewarm.misses")
+    return result
+
+
+def _stop(process, port):
+    supervisor.retire(process)
+    port_pool.release(port)
+
+
+def drain(run_dir=None, game_id=None):
+    """關掉閒置的 Game Server (指定版本 / 指定遊戲 / 全部)"""
+    victims = []
+    with _lock:
+        for key, pool in list(_pools.items()):
+            if run_dir is not None and key != run_dir:
+                continue
+            if game_id is not None and pool.game_id != str(game_id):
+                continue
+            victims.extend(pool.idle)
+            pool.idle.clear()
+            del _pools[key]
+    for process, port, _ in victims:
+        _stop(process, port)
+    return len(victims)
+
+
+def drain_all():
+    return drain()
+
+
+def run_dirs():
+    """有預熱池的版本 (閒置或正在開的 Game Server 在裡面跑，GC 不能刪)"""
+    with _lock:
+        return set(_pools)
+
+
+def _topup_once():
+    now = time.monotonic()
+    to_spawn = []   # [(pool, 數量)]
+    to_stop = []
+    with _lock:
+        for key, pool in list(_pools.items()):
+            # 清掉已經掛掉的
+            alive = deque(item for item in pool.idle if item[0].poll() is None)
+            for item in pool.idle:
+                if item not in alive:
+                    port_pool.release(item[1])
+            pool.idle = alive
+
+            target = pool.target(now)
+            while len(pool.idle) > target:
+                to_stop.append(pool.idle.pop())
+            if target == 0 and not pool.idle:
+                del _pools[key]
+            elif len(pool.idle) < target:
+                to_spawn.append((pool, target - len(pool.idle)))
+
+    for process, port, _ in to_stop:
+        _stop(process, port)
+        metrics.incr("prewarm.retired")
+
+    for pool, count in to_spawn:
+        for _ in range(count):
+            port = port_pool.lease()
+            if port is None:
+                return
+            try:
+                process = spawner.spawn_game_server(pool.config, pool.run_dir, port)
+            except Exception as e:
+                port_pool.release(port, quarantine=False)
+                print(f"[Prewarm] spawn failed for {pool.run_dir}: {e}")
+                break
+            # 只有確定在 listen 的才放進池子
+            ready, info = spawner.wait_until_ready(process, port, label=os.path.basename(pool.run_dir))
+            if not ready:
+                print(f"[Prewarm] {pool.run_dir} not ready: {info}")
+                spawner.kill_process(process)
+                port_pool.release(port)
+                break
+            with _lock:
+                if _pools.get(pool.run_dir) is pool:
+                    pool.idle.append((process, port, time.monotonic()))
+                    process = None
+            if process is not None:
+                # 這段期間版本被 drain 掉了
+                _stop(process, port)
+            else:
+                metrics.incr("prewarm.spawned")
+
+
+def _topup_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            _topup_once()
+        except Exception as e:
+            print(f"[Prewarm Error] {e}")
+
+
+def start(interval=TOPUP_INTERVAL):
+    global _thread
+    if _thread is None:
+        _thread = threading.Thread(target=_topup_loop, args=(interval,), daemon=True)
+        _thread.start()
+    return _thread
+
+
+def stats():
+    now = time.monotonic()
+    with _lock:
+        return {
+            os.path.basename(key): {
+                "idle": len(pool.idle),
+                "target": pool.target(now),
+                "rate_per_min": round(pool.decayed_rate(now) * 60, 3),
+            }
+            for key, pool in _pools.items()
+        }
+
+
+metrics.register_source("prewarm", stats)
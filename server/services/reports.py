@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import socket
+import threading
+from server.services import metrics
+
+# Game Server -> Lobby 的狀態回報 (本機 Unix datagram socket)
+#   Game Server 從環境變數拿到路徑與間隔 (spawner 啟動時帶上)：
+#     LOBBY_REPORT_SOCKET=/tmp/lobby-control/reports.sock   LOBBY_REPORT_INTERVAL=2
+#   狀態有變 (玩家進出、開打、結束) 時送一次，另外每 LOBBY_REPORT_INTERVAL 秒送一次當心跳，一個 datagram 一個 JSON：
+#     {"port": 21050, "room": "12", "players": 2, "state": "playing", "tick_rate": 9.9}
+#   room：多房間模式的 room_id (一房一 process 不用填)；state：waiting / playing / finished；tick_rate 選填。
+#   datagram 不用連線、送不到也不會卡住遊戲，沒有實作回報的 Game Server 照舊用 /proc 或控制通道查人數。
+#   超過 STALE_AFTER 秒沒收到的回報就不採用。
+
+SUPPORTED = hasattr(socket, "AF_UNIX")
+REPORT_INTERVAL = float(os.environ.get("LOBBY_REPORT_INTERVAL", 2))
+STALE_AFTER = REPORT_INTERVAL * 3
+STATES = ("waiting", "playing", "finished")
+MAX_DATAGRAM = 4096
+
+
+class Report:
+    __slots__ = ("players", "state", "tick_rate", "received_at")
+
+    def __init__(self, players, state, tick_rate):
+        self.players = players
+        self.state = state
+        self.tick_rate = tick_rate
+        self.received_at = time.monotonic()
+
+    def fresh(self, now=None):
+        return (now or time.monotonic()) - self.received_at <= STALE_AFTER
+
+
+_reports = {}        # (port, room_id 或 None) -> Report
+_listeners = []      # fn(port, room_id, report)，收到回報時呼叫 (lobby 更新房間)
+_path = None
+_lock = threading.Lock()
+_received = 0
+_malformed = 0
+
+
+def add_listener(fn):
+    _listeners.append(fn)
+
+
+def get(port, room_id=None):
+    """最近一次的回報；沒有或太舊回傳 None"""
+    with _lock:
+        report = _reports.get((port, room_id))
+    return report if report is not None and report.fresh() else None
+
+
+def forget(port, room_id=None):
+    """房間關掉後清掉它的回報 (port 之後會給別的 Game Server 用)"""
+    with _lock:
+        _reports.pop((port, room_id), None)
+
+
+def _parse(data):
+    msg = json.loads(data.decode('utf-8'))
+    port = msg["port"]
+    players = msg["players"]
+    state = msg.get("state", "playing")
+    tick_rate = msg.get("tick_rate")
+    room = msg.get("room")
+    if not isinstance(port, int) or not isinstance(players, int) or players < 0 or state not in STATES:
+        raise ValueError("bad report")
+    if tick_rate is not None and not isinstance(tick_rate, (int, float)):
+        raise ValueError("bad tick_rate")
+    return port, None if room is None else str(room), Report(players, state, tick_rate)
+
+
+def _receive_loop(sock):
+    global _received, _malformed
+    while True:
+        data = sock.recv(MAX_DATAGRAM)
+        try:
+            port, room_id, report = _parse(data)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            with _lock:
+                _malformed += 1
+            continue
+        with _lock:
+            _received += 1
+            old = _reports.get((port, room_id))
+            _reports[(port, room_id)] = report
+        if old is not None and old.state == report.state and old.players == report.players:
+            continue  # 只是心跳
+        for fn in _listeners:
+            try:
+                fn(port, room_id, report)
+            except Exception as e:
+                print(f"[Reports Error] {e}")
+
+
+def start(path):
+    """開始收回報；回傳要傳給 Game Server 的環境變數 (平台不支援回傳空 dict)"""
+    global _path
+    if not SUPPORTED:
+        return {}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    _path = path
+    threading.Thread(target=_receive_loop, args=(sock,), daemon=True).start()
+    print(f"[Reports] Game server reports on {path}")
+    return {"LOBBY_REPORT_SOCKET": path, "LOBBY_REPORT_INTERVAL": str(REPORT_INTERVAL)}
+
+
+def stats():
+    now = time.monotonic()
+    with _lock:
+        reports = list(_reports.values())
+        received, malformed = _received, _malformed
+    fresh = [r for r in reports if r.fresh(now)]
+    states = {s: 0 for s in STATES}
+    for r in fresh:
+        states[r.state] += 1
+    ticks = [r.tick_rate for r in fresh if r.tick_rate is not None]
+    return {
+        "socket": _path,
+        "received": received,
+        "malformed": malformed,
+        "reporting": len(fresh),
+        "stale": len(reports) - len(fresh),
+        "states": states,
+        "players": sum(r.players for r in fresh),
+        "tick_rate_min": round(min(ticks), 2) if ticks else None,
+        "tick_rate_avg": round(sum(ticks) / len(ticks), 2) if ticks else None,
+    }
+
+
+metrics.register_source("reports", stats)
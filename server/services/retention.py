@@ -0,0 +1,159 @@
+import os
+import time
+import shutil
+import threading
+from server.services.db import db_instance
+from server.services import lobby
+from server.services import hosting
+from server.services import prewarm
+from server.services import pipeline
+from server.services.artifact_cache import artifact_cache
+
+# 舊版本清理 (GC)：
+#   - 每款遊戲保留最近 KEEP_VERSIONS 版 (加上目前版本) 的 ZIP 與 running_games 目錄
+#   - 其他沒被引用的 ZIP / 解壓目錄 / 上傳殘留 (.part, .staging-, .old-) 一律刪除
+#   - 正在被使用的目錄 (房間、預熱中的閒置 Game Server、多房間 Game Server) 絕對不刪
+#   - 沒被引用的 ZIP / 解壓目錄也要超過 LEFTOVER_TTL 沒動才刪：多 worker 模式下上傳是在 worker 的 pipeline 處理，
+#     coordinator 這裡看不到它的 in_flight，剛搬到位置、還沒寫進 DB 的新版本不能被當成垃圾
+
+KEEP_VERSIONS = 3
+GC_INTERVAL = 60 * 60          # 每小時跑一次
+LEFTOVER_TTL = 60 * 60         # 暫存檔超過一小時沒動才算殘留
+
+last_report = None
+_gc_lock = threading.Lock()
+
+
+def path_size(path):
+    """檔案或資料夾的總大小 (bytes)"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+
+def _is_leftover(path, now):
+    try:
+        return now - os.path.getmtime(path) > LEFTOVER_TTL
+    except OSError:
+        return False
+
+
+def _live_run_dirs():
+    dirs = set(lobby.rooms.run_dirs()) | prewarm.run_dirs() | hosting.run_dirs()
+    return {os.path.abspath(d) for d in dirs}
+
+
+def collect_garbage(keep=KEEP_VERSIONS, dry_run=False):
+    """
+    執行一次清理，回傳報告:
+    {"removed": [...], "skipped_in_use": [...], "failed": [...], "reclaimed_bytes": n, "dry_run": bool}
+    """
+    global last_report
+    keep = max(1, keep)
+    now = time.time()
+
+    with _gc_lock:
+        # 1. 決定要保留的 ZIP (pipeline 還在處理的也算)
+        keep_files = set(db_instance.get_current_artifacts())
+        with pipeline.status_lock:
+            keep_files |= pipeline.in_flight
+        expired_rows = {}  # file_path -> [version_id]
+        seen = {}
+        for row in db_instance.get_version_history():
+            n = seen.get(row["game_id"], 0)
+            seen[row["game_id"]] = n + 1
+            if n < keep:
+                keep_files.add(row["file_path"])
+            else:
+                expired_rows.setdefault(row["file_path"], []).append(row["id"])
+
+        live_dirs = _live_run_dirs()
+        report = {"removed": [], "skipped_in_use": [], "failed": [], "reclaimed_bytes": 0, "dry_run": dry_run}
+
+        def remove(path):
+            """刪不掉 (權限、已經被別人刪了...) 就跳過，不要中斷整輪清理；回傳是否刪掉"""
+            size = path_size(path)
+            if not dry_run:
+                try:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+                except OSError as e:
+                    print(f"[GC] Cannot remove {os.path.basename(path)}: {e}")
+                    report["failed"].append(os.path.basename(path))
+                    return False
+            report["removed"].append(os.path.basename(path))
+            report["reclaimed_bytes"] += size
+            return True
+
+        # 2. 解壓目錄
+        if os.path.isdir(pipeline.RUN_ROOT):
+            for name in os.listdir(pipeline.RUN_ROOT):
+                path = os.path.join(pipeline.RUN_ROOT, name)
+                if not os.path.isdir(path):
+                    continue
+                if os.path.abspath(path) in live_dirs:
+                    if name + ".zip" not in keep_files:
+                        report["skipped_in_use"].append(name)
+                    continue
+                if ".staging-" in name or ".old-" in name:
+                    if _is_leftover(path, now):
+                        remove(path)
+                elif name + ".zip" not in keep_files and _is_leftover(path, now):
+                    remove(path)
+
+        # 3. ZIP 與上傳殘留
+        deleted_rows = []
+        if os.path.isdir(pipeline.STORAGE_DIR):
+            for name in os.listdir(pipeline.STORAGE_DIR):
+                path = os.path.join(pipeline.STORAGE_DIR, name)
+                if name.endswith(".part"):
+                    if _is_leftover(path, now):
+                        remove(path)
+                    continue
+                if not name.endswith(".zip") or name in keep_files or not _is_leftover(path, now):
+                    continue
+                # 房間還在用這版的話，ZIP 也先留著，下次再清
+                if name[:-4] in report["skipped_in_use"]:
+                    continue
+                if remove(path):
+                    artifact_cache.invalidate(path)
+                    deleted_rows.extend(expired_rows.pop(name, []))
+
+        # DB 中已經沒有檔案的舊版本紀錄也一併清除
+        for file_path, ids in expired_rows.items():
+            if file_path[:-4] not in report["skipped_in_use"] and \
+                    not os.path.exists(os.path.join(pipeline.STORAGE_DIR, file_path)):
+                deleted_rows.extend(ids)
+        if deleted_rows and not dry_run:
+            db_instance.delete_game_versions(deleted_rows)
+
+        last_report = dict(report, finished_at=now)
+
+    mb = report["reclaimed_bytes"] / (1024 * 1024)
+    print(f"[GC] Removed {len(report['removed'])} items, reclaimed {mb:.2f} MB"
+          f"{' (dry run)' if dry_run else ''}. In use: {report['skipped_in_use']}")
+    return report
+
+
+def _gc_loop(interval):
+    while True:
+        try:
+            collect_garbage()
+        except Exception as e:
+            print(f"[GC Error] {e}")
+        time.sleep(interval)
+
+
+def start_gc_thread(interval=GC_INTERVAL):
+    t = threading.Thread(target=_gc_loop, args=(interval,), daemon=True)
+    t.start()
+    return t
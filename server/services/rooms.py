@@ -0,0 +1,296 @@
+import time
+import threading
+
+# 房間資料結構
+#   Room: 單一房間 (__slots__，每個房間有自己的 lock)
+#   RoomRegistry: 所有房間 + 索引 (game_id / 玩家 / port / 房主 / 有空位的房間)，
+#                 沒有條件的 LIST_ROOMS 結果會快取到下次有變動為止；有條件的用 query() 從索引挑
+#
+# Lock 順序：room.lock -> registry.lock (registry.lock 只保護索引，持有時間很短)
+# 有給 journal (services/journal.py) 的話，每次新增/移除房間與玩家進出都會寫一筆，重啟時用來重建；
+# 有給 events (services/events.py) 的話，同樣的變動會推播給訂閱 "rooms" 的 client
+
+
+class Room:
+    __slots__ = ("room_id", "game_id", "game_name", "port", "host", "players", "process",
+                 "version", "run_dir", "max_players", "shared", "agent", "token", "created_at", "last_active", "connected", "state",
+                 "closed", "lock")
+
+    def __init__(self, room_id, game_id, game_name, port, host, process, version, run_dir,
+                 max_players=None):
+        self.room_id = room_id
+        self.game_id = str(game_id)
+        self.game_name = game_name
+        self.port = port
+        self.host = host
+        self.players = {}  # username -> user_id (dict 保留加入順序，移除是 O(1))
+        self.process = process
+        self.version = version
+        self.run_dir = run_dir
+        self.max_players = max_players  # None = 不限人數
+        self.shared = None  # 多房間模式：所在的 hosting.GameHost (process 由它管)
+        self.agent = None   # 開在 game host agent 上：agents.Agent (process 是 agents.RemoteProcess)
+        self.token = None   # 多房間模式：玩家連線時要送的房間 token
+        self.created_at = time.time()
+        self.last_active = time.monotonic()  # 最後有人進出 / 有玩家連著 Game Server 的時間 (閒置回收用)
+        self.connected = None  # Game Server 回報的連線人數 (services/reports.py)；None = 沒有回報
+        self.state = None      # Game Server 回報的狀態：waiting / playing / finished
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def summary(self):
+        """LIST_ROOMS 回傳的格式"""
+        return {
+            "id": self.room_id,
+            "game_id": self.game_id,
+            "game_name": self.game_name,
+            "host": self.host,
+            "players": len(self.players),
+            "max_players": self.max_players,
+            "port": self.port,
+            "version": self.version,
+            "state": self.state,
+            "connected": self.connected,
+        }
+
+    def open_slots(self):
+        """還能加入幾個人 (不限人數回傳 None)"""
+        if self.max_players is None:
+            return None
+        return max(0, self.max_players - len(self.players))
+
+
+# LIST_ROOMS 的排序方式 -> sort key (Room)
+SORT_KEYS = {
+    "id": lambda r: int(r.room_id),
+    "players": lambda r: (-len(r.players), int(r.room_id)),       # 人多的在前
+    "open_slots": lambda r: (-(r.open_slots() if r.max_players is not None else float("inf")), int(r.room_id)),
+    "newest": lambda r: -r.created_at,
+    "oldest": lambda r: r.created_at,
+}
+
+
+class RoomRegistry:
+    def __init__(self, journal=None, events=None):
+        self.lock = threading.Lock()
+        self.journal = journal
+        self.events = events
+        self._rooms = {}       # room_id -> Room
+        self._by_game = {}     # game_id -> {room_id}
+        self._by_player = {}   # username -> {room_id}
+        self._by_port = {}     # port -> {room_id} (多房間模式會共用 port)
+        self._by_host = {}     # 房主 username -> {room_id}
+        # 還有空位的房間：game_id -> {玩家數: {room_id: None}}，QUICK_JOIN 直接挑人數最多的那一桶
+        self._open = {}
+        self._open_bucket = {}  # room_id -> 目前在 _open 的哪一桶 (玩家數)；沒有空位就不在
+        self._next_id = 1
+        self._revision = 0
+        self._snapshot = []
+        self._snapshot_revision = -1
+
+    # ---------- 內部索引維護 (需持有 self.lock) ----------
+    @staticmethod
+    def _index_add(index, key, room_id):
+        index.setdefault(key, set()).add(room_id)
+
+    @staticmethod
+    def _index_discard(index, key, room_id):
+        ids = index.get(key)
+        if ids:
+            ids.discard(room_id)
+            if not ids:
+                del index[key]
+
+    def _index_open(self, room):
+        """房間人數變了 (或新增/移除) 之後，更新它在 _open 的位置"""
+        rid = room.room_id
+        old = self._open_bucket.pop(rid, None)
+        if old is not None:
+            buckets = self._open[room.game_id]
+            del buckets[old][rid]
+            if not buckets[old]:
+                del buckets[old]
+                if not buckets:
+                    del self._open[room.game_id]
+        if rid in self._rooms and not room.closed and room.state != "finished" and room.open_slots() != 0:
+            count = len(room.players)
+            self._open.setdefault(room.game_id, {}).setdefault(count, {})[rid] = None
+            self._open_bucket[rid] = count
+
+    # ---------- 房間 ----------
+    def next_id(self):
+        with self.lock:
+            rid = str(self._next_id)
+            self._next_id += 1
+            return rid
+
+    def bump_next_id(self, room_id):
+        """重建房間後，之後的 room_id 要接在後面 (不能跟還在的房間撞號)"""
+        with self.lock:
+            self._next_id = max(self._next_id, int(room_id) + 1)
+
+    def add(self, room, record=True):
+        with self.lock:
+            self._rooms[room.room_id] = room
+            self._index_add(self._by_game, room.game_id, room.room_id)
+            self._index_add(self._by_port, room.port, room.room_id)
+            self._index_add(self._by_host, room.host, room.room_id)
+            for username in room.players:
+                self._index_add(self._by_player, username, room.room_id)
+            self._index_open(room)
+            self._revision += 1
+            # 在 lock 裡寫：房間放進來之後別人才找得到它來 JOIN，create 一定排在它的 join 前面
+            if record and self.journal:
+                self.journal.record("create", room)
+        self._publish("added", room)
+
+    def remove(self, room_id):
+        with self.lock:
+            room = self._rooms.pop(room_id, None)
+            if room is None:
+                return None
+            self._index_discard(self._by_game, room.game_id, room_id)
+            self._index_discard(self._by_port, room.port, room_id)
+            self._index_discard(self._by_host, room.host, room_id)
+            for username in room.players:
+                self._index_discard(self._by_player, username, room_id)
+            self._index_open(room)
+            self._revision += 1
+            if self.journal:
+                self.journal.record("close", room)
+        self._publish("removed", room)
+        return room
+
+    def get(self, room_id):
+        with self.lock:
+            return self._rooms.get(room_id)
+
+    def __contains__(self, room_id):
+        with self.lock:
+            return room_id in self._rooms
+
+    def __len__(self):
+        with self.lock:
+            return len(self._rooms)
+
+    def values(self):
+        with self.lock:
+            return list(self._rooms.values())
+
+    # ---------- 玩家 (呼叫前需持有 room.lock) ----------
+    def add_player(self, room, username, user_id):
+        room.players[username] = user_id
+        room.last_active = time.monotonic()
+        with self.lock:
+            self._index_add(self._by_player, username, room.room_id)
+            self._index_open(room)
+            self._revision += 1
+        if self.journal:
+            self.journal.record("join", room, username=username, user_id=user_id)
+        self._publish("updated", room)
+
+    def remove_player(self, room, username):
+        if room.players.pop(username, None) is None:
+            return False
+        room.last_active = time.monotonic()
+        with self.lock:
+            self._index_discard(self._by_player, username, room.room_id)
+            self._index_open(room)
+            self._revision += 1
+        if self.journal:
+            self.journal.record("leave", room, username=username)
+        self._publish("updated", room)
+        return True
+
+    def set_live(self, room, connected, state):
+        """Game Server 回報的人數 / 狀態 (呼叫前需持有 room.lock)"""
+        if room.connected == connected and room.state == state:
+            return
+        room.connected = connected
+        room.state = state
+        if connected:
+            room.last_active = time.monotonic()
+        with self.lock:
+            self._index_open(room)
+            self._revision += 1
+        self._publish("updated", room)
+
+    def _publish(self, op, room):
+        if self.events:
+            self.events.publish(self.events.TOPIC_ROOMS, room.room_id, op,
+                                None if op == "removed" else room.summary())
+
+    # ---------- 查詢 ----------
+    def has_game(self, game_id):
+        with self.lock:
+            return bool(self._by_game.get(str(game_id)))
+
+    def rooms_of_game(self, game_id):
+        with self.lock:
+            return [self._rooms[rid] for rid in self._by_game.get(str(game_id), ())]
+
+    def rooms_of_player(self, username):
+        with self.lock:
+            return [self._rooms[rid] for rid in self._by_player.get(username, ())]
+
+    def rooms_on_port(self, port):
+        with self.lock:
+            return [self._rooms[rid] for rid in self._by_port.get(port, ())]
+
+    def run_dirs(self):
+        with self.lock:
+            return {r.run_dir for r in self._rooms.values() if r.run_dir}
+
+    def snapshot(self):
+        """LIST_ROOMS 用的列表；只有房間/人數有變動時才重建"""
+        with self.lock:
+            if self._snapshot_revision != self._revision:
+                self._snapshot = [r.summary() for r in self._rooms.values()]
+                self._snapshot_revision = self._revision
+            return self._snapshot
+
+    def best_open_room(self, game_id):
+        """這個遊戲還有空位、人數最多的房間 (先把房間塞滿)；沒有回傳 None。
+        只看 _open 的桶數 (最多 max_players 個)，跟房間總數無關"""
+        with self.lock:
+            buckets = self._open.get(str(game_id))
+            if not buckets:
+                return None
+            bucket = buckets[max(buckets)]
+            return self._rooms[next(iter(bucket))]
+
+    def query(self, game_id=None, version=None, host=None, open_only=False, sort=None, limit=None):
+        """
+        有條件的 LIST_ROOMS：從最小的索引挑候選，再過濾其他條件。回傳 (summaries, 符合的總數)。
+        sort 是 SORT_KEYS 的名稱；limit 只截斷回傳的列表，總數照算。
+        """
+        with self.lock:
+            candidates = []
+            if game_id is not None:
+                candidates.append(self._by_game.get(str(game_id), ()))
+            if host is not None:
+                candidates.append(self._by_host.get(host, ()))
+            if open_only:
+                if game_id is not None:
+                    open_ids = [rid for bucket in self._open.get(str(game_id), {}).values() for rid in bucket]
+                else:
+                    open_ids = self._open_bucket
+                candidates.append(open_ids)
+            ids = min(candidates, key=len) if candidates else self._rooms
+            matched = []
+            for rid in ids:
+                room = self._rooms[rid]
+                if game_id is not None and room.game_id != str(game_id):
+                    continue
+                if host is not None and room.host != host:
+                    continue
+                if version is not None and str(room.version) != str(version):
+                    continue
+                if open_only and rid not in self._open_bucket:
+                    continue
+                matched.append(room)
+        matched.sort(key=SORT_KEYS[sort or "id"])
+        total = len(matched)
+        if limit is not None:
+            matched = matched[:limit]
+        return [r.summary() for r in matched], total
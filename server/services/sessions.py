@@ -0,0 +1,39 @@
+import threading
+
+# 線上使用者 { "username:role": owner }
+#   owner 是連線的識別字串："ip:port"；多 worker 模式前面再加 worker 的 pid ("pid:ip:port")，
+#   這樣 worker 掛掉時可以一次清掉它的所有連線 (release_owner_prefix)。
+# 多 worker 模式下只有 coordinator (主 process) 持有這份資料，worker 透過 state.call 存取。
+
+_online = {}
+_lock = threading.Lock()
+
+
+def claim(key, owner):
+    """登入時佔用帳號；同帳號已在別的連線登入回傳 False"""
+    with _lock:
+        current = _online.get(key)
+        if current is not None and current != owner:
+            return False
+        _online[key] = owner
+        return True
+
+
+def release(key, owner):
+    with _lock:
+        if _online.get(key) == owner:
+            del _online[key]
+
+
+def release_owner_prefix(prefix):
+    """清掉某個 worker 的所有登入 (worker 異常結束時)；回傳清掉的 "username:role" 清單"""
+    with _lock:
+        keys = [k for k, owner in _online.items() if owner.startswith(prefix)]
+        for k in keys:
+            del _online[k]
+    return keys
+
+
+def count():
+    with _lock:
+        return len(_online)
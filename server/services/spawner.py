@@ -0,0 +1,394 @@
+import os
+import json
+import time
+import errno
+import signal
+import socket
+import tempfile
+import itertools
+import threading
+import subprocess
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+from server.services import pipeline
+from server.services import metrics
+from common.utils import build_argv
+
+# 啟動 Game Server 的共用邏輯 (lobby 開房與 prewarm 預熱都走這裡)
+#
+# 就緒檢查 (readiness)：Game Server 真的在 listen 之後才算開房成功
+#   - game_config.json 有 "ready_line"：等 stdout 印出含有該字串的那一行。
+#     stdout 寫到 GAME_LOG_DIR/<port>.log (不是 pipe)，Lobby 從檔案找那一行；
+#     Lobby 重啟後 Game Server 繼續寫檔，不會因為 pipe 沒人讀而收到 EPIPE
+#   - 否則 Linux 上查 /proc/net/tcp 的 LISTEN 狀態 (不會真的連進去，不會佔到玩家名額)
+#   - 非 Linux 試著 bind 同一個 port，bind 不上就代表已經在 listen
+#     (不能用 connect 探測：只收一個人的 Game Server 會把探測連線當成第一個玩家)
+# 以上都用指數退避 (exponential backoff) 輪詢，逾時或 process 掛掉就殺掉並回報失敗。
+
+READY_TIMEOUT = float(os.environ.get("LOBBY_READY_TIMEOUT", 10))
+GAME_LOG_DIR = os.environ.get("LOBBY_GAME_LOG_DIR", os.path.join(tempfile.gettempdir(), "lobby-game-logs"))
+READY_POLL_MIN = 0.01
+READY_POLL_MAX = 0.5
+KILL_GRACE = 2.0
+
+# spawn -> ready 的時間分布 (秒)
+READY_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10)
+
+
+# 資源限制 (Linux)：Game Server 不跟 Lobby 搶 CPU，失控時也不會吃光記憶體
+#   LOBBY_RESERVED_CPUS：編號最小的幾顆 CPU 留給 Lobby，Game Server 只排在其他 CPU 上 (只有一顆時不保留)
+#   game_config.json 的 "resources" 提示 (pipeline.RESOURCE_HINTS 驗證範圍)：
+#     cpus: 只用幾顆 CPU (從 Game Server 可用的 CPU 輪流分配)   memory_mb: RLIMIT_AS
+#     cpu_seconds: RLIMIT_CPU (超過就被 SIGXCPU 殺掉，supervisor 當作當掉收房)   nice: 0~19
+#   沒填的用 LOBBY_GAME_MEMORY_MB / LOBBY_GAME_NICE (0 = 不限制)，nice 不會比 Lobby 設的預設值低。
+#   process 起來後由 Lobby 用 sched_setaffinity / prlimit / setpriority 套用，不用 preexec_fn
+#   (Lobby 是多執行緒，fork 之後在子 process 跑 Python 程式碼可能 deadlock)。
+RESERVED_CPUS = int(os.environ.get("LOBBY_RESERVED_CPUS", 1))
+GAME_MEMORY_MB = int(os.environ.get("LOBBY_GAME_MEMORY_MB", 0))
+GAME_NICE = int(os.environ.get("LOBBY_GAME_NICE", 0))
+CPU_LIMIT_GRACE = 5  # RLIMIT_CPU soft 到 hard 之間的秒數 (先收 SIGXCPU，再被 SIGKILL)
+
+try:
+    _ALL_CPUS = sorted(os.sched_getaffinity(0))
+except AttributeError:  # 非 Linux
+    _ALL_CPUS = None
+GAME_CPUS = _ALL_CPUS[RESERVED_CPUS:] if _ALL_CPUS and len(_ALL_CPUS) > RESERVED_CPUS else _ALL_CPUS
+_cpu_rotation = itertools.count()
+
+
+# 額外給 Game Server 的環境變數 (例如 reports.start() 回傳的回報通道)
+GAME_ENV = {}
+
+
+# 解析過的 game_config.json：run_dir -> ((mtime_ns, size), config)，檔案沒變就不用每次開房都重新解析
+_config_cache = {}
+_config_lock = threading.Lock()
+
+
+def load_game_config(run_dir):
+    """讀取並驗證解壓目錄中的 game_config.json (回傳的 dict 是共用的，不要修改)"""
+    config_path = os.path.join(run_dir, "game_config.json")
+    try:
+        st = os.stat(config_path)
+    except FileNotFoundError:
+        raise pipeline.ValidationError("game_config.json missing in ZIP.")
+    key = (st.st_mtime_ns, st.st_size)
+    with _config_lock:
+        cached = _config_cache.get(run_dir)
+    if cached and cached[0] == key:
+        return cached[1]
+    try:
+        with open(config_path, 'r') as f:
+            config = pipeline.validate_config(json.load(f))
+    except ValueError as e:
+        raise pipeline.ValidationError(f"Config format error: {e}")
+    with _config_lock:
+        _config_cache[run_dir] = (key, config)
+    return config
+
+
+def build_server_argv(config, port, control=None):
+    # {control}：多房間模式的控制通道路徑 (hosting.py)；一般模式給空字串
+    return build_argv(config.get("server_cmd", ""), port=port, control=control or "")
+
+
+# 每個 Game Server 自成一個 process group (POSIX: 新 session)，關閉時整組送信號
+if os.name == 'nt':
+    _GROUP_KWARGS = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+else:
+    _GROUP_KWARGS = {"start_new_session": True}
+
+
+def signal_process(process, sig):
+    """對 Game Server 的整個 process group 送信號 (Windows 退回只送給本身)"""
+    if process.returncode is not None:
+        return  # 已經回收，pid 可能被重用，不能再送
+    if os.name == 'nt':
+        if sig == signal.SIGTERM:
+            process.terminate()
+        else:
+            process.kill()
+        return
+    try:
+        os.killpg(process.pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+def resource_policy(config):
+    """game_config.json 的 resources 提示 + Lobby 預設 -> 要套用的限制 (dict，空的代表不限制)"""
+    hints = config.get("resources") or {}
+    policy = {}
+    if GAME_CPUS:
+        count = hints.get("cpus", len(GAME_CPUS))
+        if count < len(GAME_CPUS):
+            start = next(_cpu_rotation)
+            policy["cpus"] = [GAME_CPUS[(start + i) % len(GAME_CPUS)] for i in range(count)]
+        elif GAME_CPUS != _ALL_CPUS:
+            policy["cpus"] = GAME_CPUS
+    memory_mb = hints.get("memory_mb", GAME_MEMORY_MB)
+    if memory_mb:
+        policy["memory_bytes"] = memory_mb * 1024 * 1024
+    if hints.get("cpu_seconds"):
+        policy["cpu_seconds"] = hints["cpu_seconds"]
+    nice = max(hints.get("nice", GAME_NICE), GAME_NICE)
+    if nice:
+        policy["nice"] = nice
+    return policy
+
+
+def apply_resources(pid, policy):
+    """對已啟動的 process 套用 resource_policy() 的結果；平台不支援或失敗只記錄，不影響開房"""
+    if not policy:
+        return
+    try:
+        if "cpus" in policy:
+            os.sched_setaffinity(pid, policy["cpus"])
+        if "memory_bytes" in policy and resource is not None:
+            limit = policy["memory_bytes"]
+            resource.prlimit(pid, resource.RLIMIT_AS, (limit, limit))
+        if "cpu_seconds" in policy and resource is not None:
+            limit = policy["cpu_seconds"]
+            resource.prlimit(pid, resource.RLIMIT_CPU, (limit, limit + CPU_LIMIT_GRACE))
+        if "nice" in policy:
+            os.setpriority(os.PRIO_PROCESS, pid, policy["nice"])
+        metrics.incr("spawn.resources_applied")
+    except (OSError, AttributeError, ValueError) as e:
+        metrics.incr("spawn.resources_failed")
+        print(f"[Lobby] Cannot apply resource limits to pid {pid}: {e}")
+
+
+def resource_stats():
+    return {
+        "reserved_cpus": _ALL_CPUS[:RESERVED_CPUS] if GAME_CPUS != _ALL_CPUS else [],
+        "game_cpus": GAME_CPUS,
+        "default_memory_mb": GAME_MEMORY_MB,
+        "default_nice": GAME_NICE,
+    }
+
+
+metrics.register_source("resources", resource_stats)
+
+
+def _watch_ready_line(process, log_path, ready_line):
+    """從 Game Server 的 log 檔找 ready_line，看到就設定 ready_event；process 結束或逾時就不找了"""
+    deadline = time.monotonic() + READY_TIMEOUT * 2
+    line = ""
+    with open(log_path, 'r', errors='replace') as f:
+        while process.poll() is None and time.monotonic() < deadline:
+            part = f.readline()
+            if not part:
+                time.sleep(READY_POLL_MIN)
+                continue
+            line += part
+            if not line.endswith("\n"):
+                continue  # 還沒寫完的一行
+            if ready_line in line:
+                process.ready_event.set()
+                return
+            line = ""
+
+
+def spawn_game_server(config, run_dir, port, control=None):
+    """
+    啟動 Game Server Process (不經過 /bin/sh)；cwd 設定為 run_dir，這樣 Server 就在解壓後的目錄跑
+    """
+    argv = build_server_argv(config, port, control)
+    print(f"[Lobby] Starting Game Server (v{config.get('version', '1.0')}): {' '.join(argv)}")
+
+    env = dict(os.environ, PYTHONUNBUFFERED="1", **GAME_ENV)
+    ready_line = config.get("ready_line")
+    if ready_line:
+        os.makedirs(GAME_LOG_DIR, exist_ok=True)
+        log_path = os.path.join(GAME_LOG_DIR, f"{port}.log")
+        with open(log_path, 'wb') as log:
+            process = subprocess.Popen(argv, cwd=run_dir, env=env, stdout=log,
+                                       stderr=subprocess.STDOUT, **_GROUP_KWARGS)
+        print(f"[Lobby] Game Server output: {log_path}")
+        process.ready_event = threading.Event()
+        threading.Thread(target=_watch_ready_line, args=(process, log_path, ready_line), daemon=True).start()
+    else:
+        process = subprocess.Popen(argv, cwd=run_dir, env=env, **_GROUP_KWARGS)
+        process.ready_event = None
+    process.spawned_at = time.monotonic()
+    apply_resources(process.pid, resource_policy(config))
+    return process
+
+
+def _proc_sockets(port, state):
+    """數 /proc/net/tcp{,6} 中 local port = port 且狀態為 state 的 socket；非 Linux 回傳 None"""
+    found_table = False
+    count = 0
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table, 'r') as f:
+                found_table = True
+                next(f, None)
+                for line in f:
+                    parts = line.split()
+                    # local_address = IP:PORT (hex)，st: 0A = LISTEN, 01 = ESTABLISHED
+                    if len(parts) > 3 and parts[3] == state and int(parts[1].rsplit(':', 1)[1], 16) == port:
+                        count += 1
+        except OSError:
+            continue
+    return count if found_table else None
+
+
+def _proc_listening(port):
+    """查 /proc/net/tcp{,6} 是否有人在 listen 這個 port；非 Linux 回傳 None"""
+    count = _proc_sockets(port, "0A")
+    return None if count is None else count > 0
+
+
+def connection_count(port):
+    """Game Server 這個 port 上目前有幾條已建立的連線 (閒置回收用)；查不到回傳 None"""
+    return _proc_sockets(port, "01")
+
+
+def _bind_probe(port):
+    """bind 得上代表沒人在用這個 port；不會連進 Game Server，不會佔到玩家名額"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        if hasattr(socket, "SO_EXCLUSIVEADDRUSE"):
+            # Windows 的 SO_REUSEADDR 允許搶別人的 port，要用這個才會 bind 失敗
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_EXCLUSIVEADDRUSE, 1)
+        else:
+            # 只剩 TIME_WAIT 的舊連線不算
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            s.bind(('0.0.0.0', port))
+        except OSError as e:
+            if e.errno in (errno.EADDRINUSE, errno.EACCES) or getattr(e, "winerror", None) == 10048:
+                return True
+            raise
+        return False
+
+
+def is_listening(port):
+    state = _proc_listening(port)
+    return _bind_probe(port) if state is None else state
+
+
+def wait_until_ready(process, port, label=None, timeout=READY_TIMEOUT):
+    """
+    等 Game Server 就緒。回傳 (True, 秒數) 或 (False, 錯誤訊息)。
+    label (例如 Snake_3.2) 用來記錄 spawn->ready 的直方圖。
+    """
+    start = getattr(process, "spawned_at", time.monotonic())
+    deadline = time.monotonic() + timeout
+    delay = READY_POLL_MIN
+    event = getattr(process, "ready_event", None)
+
+    while True:
+        code = process.poll()
+        if code is not None:
+            metrics.incr("spawn.failed_exit")
+            return False, f"Game server exited during startup (code {code})."
+
+        ready = event.is_set() if event is not None else is_listening(port)
+        if ready:
+            elapsed = time.monotonic() - start
+            metrics.observe("spawn.ready_seconds", elapsed, READY_BUCKETS)
+            if label:
+                metrics.observe(f"spawn.ready_seconds.{label}", elapsed, READY_BUCKETS)
+            return True, elapsed
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            metrics.incr("spawn.failed_timeout")
+            return False, f"Game server not ready after {timeout:.0f}s."
+
+        if event is not None:
+            event.wait(min(delay, remaining))
+        else:
+            time.sleep(min(delay, remaining))
+        delay = min(delay * 2, READY_POLL_MAX)
+
+
+def _proc_stat(pid):
+    """/proc/<pid>/stat 中 ')' 之後的欄位 (從 state 開始)；讀不到回傳 None"""
+    try:
+        with open(f"/proc/{pid}/stat", 'r') as f:
+            return f.read().rsplit(')', 1)[1].split()
+    except (OSError, IndexError):
+        return None
+
+
+def process_start_time(pid):
+    """process 的啟動時間 (開機後的 clock ticks)，用來確認 pid 沒有被別的 process 重用；非 Linux 回傳 None"""
+    fields = _proc_stat(pid)
+    try:
+        return int(fields[19]) if fields else None
+    except (IndexError, ValueError):
+        return None
+
+
+class AttachedProcess:
+    """
+    Lobby 重啟後重新接管的 Game Server (不是自己的子 process，不能 waitpid)。
+    提供 supervisor / signal_process / kill_process 會用到的 Popen 介面；結束碼拿不到，一律當 0。
+    """
+    def __init__(self, pid, start_time=None):
+        self.pid = pid
+        self.start_time = start_time
+        self.returncode = None
+        self.stdout = None
+        self.ready_event = None
+        self.spawned_at = time.monotonic()
+
+    def _alive(self):
+        fields = _proc_stat(self.pid)
+        if fields is None:
+            if os.path.exists("/proc"):
+                return False
+            try:
+                os.kill(self.pid, 0)
+                return True
+            except ProcessLookupError:
+                return False
+            except PermissionError:
+                return True
+        if fields[0] == 'Z':
+            return False
+        return self.start_time is None or process_start_time(self.pid) == self.start_time
+
+    def poll(self):
+        if self.returncode is None and not self._alive():
+            self.returncode = 0
+        return self.returncode
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise subprocess.TimeoutExpired(f"pid {self.pid}", timeout)
+            time.sleep(0.05)
+        return self.returncode
+
+    def terminate(self):
+        os.kill(self.pid, signal.SIGTERM)
+
+    def kill(self):
+        os.kill(self.pid, getattr(signal, "SIGKILL", signal.SIGTERM))
+
+
+def attach_process(pid, start_time=None):
+    """接管還在跑的 process；pid 已經不在 (或被重用) 回傳 None"""
+    if not pid:
+        return None
+    process = AttachedProcess(pid, start_time)
+    return process if process.poll() is None else None
+
+
+def kill_process(process, grace=KILL_GRACE):
+    """先 terminate，等不到就 kill，最後一定 wait() 避免殭屍"""
+    try:
+        signal_process(process, signal.SIGTERM)
+        try:
+            process.wait(timeout=grace)
+        except subprocess.TimeoutExpired:
+            signal_process(process, getattr(signal, "SIGKILL", signal.SIGTERM))
+            process.wait(timeout=grace)
+    except Exception as e:
+        print(f"[Lobby Error] Killing process failed: {e}")
@@ -0,0 +1,178 @@
+import os
+import time
+import socket
+import threading
+from common.utils import send_json, recv_json
+from server.services import lobby
+from server.services import matchmaking
+from server.services import popularity
+from server.services import prewarm
+from server.services import hosting
+from server.services import sessions
+from server.services import events
+from server.services import metrics
+
+# Lobby 的共享狀態 (房間 / port pool / 線上名單 / 配對佇列 / Game Server process)
+#   單 process：state.call("join_room", ...) 直接呼叫本地函式。
+#   多 worker (main.py --workers N)：主 process 跑 coordinator，持有所有共享狀態與 Game Server，
+#   worker 只處理連線，state.call 經由 Unix socket 轉給 coordinator (length-prefixed JSON，同 common/utils)：
+#     -> {"fn": "join_room", "args": ["3", 2, "alice"]}     <- {"ok": true, "result": {...}}
+#     -> {"fn": "stream"}                                   <- 之後持續推送 EVENT frame (所有 topic)
+#   每個 worker thread 有自己的 coordinator 連線，長時間的呼叫 (開房、配對) 不會互相卡住。
+
+
+class StateError(Exception):
+    pass
+
+
+def _drain_game(game_id):
+    prewarm.drain(game_id=game_id)
+    hosting.drain(game_id=game_id)
+
+
+# 可以遠端呼叫的函式 (名稱 -> 本地實作)
+CALLS = {
+    "create_room": lobby.handle_create_room,
+    "join_room": lobby.handle_join_room,
+    "leave_room": lobby.handle_leave_room,
+    "list_rooms": lobby.handle_list_rooms,
+    "quick_join": lobby.handle_quick_join,
+    "queue_match": matchmaking.handle_queue_match,
+    "is_game_running": lobby.is_game_running,
+    "drain_game": _drain_game,
+    "has_pending_play": popularity.has_pending_play,
+    "claim_login": sessions.claim,
+    "release_login": sessions.release,
+    "publish": events.publish,
+    "stats": metrics.snapshot,
+}
+
+_client = None  # worker 模式下的 CoordinatorClient
+
+
+def is_worker():
+    return _client is not None
+
+
+def call(fn, *args):
+    if _client is None:
+        return CALLS[fn](*args)
+    return _client.call(fn, *args)
+
+
+# ==================== Worker 端 ====================
+
+class CoordinatorClient:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(self.path)
+        return s
+
+    def call(self, fn, *args):
+        # 連線斷掉 (coordinator 重開) 重連一次
+        for attempt in range(2):
+            conn = getattr(self._local, "conn", None)
+            try:
+                if conn is None:
+                    conn = self._local.conn = self._connect()
+                if send_json(conn, {"fn": fn, "args": list(args)}):
+                    reply = recv_json(conn)
+                    if reply is not None:
+                        if not reply.get("ok"):
+                            raise StateError(reply.get("error", "Coordinator call failed."))
+                        return reply.get("result")
+            except OSError:
+                pass
+            if conn is not None:
+                conn.close()
+            self._local.conn = None
+        metrics.incr("state.call_failed")
+        raise StateError(f"Coordinator unreachable ({fn}).")
+
+
+def connect(path):
+    """worker 啟動時呼叫：之後 state.call / events.publish 都轉給 coordinator"""
+    global _client
+    _client = CoordinatorClient(path)
+    events.set_forward(lambda topic, key, op, data: call("publish", topic, key, op, data))
+    # SUBSCRIBE rooms 的快照要跟 coordinator 拿
+    events.register_snapshot(events.TOPIC_ROOMS, lambda topic: call("list_rooms").get("rooms", []))
+    # 開房/玩家數是 coordinator 在累計，worker 的排行榜定期重算
+    popularity.RANKINGS_MAX_AGE = popularity.FLUSH_INTERVAL
+    threading.Thread(target=_stream_loop, args=(path,), daemon=True).start()
+
+
+def _stream_loop(path):
+    """接收 coordinator 推過來的事件，分送給這個 worker 的訂閱者"""
+    while True:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.connect(path)
+                send_json(s, {"fn": "stream"})
+                while True:
+                    frame = recv_json(s)
+                    if frame is None:
+                        break
+                    topic = frame.get("topic")
+                    if topic != events.TOPIC_ROOMS:
+                        # 商城 / 評論有變動，排行榜要重算
+                        popularity.invalidate_rankings()
+                    for ev in frame.get("events", []):
+                        events.deliver(topic, ev.get("id"), ev.get("op"), ev.get("data"))
+        except OSError as e:
+            print(f"[State] Event stream to coordinator lost: {e}")
+        time.sleep(1.0)
+
+
+# ==================== Coordinator 端 ====================
+
+def _serve_conn(conn):
+    with conn:
+        while True:
+            request = recv_json(conn)
+            if request is None:
+                return
+            fn = request.get("fn")
+            if fn == "stream":
+                sub = events.Subscriber(conn, threading.Lock())
+                events.subscribe_all(sub)
+                # 推送由 events 的 thread 負責；這裡只等 worker 斷線
+                while conn.recv(1):
+                    pass
+                events.unsubscribe(sub)
+                return
+            impl = CALLS.get(fn)
+            if impl is None:
+                reply = {"ok": False, "error": f"Unknown call: {fn}"}
+            else:
+                try:
+                    reply = {"ok": True, "result": impl(*request.get("args", []))}
+                except Exception as e:
+                    print(f"[State Error] {fn}: {e}")
+                    reply = {"ok": False, "error": str(e)}
+            if not send_json(conn, reply):
+                return
+
+
+def serve(path):
+    """主 process 呼叫：開始在 Unix socket 上提供共享狀態"""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(128)
+
+    def accept_loop():
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=_serve_conn, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    print(f"[State] Coordinator listening on {path}")
+    return server
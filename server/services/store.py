@@ -1,8 +1,14 @@
 import os
 import base64
+import uuid
 from common.protocol import Protocol
 from .db import db_instance
-from server.services import lobby
+from server.services import pipeline
+from server.services import metrics
+from server.services import popularity
+from server.services import events
+from server.services import state
+from server.services.artifact_cache import artifact_cache
 
 # 設定存放路徑
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -12,6 +18,20 @@ STORAGE_DIR = os.path.join(server_dir, 'storage', 'games')
 if not os.path.exists(STORAGE_DIR):
     os.makedirs(STORAGE_DIR)
 
+metrics.register_source("artifact_cache", artifact_cache.stats)
+
+def _publish_game(op, game_id, name=None, version=None, desc=None):
+    """推播商城變動給訂閱 catalog 的 client"""
+    data = None if op == "removed" else {"id": game_id, "name": name, "version": version, "description": desc}
+    events.publish(events.TOPIC_CATALOG, str(game_id), op, data)
+
+def _save_upload(safe_filename, b64_data):
+    """把上傳內容寫到暫存檔，交給 pipeline 驗證"""
+    upload_path = os.path.join(STORAGE_DIR, f"{safe_filename}.{uuid.uuid4().hex}.part")
+    with open(upload_path, "wb") as f:
+        f.write(base64.b64decode(b64_data))
+    return upload_path
+
 def handle_upload_game(payload, dev_user_id):
     name = payload.get("game_name")
     version = payload.get("version")
@@ -43,25 +63,41 @@ def handle_upload_game(payload, dev_user_id):
         game_id_to_resurrect = game_id
 
     try:
-        # 處理檔案儲存
+        # 處理檔案儲存 (先存成暫存檔，背景驗證通過後才會換成正式檔名)
         filename = f"{name}_{version}.zip"
         safe_filename = "".join([c for c in filename if c.isalpha() or c.isdigit() or c in "._-"])
-        save_path = os.path.join(STORAGE_DIR, safe_filename)
-        
-        with open(save_path, "wb") as f:
-            f.write(base64.b64decode(b64_data))
-            
-        if is_resurrection:
-            # 執行復活：更新資料 + 設定為 Active
-            db_instance.update_game_version(game_id_to_resurrect, version, desc, safe_filename)
-            db_instance.set_game_active(game_id_to_resurrect, True)
-            return {"status": Protocol.STATUS_OK, "message": f"Game '{name}' has been re-published (resurrected)!"}
-        else:
-            # 執行新增
-            if db_instance.add_game(name, version, dev_user_id, desc, safe_filename):
-                return {"status": Protocol.STATUS_OK, "message": "Game uploaded successfully."}
-            else:
-                return {"status": Protocol.STATUS_ERROR, "message": "DB Error."}
+        upload_path = _save_upload(safe_filename, b64_data)
+
+        def publish(promote):
+            if is_resurrection:
+                # 執行復活：驗證期間可能已經被另一個上傳復活了
+                details = db_instance.get_game_details_by_name(name)
+                if not details or details[2]:
+                    return False, f"Game '{name}' was re-published while validating."
+                if not db_instance.update_game_version(game_id_to_resurrect, version, desc, safe_filename):
+                    return False, "DB Error."
+                # 更新資料後才換檔案 + 設定為 Active (同檔名會被覆蓋，清掉舊快取)
+                promote()
+                artifact_cache.invalidate(os.path.join(STORAGE_DIR, safe_filename))
+                db_instance.set_game_active(game_id_to_resurrect, True)
+                popularity.invalidate_rankings()
+                _publish_game("added", game_id_to_resurrect, name, version, desc)
+                return True, f"Game '{name}' has been re-published (resurrected)!"
+            # 執行新增：先以下架狀態佔住名稱 (驗證期間可能已有同名遊戲，包含別的 worker)，檔案就位後才上架
+            if not db_instance.add_game(name, version, dev_user_id, desc, safe_filename, active=False):
+                return False, f"Game Name '{name}' was taken while validating."
+            promote()
+            game_id = db_instance.get_game_details_by_name(name)[0]
+            db_instance.set_game_active(game_id, True)
+            popularity.invalidate_rankings()
+            _publish_game("added", game_id, name, version, desc)
+            return True, "Game uploaded successfully."
+
+        pipeline.submit(dev_user_id, name, version, upload_path, safe_filename, publish)
+        return {
+            "status": Protocol.STATUS_OK,
+            "message": f"Upload received. '{name}' v{version} will be published after validation."
+        }
 
     except Exception as e:
         return {"status": Protocol.STATUS_ERROR, "message": str(e)}
@@ -92,27 +128,41 @@ def handle_update_game(payload, dev_user_id):
     try:
         filename = f"{name}_{new_version}.zip"
         safe_filename = "".join([c for c in filename if c.isalpha() or c.isdigit() or c in "._-"])
-        save_path = os.path.join(STORAGE_DIR, safe_filename)
+        upload_path = _save_upload(safe_filename, b64_data)
 
-        with open(save_path, "wb") as f:
-            f.write(base64.b64decode(b64_data))
+        def publish(promote):
+            old_info = db_instance.get_game_file_info(game_id)
+            # 只有目前版本還是 current_version 才換 (驗證期間可能有另一個更新先上了)
+            if not db_instance.update_game_version(game_id, new_version, desc, safe_filename,
+                                                   expect_version=current_version):
+                return False, f"Game '{name}' was updated by another upload while validating."
+            promote()
+            # 舊版本已被取代，不再需要留在下載快取
+            if old_info:
+                artifact_cache.invalidate(os.path.join(STORAGE_DIR, old_info[0]))
+            popularity.invalidate_rankings()
+            # 舊版本的預熱 / 多房間 Game Server 不再需要 (在 coordinator 那邊)
+            state.call("drain_game", game_id)
+            _publish_game("updated", game_id, name, new_version, desc)
+            return True, f"Game updated to version {new_version}."
 
-        if db_instance.update_game_version(game_id, new_version, desc, safe_filename):
-            return {
-                "status": Protocol.STATUS_OK, 
-                "message": f"Game updated to version {new_version}."
-            }
-        else:
-            return {"status": Protocol.STATUS_ERROR, "message": "DB Error during update."}
+        pipeline.submit(dev_user_id, name, new_version, upload_path, safe_filename, publish)
+        return {
+            "status": Protocol.STATUS_OK, 
+            "message": f"Update received. Version {new_version} will go live after validation."
+        }
 
     except Exception as e:
         return {"status": Protocol.STATUS_ERROR, "message": str(e)}
 
-def handle_list_games():
-    """列出所有上架中的遊戲 (給玩家看)"""
+def handle_list_games(payload=None):
+    """列出所有上架中的遊戲 (給玩家看)，order_by: popular / top_rated / newest"""
+    order_by = (payload or {}).get("order_by") or popularity.ORDER_DEFAULT
+    if order_by not in popularity.ORDERS:
+        return {"status": Protocol.STATUS_ERROR, "message": f"Invalid order_by: {order_by}"}
     try:
-        games = db_instance.get_all_games()
-        return {"status": Protocol.STATUS_OK, "games": games}
+        games = popularity.get_ranked_games(order_by)
+        return {"status": Protocol.STATUS_OK, "games": games, "order_by": order_by}
     except Exception as e:
         return {"status": Protocol.STATUS_ERROR, "message": str(e)}
 
@@ -131,8 +181,9 @@ def handle_download_game(payload):
         return {"status": Protocol.STATUS_ERROR, "message": "Game file missing on server."}
 
     try:
-        with open(full_path, "rb") as f:
-            file_data = base64.b64encode(f.read()).decode('utf-8')
+        # 熱門遊戲直接從記憶體快取拿 (已是 base64)
+        file_data = artifact_cache.get_b64(full_path)
+        popularity.record_download(game_id)
             
         return {
             "status": Protocol.STATUS_OK,
@@ -148,7 +199,11 @@ def handle_list_my_games(dev_user_id):
     """列出該開發者的所有遊戲 (包含已下架)"""
     try:
         games = db_instance.get_games_by_dev(dev_user_id)
-        return {"status": Protocol.STATUS_OK, "games": games}
+        return {
+            "status": Protocol.STATUS_OK,
+            "games": games,
+            "uploads": pipeline.get_upload_status(dev_user_id)
+        }
     except Exception as e:
         return {"status": Protocol.STATUS_ERROR, "message": str(e)}
 
@@ -160,7 +215,7 @@ def handle_unpublish_game(payload, dev_user_id):
         return {"status": Protocol.STATUS_ERROR, "message": "Permission denied: You do not own this game."}
 
     # 2. 檢查房間狀態 (呼叫 lobby 模組)
-    if lobby.is_game_running(game_id):
+    if state.call("is_game_running", game_id):
         return {
             "status": Protocol.STATUS_ERROR, 
             "message": "Cannot unpublish: There are active rooms playing this game. Please wait or close them first."
@@ -168,11 +223,14 @@ def handle_unpublish_game(payload, dev_user_id):
 
     # 3. 執行下架
     if db_instance.set_game_active(game_id, False):
+        popularity.invalidate_rankings()
+        state.call("drain_game", game_id)
+        _publish_game("removed", game_id)
         return {"status": Protocol.STATUS_OK, "message": "Game unpublished successfully."}
     else:
         return {"status": Protocol.STATUS_ERROR, "message": "DB Error."}
 
-def handle_review_game(payload, user_id):
+def handle_review_game(payload, user_id, username=None):
     """處理玩家評論"""
     game_id = payload.get("game_id")
     rating = payload.get("rating")
@@ -189,10 +247,13 @@ def handle_review_game(payload, user_id):
         return {"status": Protocol.STATUS_ERROR, "message": "Invalid rating."}
 
     # 檢查是否有玩過 (未玩先評禁止)
-    if not db_instance.has_played(user_id, game_id):
+    if not (state.call("has_pending_play", user_id, game_id) or db_instance.has_played(user_id, game_id)):
         return {"status": Protocol.STATUS_ERROR, "message": "You must play the game before reviewing."}
 
     if db_instance.add_review(user_id, game_id, rating, comment):
+        popularity.invalidate_rankings()
+        events.publish(f"{events.TOPIC_REVIEWS}{game_id}", None, "added",
+                       {"player": username, "rating": rating, "comment": comment})
         return {"status": Protocol.STATUS_OK, "message": "Review added successfully."}
     else:
         return {"status": Protocol.STATUS_ERROR, "message": "Failed to save review."}
@@ -212,4 +273,8 @@ def handle_get_reviews(payload):
             "average_rating": round(avg_rating, 1)
         }
     except Exception as e:
-        return {"status": Protocol.STATUS_ERROR, "message": str(e)}
\ No newline at end of file
+        return {"status": Protocol.STATUS_ERROR, "message": str(e)}
+
+events.register_snapshot(events.TOPIC_CATALOG, lambda topic: popularity.get_ranked_games(popularity.ORDER_DEFAULT))
+events.register_snapshot(events.TOPIC_REVIEWS,
+                         lambda topic: handle_get_reviews({"game_id": topic[len(events.TOPIC_REVIEWS):]}).get("reviews"))
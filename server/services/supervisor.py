@@ -0,0 +1,168 @@
+import os
+import time
+import signal
+import threading
+import subprocess
+from server.services import metrics
+from server.services import spawner
+
+# Game Server 監督執行緒
+#   - watch(): 追蹤 process，結束時 (正常結束或當掉) 呼叫 on_exit(returncode)
+#   - retire(): 非阻塞關閉，先 terminate，超過 TERM_GRACE 秒還沒結束就 kill，最後一定會被回收 (不留殭屍)
+#   - 定期讀 /proc 取得每個 process 的 CPU% 與 RSS，給 STATS 看
+
+TICK_INTERVAL = 0.5
+TERM_GRACE = float(os.environ.get("LOBBY_TERM_GRACE", 3))
+
+try:
+    _CLK_TCK = os.sysconf("SC_CLK_TCK")
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _CLK_TCK = _PAGE_SIZE = None
+
+
+class _Watch:
+    __slots__ = ("process", "label", "on_exit", "started_at", "cpu_ticks", "sampled_at", "cpu_percent",
+                 "rss_bytes")
+
+    def __init__(self, process, label, on_exit):
+        self.process = process
+        self.label = label
+        self.on_exit = on_exit
+        self.started_at = time.time()
+        self.cpu_ticks = None
+        self.sampled_at = None
+        self.cpu_percent = 0.0
+        self.rss_bytes = 0
+
+
+_watched = {}   # pid -> _Watch
+_retiring = []  # [(process, kill_at)]
+_lock = threading.Lock()
+_thread = None
+
+
+def watch(process, label="", on_exit=None):
+    with _lock:
+        _watched[process.pid] = _Watch(process, label, on_exit)
+
+
+def unwatch(process):
+    with _lock:
+        _watched.pop(process.pid, None)
+
+
+def retire(process, grace=TERM_GRACE):
+    """不等待地關閉 process：terminate，grace 秒後還活著就 kill"""
+    unwatch(process)
+    if process.poll() is None:
+        try:
+            spawner.signal_process(process, signal.SIGTERM)
+        except OSError as e:
+            print(f"[Supervisor] terminate {process.pid} failed: {e}")
+    with _lock:
+        _retiring.append((process, time.monotonic() + grace))
+    metrics.incr("supervisor.retired")
+
+
+def _sample(w, now):
+    """讀 /proc/<pid>/stat 與 statm (Linux)；其他平台略過"""
+    if _CLK_TCK is None:
+        return
+    pid = w.process.pid
+    try:
+        with open(f"/proc/{pid}/stat", 'r') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f"/proc/{pid}/statm", 'r') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return
+    # fields[11], fields[12] = utime, stime (從 state 欄位開始算)
+    ticks = int(fields[11]) + int(fields[12])
+    if w.cpu_ticks is not None and now > w.sampled_at:
+        w.cpu_percent = round((ticks - w.cpu_ticks) / _CLK_TCK / (now - w.sampled_at) * 100, 1)
+    w.cpu_ticks = ticks
+    w.sampled_at = now
+    w.rss_bytes = resident_pages * _PAGE_SIZE
+
+
+def _tick():
+    now = time.monotonic()
+    exited = []
+    with _lock:
+        watches = list(_watched.values())
+        retiring = list(_retiring)
+
+    for w in watches:
+        code = w.process.poll()  # poll() 也會順便回收 (reap)
+        if code is None:
+            _sample(w, now)
+        else:
+            exited.append((w, code))
+
+    still = []
+    for process, kill_at in retiring:
+        if process.poll() is not None:
+            continue
+        if now >= kill_at:
+            try:
+                spawner.signal_process(process, getattr(signal, "SIGKILL", signal.SIGTERM))
+                metrics.incr("supervisor.killed")
+                process.wait(timeout=1)
+                continue
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        still.append((process, kill_at))
+
+    with _lock:
+        done = {id(p) for p, _ in retiring} - {id(p) for p, _ in still}
+        _retiring[:] = [item for item in _retiring if id(item[0]) not in done]
+        for w, _ in exited:
+            _watched.pop(w.process.pid, None)
+
+    for w, code in exited:
+        metrics.incr("supervisor.crashed" if code != 0 else "supervisor.exited")
+        print(f"[Supervisor] {w.label} (pid {w.process.pid}) exited with code {code}")
+        if w.on_exit:
+            try:
+                w.on_exit(code)
+            except Exception as e:
+                print(f"[Supervisor Error] on_exit for {w.label}: {e}")
+
+
+def _loop(interval):
+    while True:
+        try:
+            _tick()
+        except Exception as e:
+            print(f"[Supervisor Error] {e}")
+        time.sleep(interval)
+
+
+def start(interval=TICK_INTERVAL):
+    global _thread
+    if _thread is None:
+        _thread = threading.Thread(target=_loop, args=(interval,), daemon=True)
+        _thread.start()
+    return _thread
+
+
+def stats():
+    now = time.time()
+    with _lock:
+        procs = [{
+            "pid": w.process.pid,
+            "label": w.label,
+            "uptime": round(now - w.started_at, 1),
+            "cpu_percent": w.cpu_percent,
+            "rss_bytes": w.rss_bytes,
+        } for w in _watched.values()]
+        retiring = len(_retiring)
+    return {
+        "processes": procs,
+        "total_rss_bytes": sum(p["rss_bytes"] for p in procs),
+        "retiring": retiring,
+    }
+
+
+metrics.register_source("supervisor", stats)
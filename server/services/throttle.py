@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import struct
+import threading
+from collections import OrderedDict, deque
+from common.protocol import Protocol
+from server.services import metrics
+
+# 流量控制 (每條連線的請求頻率 + 大檔傳輸)
+#   1. 每條連線、每類指令各一個 token bucket：每秒補 rate 個、最多存 burst 個，用完回 ERROR + retry_after (秒)，
+#      不會斷線。rate = 0 表示不限制。PING 不算 (心跳不能被擋)。
+#        interactive：登入、房間、評論等一般指令    catalog：LIST_GAMES / LIST_ROOMS 這類列表
+#        bulk：DOWNLOAD_GAME / UPLOAD_GAME
+#   2. 下載 / 上傳同時最多 MAX_TRANSFERS 個 (每個 process)，滿了就排隊；排隊是每個玩家輪流 (round robin)，
+#      一個人排了很多個也不會擋住其他人。每人同時最多 MAX_TRANSFERS_PER_USER 個，超過直接拒絕。
+#      最多排 TRANSFER_WAIT 秒，之後回 ERROR + retry_after；要比 client 等回覆的時間 (TRANSFER_TIMEOUT) 短很多，
+#      排隊加上控速傳送的時間才不會超過 client 的逾時。
+#   3. 大的回覆 (下載的 ZIP) 切成 CHUNK_SIZE 一塊一塊送，依 TRANSFER_RATE (每個傳輸) 與 TOTAL_BANDWIDTH (全部加起來)
+#      控速，中間會讓出 CPU / 網路給其他連線的小請求。一個 frame 送完前這條連線的推播會等著。
+# 上傳在 recv 時已經收完整個封包 (協定是一個 JSON 一個 frame)，這裡只能限制它後續處理的並行數。
+
+INTERACTIVE = "interactive"
+CATALOG = "catalog"
+BULK = "bulk"
+
+CATALOG_COMMANDS = {Protocol.CMD_LIST_GAMES, Protocol.CMD_LIST_ROOMS, Protocol.CMD_LIST_MY_GAMES,
+                    Protocol.CMD_GET_REVIEWS}
+BULK_COMMANDS = {Protocol.CMD_DOWNLOAD_GAME, Protocol.CMD_UPLOAD_GAME}
+EXEMPT_COMMANDS = {Protocol.CMD_PING}
+
+# (每秒補充, 最多存幾個)
+RATES = {
+    INTERACTIVE: (float(os.environ.get("LOBBY_RATE_INTERACTIVE", 20)), float(os.environ.get("LOBBY_BURST_INTERACTIVE", 40))),
+    CATALOG: (float(os.environ.get("LOBBY_RATE_CATALOG", 5)), float(os.environ.get("LOBBY_BURST_CATALOG", 20))),
+    BULK: (float(os.environ.get("LOBBY_RATE_BULK", 0.2)), float(os.environ.get("LOBBY_BURST_BULK", 3))),
+}
+
+MAX_TRANSFERS = int(os.environ.get("LOBBY_MAX_TRANSFERS", 4))
+MAX_TRANSFERS_PER_USER = int(os.environ.get("LOBBY_MAX_TRANSFERS_PER_USER", 2))
+TRANSFER_WAIT = float(os.environ.get("LOBBY_TRANSFER_WAIT", 10))
+TRANSFER_RETRY_AFTER = 5.0  # 排不到名額時建議 client 幾秒後再試
+
+# bytes/秒，0 = 不限
+TRANSFER_RATE = int(os.environ.get("LOBBY_TRANSFER_RATE", 8 * 1024 * 1024))
+TOTAL_BANDWIDTH = int(os.environ.get("LOBBY_TOTAL_BANDWIDTH", 24 * 1024 * 1024))
+CHUNK_SIZE = 64 * 1024
+PACE_THRESHOLD = 256 * 1024  # 比這小的回覆直接送
+
+WAIT_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30)
+
+
+def classify(cmd):
+    """指令屬於哪一類；不限制的回傳 None"""
+    if cmd in EXEMPT_COMMANDS:
+        return None
+    if cmd in BULK_COMMANDS:
+        return BULK
+    if cmd in CATALOG_COMMANDS:
+        return CATALOG
+    return INTERACTIVE
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, n=1):
+        """夠就扣掉回傳 0；不夠不扣，回傳還要等幾秒"""
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= n:
+                self.tokens -= n
+                return 0.0
+            return (n - self.tokens) / self.rate
+
+    def reserve(self, n):
+        """一定扣 (可以欠)，回傳要先睡幾秒才能送；大家依序排在後面，不會有人一直搶不到"""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= n
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class Limiter:
+    """一條連線的請求頻率限制 (每類指令一個 bucket)"""
+
+    def __init__(self):
+        self.buckets = {cls: TokenBucket(rate, burst) for cls, (rate, burst) in RATES.items() if rate > 0}
+
+    def check(self, cmd):
+        """可以處理回傳 None；超過頻率回傳 ERROR 回覆"""
+        cls = classify(cmd)
+        bucket = self.buckets.get(cls)
+        if bucket is None:
+            return None
+        wait = bucket.try_take()
+        if not wait:
+            return None
+        metrics.incr(f"throttle.limited.{cls}")
+        return {
+            "status": Protocol.STATUS_ERROR,
+            "message": f"Too many requests. Please retry in {wait:.1f}s.",
+            "retry_after": round(wait, 2),
+        }
+
+
+# ---------- 下載 / 上傳並行數 (每人輪流排隊) ----------
+class _Waiter:
+    __slots__ = ("event", "granted")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+_active = 0
+_per_user = {}           # username -> 進行中 + 排隊中
+_queues = OrderedDict()  # username -> deque[_Waiter]，輪到誰就把他移到最後
+_lock = threading.Lock()
+
+
+def acquire_transfer(username, timeout=TRANSFER_WAIT):
+    """取得一個傳輸名額；成功回傳 None，失敗回傳錯誤訊息。成功後一定要 release_transfer()"""
+    global _active
+    with _lock:
+        if _per_user.get(username, 0) >= MAX_TRANSFERS_PER_USER:
+            metrics.incr("throttle.transfer_rejected")
+            return f"You can run at most {MAX_TRANSFERS_PER_USER} downloads/uploads at a time."
+        _per_user[username] = _per_user.get(username, 0) + 1
+        if _active < MAX_TRANSFERS and not _queues:
+            _active += 1
+            return None
+        waiter = _Waiter()
+        _queues.setdefault(username, deque()).append(waiter)
+    metrics.incr("throttle.transfer_queued")
+
+    start = time.monotonic()
+    waiter.event.wait(timeout)
+    with _lock:
+        if not waiter.granted:
+            queue = _queues[username]
+            queue.remove(waiter)
+            if not queue:
+                del _queues[username]
+            _drop_user(username)
+            metrics.incr("throttle.transfer_timeouts")
+            return "Server is busy with other downloads. Please try again later."
+    metrics.observe("throttle.transfer_wait_seconds", time.monotonic() - start, WAIT_BUCKETS)
+    return None
+
+
+def _drop_user(username):
+    count = _per_user.get(username, 0) - 1
+    if count > 0:
+        _per_user[username] = count
+    else:
+        _per_user.pop(username, None)
+
+
+def release_transfer(username):
+    """歸還名額；有人在排隊就交給下一個玩家"""
+    global _active
+    with _lock:
+        _drop_user(username)
+        if _queues:
+            user, queue = next(iter(_queues.items()))
+            waiter = queue.popleft()
+            if queue:
+                _queues.move_to_end(user)
+            else:
+                del _queues[user]
+            waiter.granted = True
+            waiter.event.set()
+        else:
+            _active = max(0, _active - 1)
+
+
+# ---------- 大回覆控速 ----------
+def _bandwidth_bucket(rate):
+    return TokenBucket(rate, max(CHUNK_SIZE, rate / 10)) if rate > 0 else None
+
+
+_total_bucket = _bandwidth_bucket(TOTAL_BANDWIDTH)
+_paced_bytes = 0
+_paced_sleep = 0.0
+
+
+def send_paced(sock, data):
+    """同 send_json，大的回覆分塊控速送出；呼叫端要拿著這條連線的 send lock"""
+    global _paced_bytes, _paced_sleep
+    try:
+        payload = json.dumps(data).encode('utf-8')
+        frame = struct.pack('!I', len(payload)) + payload
+        if len(frame) < PACE_THRESHOLD:
+            sock.sendall(frame)
+            return True
+        own = _bandwidth_bucket(TRANSFER_RATE)
+        view = memoryview(frame)
+        slept = 0.0
+        for offset in range(0, len(frame), CHUNK_SIZE):
+            chunk = view[offset:offset + CHUNK_SIZE]
+            wait = max(own.reserve(len(chunk)) if own else 0.0,
+                       _total_bucket.reserve(len(chunk)) if _total_bucket else 0.0)
+            if wait > 0:
+                time.sleep(wait)
+                slept += wait
+            sock.sendall(chunk)
+        with _lock:
+            _paced_bytes += len(frame)
+            _paced_sleep += slept
+        metrics.observe("throttle.paced_seconds", slept, WAIT_BUCKETS)
+        return True
+    except Exception as e:
+        print(f"[Throttle Error] send failed: {e}")
+        return False
+
+
+def stats():
+    with _lock:
+        return {
+            "rates": {cls: {"rate": rate, "burst": burst} for cls, (rate, burst) in RATES.items()},
+            "transfers_active": _active,
+            "transfers_waiting": sum(len(q) for q in _queues.values()),
+            "transfer_limit": MAX_TRANSFERS,
+            "transfer_rate": TRANSFER_RATE,
+            "total_bandwidth": TOTAL_BANDWIDTH,
+            "paced_bytes": _paced_bytes,
+            "paced_sleep_seconds": round(_paced_sleep, 3),
+        }
+
+
+metrics.register_source("throttle", stats)
@@ -0,0 +1,126 @@
+import os
+import time
+import concurrent.futures
+from server.services import metrics
+from server.services import pipeline
+from server.services import popularity
+from server.services import spawner
+from server.services.artifact_cache import artifact_cache
+from server.services.db import db_instance
+
+# 開機暖身：Lobby 開始接受連線前，先把冷啟動時第一個請求才會做的事做掉
+#   1. 上架中遊戲缺少的 running_games/<版本> 用 process pool 平行解壓 (不然第一次 CREATE_ROOM 要同步解壓)，
+#      再把 game_config.json 讀進 spawner 的快取 (開房的 process 需要；多 worker 時是 coordinator)
+#   2. 重建商城排行 (LIST_GAMES 的排序與平均評分)，每款遊戲的評論讀一次，DB 頁面進 page cache
+#   3. 最熱門的幾款遊戲 ZIP 先載進 artifact_cache (第一次 DOWNLOAD_GAME 不用讀檔)
+# 整個過程最多 WARMUP_TIMEOUT 秒；時間到還沒開始的解壓取消，留給第一次請求 (跟沒暖身時一樣)，
+# 已經在跑的解壓會等它做完才開始接受連線 (不然開房時會跟它同時解壓同一個版本)。
+# 要在開任何背景 thread 之前呼叫 (process pool 在 Linux 是 fork)。
+
+WARMUP_TIMEOUT = float(os.environ.get("LOBBY_WARMUP_TIMEOUT", 20))
+WARMUP_PROCESSES = int(os.environ.get("LOBBY_WARMUP_PROCESSES", min(4, os.cpu_count() or 1)))
+WARM_ARTIFACTS = 5  # 預先載入幾款最熱門遊戲的 ZIP
+
+last_report = None
+
+
+def _active_versions():
+    """[(zip_path, run_dir)]：上架中遊戲目前的版本"""
+    return [(os.path.join(pipeline.STORAGE_DIR, file_path), pipeline.run_dir_for(file_path))
+            for _, file_path in db_instance.get_active_artifacts()]
+
+
+def extract_missing(deadline):
+    """平行解壓還沒解壓的版本，再讀 game_config.json；回傳統計"""
+    versions = _active_versions()
+    jobs = [(zip_path, run_dir) for zip_path, run_dir in versions
+            if not os.path.exists(run_dir) and os.path.exists(zip_path)]
+    result = {"missing": len(jobs), "extracted": 0, "failed": 0, "timed_out": 0, "configs": 0}
+    if jobs:
+        _extract_parallel(jobs, deadline, result)
+    for _, run_dir in versions:
+        if time.monotonic() >= deadline:
+            break
+        if os.path.exists(run_dir):
+            try:
+                spawner.load_game_config(run_dir)
+                result["configs"] += 1
+            except pipeline.ValidationError as e:
+                print(f"[Warmup] {os.path.basename(run_dir)}: {e}")
+    return result
+
+
+def _extract_parallel(jobs, deadline, result):
+    try:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=min(WARMUP_PROCESSES, len(jobs)))
+    except (OSError, NotImplementedError):
+        # 不能開 process (例如沒有 /dev/shm)：改用 thread，解壓大多在等 I/O
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=min(WARMUP_PROCESSES, len(jobs)))
+    futures = {pool.submit(pipeline.extract_artifact, zip_path, run_dir): run_dir for zip_path, run_dir in jobs}
+    try:
+        for future in concurrent.futures.as_completed(futures, timeout=max(0.0, deadline - time.monotonic())):
+            try:
+                future.result()
+                result["extracted"] += 1
+            except Exception as e:
+                result["failed"] += 1
+                print(f"[Warmup] Extract {os.path.basename(futures[future])} failed: {e}")
+    except concurrent.futures.TimeoutError:
+        result["timed_out"] = sum(1 for f in futures if not f.done())
+    finally:
+        # 還沒開始的取消；已經在跑的等它做完 (每個 process 最多一個)
+        pool.shutdown(wait=True, cancel_futures=True)
+    metrics.incr("warmup.extracted", result["extracted"])
+
+
+def warm_caches(deadline):
+    """商城排行 / 評論 / 熱門 ZIP；時間到就停，回傳統計"""
+    result = {"catalog": 0, "reviews": 0, "artifacts": 0, "cut_short": False}
+    games = popularity.rebuild_rankings()[popularity.ORDER_DEFAULT]
+    result["catalog"] = len(games)
+
+    steps = []
+    steps += [("reviews", lambda g=g: len(db_instance.get_game_reviews(g["id"]))) for g in games]
+    for g in popularity.get_ranked_games(popularity.ORDER_POPULAR)[:WARM_ARTIFACTS]:
+        info = db_instance.get_game_file_info(g["id"])
+        if info:
+            path = os.path.join(pipeline.STORAGE_DIR, info[0])
+            steps.append(("artifacts", lambda p=path: 1 if artifact_cache.get_b64(p) else 0))
+
+    for name, step in steps:
+        if time.monotonic() >= deadline:
+            result["cut_short"] = True
+            break
+        try:
+            result[name] += step()
+        except Exception as e:
+            print(f"[Warmup] {name}: {e}")
+    return result
+
+
+def run(extract=True, caches=True, timeout=WARMUP_TIMEOUT):
+    """開機暖身 (最多 timeout 秒)；回傳並記錄統計 (STATS 的 warmup)"""
+    global last_report
+    start = time.monotonic()
+    deadline = start + timeout
+    report = {}
+    if extract:
+        report["extract"] = extract_missing(deadline)
+    if caches:
+        try:
+            report["caches"] = warm_caches(deadline)
+        except Exception as e:
+            print(f"[Warmup Error] {e}")
+            report["caches"] = {"error": str(e)}
+    elapsed = time.monotonic() - start
+    report["seconds"] = round(elapsed, 3)
+    report["complete"] = not (report.get("extract", {}).get("timed_out") or
+                              report.get("caches", {}).get("cut_short"))
+    last_report = report
+    metrics.observe("warmup.seconds", elapsed)
+    print(f"[Warmup] {'Done' if report['complete'] else 'Time limit reached'} in {elapsed:.2f}s: "
+          f"{ {k: v for k, v in report.items() if k not in ('seconds', 'complete')} }")
+    return report
+
+
+metrics.register_source("warmup", lambda: last_report)